@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+On demand access to the members of a BAT result archive.
+
+Rather than extracting every report and image up front, only the
+scandata.pickle is extracted when the archive is opened. Other members
+are looked up through a member-name index and written to the
+extraction directory the first time somebody asks for them.
+
+The archive is read through a seekable file object. For gzip compressed
+archives this is a GzipSeekIndex, which remembers the state of the
+decompressor at regular intervals (seek points, in the spirit of zlib's
+zran.c example) so that any member can be read by seeking to the nearest
+seek point instead of decompressing the archive from the start.
+'''
+
+import os, tarfile, zlib, bz2, threading
+import battrace
+
+
+## Distance in bytes of uncompressed data between two seek points. Each seek
+## point holds a copy of the zlib state (about 40KB, mostly the 32KB window).
+SEEKPOINT_SPACING = 8 * 1024 * 1024
+READ_CHUNKSIZE    = 64 * 1024
+
+
+def openTar( filepath, flags = 'r' ):
+    """
+    Open a BAT result archive, which may or may not be gzip compressed.
+    """
+    try:
+        return tarfile.open( filepath, "%s%s" % (flags,':gz'))
+    except Exception, e:
+        return tarfile.open( filepath, flags)
+
+
+class GzipSeekIndex:
+    """
+    Read only, seekable file object for the uncompressed contents of a
+    gzip file.
+
+    Seek points are recorded the first time the data is decompressed, a
+    seek then restarts decompression from the closest seek point before
+    the wanted offset. Concatenated gzip members are supported.
+    """
+    def __init__(self, fileobj, spacing = SEEKPOINT_SPACING):
+        self.raw     = fileobj
+        self.spacing = spacing
+        ## (compressed offset, uncompressed offset, zlib state or None)
+        self.points  = [(0, 0, None)]
+        self.pos     = 0
+        self._restore(self.points[0])
+
+    def _restore(self, point):
+        (inpos, outpos, d) = point
+        if d is None:
+            self.d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.d = d.copy()
+        self.inpos    = inpos
+        self.outpos   = outpos
+        self.buf      = ''
+        self.bufstart = outpos
+        self.eof      = False
+
+    def _decompressChunk(self):
+        """
+        Feed the next chunk of compressed data to the decompressor and return
+        the output. Sets self.eof when there is no more data.
+        """
+        self.raw.seek(self.inpos)
+        data = self.raw.read(READ_CHUNKSIZE)
+        if data == '':
+            self.eof = True
+            return ''
+        self.inpos += len(data)
+        out = self.d.decompress(data)
+        while self.d.unused_data != '':
+            ## start of the next gzip member, or padding after the last one
+            rest = self.d.unused_data
+            self.d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if rest.strip('\0') == '':
+                self.eof = True
+                break
+            out += self.d.decompress(rest)
+        self.outpos += len(out)
+        battrace.count("gzip.decompressed", len(out))
+        if not self.eof and self.outpos >= self.points[-1][1] + self.spacing:
+            self.points.append((self.inpos, self.outpos, self.d.copy()))
+        return out
+
+    def _seekPoint(self, offset):
+        """
+        Return the last seek point at or before 'offset'.
+        """
+        lo = 0
+        hi = len(self.points)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.points[mid][1] <= offset:
+                lo = mid
+            else:
+                hi = mid
+        return self.points[lo]
+
+    def read(self, size = -1):
+        if self.pos < self.bufstart:
+            self._restore(self._seekPoint(self.pos))
+        elif self.pos > self.outpos:
+            point = self._seekPoint(self.pos)
+            if point[1] > self.outpos:
+                self._restore(point)
+
+        ## skip over data in front of the wanted offset without keeping it
+        while self.pos > self.outpos and not self.eof:
+            self.buf = self._decompressChunk()
+            self.bufstart = self.outpos - len(self.buf)
+
+        ## drop what was read before
+        skip = self.pos - self.bufstart
+        if skip > 0:
+            self.buf = self.buf[skip:]
+            self.bufstart = self.pos
+
+        while (size < 0 or len(self.buf) < size) and not self.eof:
+            self.buf += self._decompressChunk()
+
+        if size < 0:
+            size = len(self.buf)
+        data = self.buf[:size]
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            while not self.eof:
+                self.pos = self.outpos
+                self.read(READ_CHUNKSIZE)
+            offset += self.outpos
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.raw.close()
+
+
+class MemberFile:
+    """
+    Read only file object for one member of an archive, a window of
+    'size' bytes starting at 'offset' in the archive file object.
+    """
+    def __init__(self, archive, offset, size):
+        self.archive = archive
+        self.offset  = offset
+        self.size    = size
+        self.pos     = 0
+
+    def read(self, size = -1):
+        left = self.size - self.pos
+        if size < 0 or size > left:
+            size = left
+        if size <= 0:
+            return ''
+        data = self.archive.readAt(self.offset + self.pos, size)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = min(max(0, offset), self.size)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
+
+
+class BATArchive:
+    """
+    A BAT result archive which extracts its members lazily into 'extractdir'.
+
+    The member index (name -> (offset, size)) is built incrementally and kept
+    for the whole session: looking up a member only reads the archive as far
+    as needed to find it. Looking up a member which is not in the archive reads
+    the index to completion once, after that all lookups are dictionary hits.
+
+    The archive can be used from more than one thread, the methods that read
+    from it hold 'lock' while doing so.
+    """
+    def __init__(self, filepath, extractdir):
+        self.filepath   = filepath
+        self.extractdir = extractdir
+        self.members    = {}   # member name -> (offset of data, size)
+        self.images     = {}   # sha256 -> [member names in images/]
+        self.extracted  = set()
+        self.complete   = False
+        self.lock       = threading.RLock()
+        self.fileobj    = self._openSeekable( filepath )
+        self.tar        = tarfile.open( fileobj = self.fileobj, mode = 'r:' )
+
+    def _openSeekable(self, filepath):
+        raw = open(filepath, 'rb')
+        magic = raw.read(3)
+        raw.seek(0)
+        if magic[:2] == '\x1f\x8b':
+            return GzipSeekIndex(raw)
+        if magic == 'BZh':
+            raw.close()
+            return bz2.BZ2File(filepath, 'r')
+        return raw
+
+    def _addMember(self, ti):
+        if not ti.isreg():
+            return
+        self.members[ti.name] = (ti.offset_data, ti.size)
+        if ti.name.startswith('images/'):
+            sha256sum = os.path.basename(ti.name)[:64]
+            self.images.setdefault(sha256sum, []).append(ti.name)
+
+    def _scanUntil(self, name):
+        """
+        Read more of the archive until the member 'name' was seen, or to the
+        end of the archive when name is None.
+        """
+        while not self.complete:
+            ti = self.tar.next()
+            if ti is None:
+                self.complete = True
+                break
+            ## only our own index is kept, not the TarInfo objects
+            del self.tar.members[:]
+            self._addMember(ti)
+            if name is not None and ti.name == name:
+                break
+        return self.members.get(name)
+
+    def buildIndex(self):
+        """
+        Make sure that the member index covers the whole archive.
+        """
+        with self.lock:
+            self._scanUntil(None)
+
+    def getMember(self, name):
+        """
+        Return (offset, size) of 'name' or None if it is not in the archive.
+        """
+        with self.lock:
+            if self.members.has_key(name):
+                return self.members[name]
+            return self._scanUntil(name)
+
+    def hasMember(self, name):
+        return self.getMember(name) is not None
+
+    def readAt(self, offset, size):
+        with self.lock:
+            self.fileobj.seek(offset)
+            return self.fileobj.read(size)
+
+    def openMember(self, name):
+        """
+        Return a file object for reading the member 'name' straight from the
+        archive, or None if there is no such member.
+        """
+        m = self.getMember(name)
+        if m is None:
+            return None
+        return MemberFile(self, m[0], m[1])
+
+    def readMember(self, name):
+        f = self.openMember(name)
+        if f is None:
+            return None
+        return f.read()
+
+    def localPath(self, name):
+        return os.path.join(self.extractdir, name)
+
+    def extract(self, name):
+        """
+        Extract the member 'name' if that has not happened yet and return the
+        path it was extracted to. None is returned if there is no such member.
+        """
+        with self.lock:
+            if name in self.extracted:
+                return self.localPath(name)
+            f = self.openMember(name)
+            if f is None:
+                return None
+            path = self.localPath(name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            out = open(path, 'wb')
+            while True:
+                data = f.read(READ_CHUNKSIZE)
+                if data == '':
+                    break
+                out.write(data)
+            out.close()
+            self.extracted.add(name)
+            return path
+
+    def extractImages(self, sha256sum, includeStatic = True):
+        """
+        Extract all the pictures that belong to the report for 'sha256sum'.
+        The "TV static" pictures (named <sha256>.png) can be big, they are
+        only extracted when includeStatic is set.
+        """
+        self.buildIndex()
+        for name in list(self.images.get(sha256sum, [])):
+            if not includeStatic and len(os.path.basename(name)) == 68:
+                continue
+            self.extract(name)
+
+    def extractAll(self, predicate):
+        """
+        Extract every member for which predicate(name) is true, in archive order.
+        """
+        self.buildIndex()
+        names = [name for (name,m) in self.members.iteritems()
+                 if name not in self.extracted and predicate(name)]
+        names.sort(key = lambda x: self.members[x][0])
+        for name in names:
+            self.extract(name)
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self.tar.close()
+                self.fileobj.close()
+                self.tar = None
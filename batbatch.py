@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Summaries of BAT result archives without the GUI, for example in CI.
+
+Every archive is loaded the way the viewer does it (the scan data is read
+through the same cached database, the tree is built by battree and the
+filters are applied by a TreeVisibility). A line of JSON is written for
+every archive with the number of files per tag, the ranked files and the
+files that have reports. The archives are done on a pool of processes,
+one archive per process at a time.
+
+The scan data is converted in a temporary directory that is removed
+afterwards, so nothing is written next to the archives unless --cache is
+given. A cache the viewer left next to an archive is used.
+
+  python batbatch.py [-j jobs] [-x tag] [--cache] archive ...
+'''
+
+import sys, os, json, shutil, tempfile, multiprocessing
+from   optparse import OptionParser
+import numpy
+from batarchive import BATArchive
+from batstore   import ScanStore
+from battree    import buildTree, TagColumns, TreeVisibility, FILTERCONFIG
+from batdupes   import DuplicateIndex
+
+## how many of the ranked files are listed, the biggest ones first
+RANKEDCOUNT = 100
+
+
+def reportPages(archive):
+    """
+    Return a dictionary from sha256 checksum to the names of the report
+    pages the archive has for it.
+    """
+    archive.buildIndex()
+    pages = {}
+    for name in archive.members.iterkeys():
+        if not name.startswith('reports/'):
+            continue
+        (sha256sum, sep, page) = os.path.basename(name).partition('-')
+        if sep == '':
+            continue
+        for ext in ('.html.gz', '.gz'):
+            if page.endswith(ext):
+                page = page[:-len(ext)]
+                break
+        pages.setdefault(sha256sum, []).append(page)
+    return pages
+
+
+def summarise(filepath, filters = (), rankedcount = RANKEDCOUNT, cache = False):
+    """
+    Return the summary of the archive 'filepath' as a dictionary. Files
+    with one of the tags in 'filters' are left out, like they are hidden
+    in the viewer; "emptydir" leaves out directories without files. With
+    'cache' the converted scan data is kept next to the archive, like the
+    viewer does.
+    """
+    extractdir = tempfile.mkdtemp()
+    archive = None
+    store = None
+    try:
+        archive = BATArchive( filepath, extractdir )
+        store = ScanStore.open( filepath, lambda: archive.extract('scandata.pickle'), extractdir,
+                                writecache = cache )
+        layout = buildTree( store.iterTreeReports() )
+
+        filtertags = [t for (tags, description) in FILTERCONFIG for t in tags]
+        extracopy = DuplicateIndex( layout.checksums, layout.sizes ).extraCopies( len(layout) )
+        columns = TagColumns( layout.tagcomboids, layout.tagcombos, layout.sizes,
+                              filtertags + list(filters), extracopy )
+        visibility = TreeVisibility( numpy.array(layout.parents, dtype=numpy.intc),
+                                     numpy.array(layout.childstart, dtype=numpy.intc),
+                                     numpy.array(layout.childcount, dtype=numpy.intc), columns )
+        visibility.setFilters( filters, "emptydir" in filters )
+        isdir = numpy.array(layout.isdir, dtype=bool)
+        shown = numpy.flatnonzero(visibility.accepted & ~isdir)
+
+        ## the number of shown files with every tag, counted per
+        ## combination of tags first
+        combocounts = numpy.bincount(numpy.asarray(layout.tagcomboids, dtype=numpy.intp)[shown],
+                                     minlength = len(layout.tagcombos))
+        tagcounts = {}
+        for (combo, count) in zip(layout.tagcombos, combocounts.tolist()):
+            if count == 0:
+                continue
+            for t in combo:
+                tagcounts[t] = tagcounts.get(t, 0) + count
+
+        ranked = [i for i in shown.tolist() if 'ranking' in layout.tagcombos[layout.tagcomboids[i]]]
+        ranked.sort(key = lambda i: -layout.sizes[i])
+
+        pages = reportPages(archive)
+        checksums = {}
+        for (sha256sum, ids) in layout.checksums.iteritems():
+            for i in ids:
+                checksums[i] = sha256sum
+        withreports = []
+        for i in shown.tolist():
+            sha256sum = checksums.get(i)
+            if sha256sum is not None and pages.has_key(sha256sum):
+                withreports.append({'path': layout.paths[i], 'checksum': sha256sum,
+                                    'pages': sorted(pages[sha256sum])})
+
+        return {'archive':     filepath,
+                'files':       int((~isdir).sum()),
+                'directories': int(isdir.sum()),
+                'shown':       len(shown),
+                'filters':     sorted(filters),
+                'tags':        tagcounts,
+                'ranked':      [{'path': layout.paths[i], 'checksum': checksums.get(i),
+                                 'size': layout.sizes[i]} for i in ranked[:rankedcount]],
+                'rankedcount': len(ranked),
+                'reports':     withreports}
+    finally:
+        if store is not None:
+            store.close()
+        if archive is not None:
+            archive.close()
+        shutil.rmtree(extractdir, True)
+
+
+def _summarise(args):
+    (filepath, filters, rankedcount, cache) = args
+    try:
+        return summarise(filepath, filters, rankedcount, cache)
+    except Exception, e:
+        return {'archive': filepath, 'error': "%s" % e}
+
+
+def summariseAll(filepaths, filters = (), rankedcount = RANKEDCOUNT, jobs = None, cache = False):
+    """
+    Yield the summaries of the archives 'filepaths', in that order, made
+    on a pool of 'jobs' processes (one per core by default). The summary
+    of an archive that could not be read only has 'archive' and 'error'.
+    """
+    work = [(f, list(filters), rankedcount, cache) for f in filepaths]
+    if jobs == 1 or len(work) <= 1:
+        for w in work:
+            yield _summarise(w)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for summary in pool.imap(_summarise, work):
+            yield summary
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+if __name__ == "__main__":
+	parser = OptionParser(usage="%prog [options] archive ...")
+	parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs",
+                          help="number of archives done at the same time (default: number of cores)")
+	parser.add_option("-x", "--filter", action="append", dest="filters", default=[],
+                          help="leave out files with this tag, can be given more than once", metavar="TAG")
+	parser.add_option("-r", "--ranked", action="store", type="int", dest="rankedcount",
+                          default=RANKEDCOUNT, help="how many ranked files to list", metavar="N")
+	parser.add_option("-o", "--output", action="store", dest="output",
+                          help="write the summaries to FILE instead of standard output", metavar="FILE")
+	parser.add_option("--cache", action="store_true", dest="cache", default=False,
+                          help="keep the converted scan data next to every archive")
+	(options, args) = parser.parse_args()
+	if args == []:
+		parser.error("no archives given")
+
+	out = sys.stdout
+	if options.output != None:
+		out = open(options.output, 'w')
+	failed = 0
+	for summary in summariseAll(args, options.filters, options.rankedcount, options.jobs, options.cache):
+		if summary.has_key('error'):
+			print >>sys.stderr, "Could not summarise %s: %s" % (summary['archive'], summary['error'])
+			failed += 1
+		out.write(json.dumps(summary, sort_keys=True) + "\n")
+		out.flush()
+	if out is not sys.stdout:
+		out.close()
+	sys.exit(failed > 0)
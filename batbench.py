@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Benchmarks of the viewer on a BAT result archive, without a display.
+
+The main window is created on the Qt offscreen platform and driven through
+the same methods the user interface calls: starting up, opening the archive
+(without the cached scan data and the session, without the session and with
+both), setting up the tree, toggling every filter, searching, selecting
+files and reading report pages and hexdumps. The wall
+clock time and the memory use after every step are written as JSON, with
+the git commit and the parameters, so runs of different commits can be
+compared with --compare.
+
+Without an archive a synthetic one is generated by batgen with a fixed
+seed, so the same arguments give the same archive on every commit.
+
+  python batbench.py -n 100000 -o new.json
+  python batbench.py -n 100000 --compare old.json
+'''
+
+import sys, os, time, json, shutil, tempfile, subprocess, platform, resource
+import ConfigParser
+from optparse import OptionParser
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from batgen   import GeneratorOptions, writeArchive
+from batbatch import reportPages
+from batstore import cachePath
+from batsession import sessionPath, archiveKey
+from battree  import buildTree, FILTERCONFIG
+from PyQt5.QtCore    import QEventLoop, QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication
+
+## how many files are selected and have their pages read
+SAMPLECOUNT = 20
+
+## the queries of the find bar that are timed, see batsearch
+FINDQUERIES = ('file1', 'dir2_*', 'magic:elf', 're:file[0-9]+7$', '')
+
+
+def memoryUsage():
+    """
+    Return (current, peak) resident memory of this process in bytes. The
+    current size is None where /proc is not available.
+    """
+    current = None
+    try:
+        statm = open('/proc/self/statm').read().split()
+        current = int(statm[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kilobytes on Linux, bytes on Mac OS X
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return (current, peak)
+
+
+def gitCommit():
+    scriptdir = os.path.dirname(os.path.realpath(__file__))
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = scriptdir,
+                                       stderr = open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    """
+    Timings of the steps of one run. measure() runs a step 'repeat' times
+    and records the fastest and the median time, and the memory in use
+    after it.
+    """
+    def __init__(self, repeat = 3, log = None):
+        self.repeat  = repeat
+        self.log     = log
+        self.results = {}
+        self.order   = []
+
+    def measure(self, name, function, *args):
+        times = []
+        (before, peak) = memoryUsage()
+        for n in xrange(self.repeat):
+            start = time.time()
+            result = function(*args)
+            times.append(time.time() - start)
+        (after, peak) = memoryUsage()
+        times.sort()
+        self.results[name] = {'seconds': times[0],
+                              'median':  times[len(times) // 2],
+                              'runs':    len(times),
+                              'rss':     after,
+                              'rssdelta': None if after is None or before is None else after - before,
+                              'peak':    peak}
+        self.order.append(name)
+        if self.log is not None:
+            print >>self.log, "%-32s %9.4fs  rss %s" % (name, times[0], formatBytes(after))
+        return result
+
+
+def formatBytes(n):
+    if n is None:
+        return '-'
+    return "%.1fMB" % (n / (1024.0 * 1024))
+
+
+def linkArchive(archivepath, workdir):
+    """
+    Return the path of a link to 'archivepath' in 'workdir', or of a copy
+    where there are no symbolic links. The viewer writes the cached scan
+    data and the session next to the archive, and the benchmarks remove
+    them for the cold runs, so they are run on the link to leave those of
+    the archive itself alone.
+    """
+    linkdir = os.path.join(workdir, 'archive')
+    os.mkdir(linkdir)
+    linkpath = os.path.join(linkdir, os.path.basename(archivepath))
+    if hasattr(os, 'symlink'):
+        os.symlink(os.path.abspath(archivepath), linkpath)
+    else:
+        shutil.copyfile(archivepath, linkpath)
+    return linkpath
+
+
+def waitForLoad(app, gui):
+    """
+    Process events until the archive that is being opened is loaded.
+    """
+    while gui.loader is not None:
+        app.processEvents(QEventLoop.AllEvents, 50)
+        time.sleep(0.001)
+    app.processEvents()
+    if gui.scandata is None:
+        raise IOError("could not load %s" % gui.tarfile)
+
+
+def waitForWebView(app, gui):
+    """
+    Process events until the web view has loaded index.html.
+    """
+    while not gui.webReady:
+        app.processEvents(QEventLoop.AllEvents, 50)
+        time.sleep(0.001)
+
+
+def sampleFiles(gui, count):
+    """
+    Return (files, files with report pages, files with a hexdump): up to
+    'count' paths of each, spread evenly over the scan.
+    """
+    pages = reportPages(gui.archive)
+    files = []
+    withpages = []
+    withhexdumps = []
+    for (path, checksum) in gui.scandata.iterChecksums():
+        if not checksum:
+            continue
+        files.append(path)
+        if pages.has_key(checksum):
+            withpages.append(path)
+            if 'hexdump' in pages[checksum]:
+                withhexdumps.append(path)
+    def spread(paths):
+        paths.sort()
+        step = max(1, len(paths) // count)
+        return paths[::step][:count]
+    return (spread(files), spread(withpages), spread(withhexdumps))
+
+
+def runBenchmarks(archivepath, scriptdir, repeat, log = None):
+    """
+    Run all the benchmarks on 'archivepath' and return the Benchmark. The
+    cached scan data and the session next to 'archivepath' are removed,
+    use linkArchive() for an archive of the user.
+    """
+    bench = Benchmark(1, log)
+    app = QApplication.instance() or QApplication(sys.argv)
+    cachedir = tempfile.mkdtemp()
+    config = ConfigParser.ConfigParser()
+    config.add_section('viewer')
+    config.set('viewer', 'reportcachedir', cachedir)
+    config.set('viewer', 'sessiondir', cachedir)
+
+    ## start up the way "batgui.py -f archive" does: the tree is loaded
+    ## first, the web view is created after that
+    batgui = bench.measure('import batgui', __import__, 'batgui')
+    gui = bench.measure('StartBATGUI', batgui.StartBATGUI, scriptdir)
+    gui.setConfig(config)
+    try:
+        def openArchive(removed):
+            for path in removed:
+                if os.path.exists(path):
+                    os.remove(path)
+            gui.openBATFile(archivepath)
+            waitForLoad(app, gui)
+        sessions = [sessionPath(archivepath),
+                    os.path.join(cachedir, archiveKey(archivepath) + '.session')]
+        bench.measure('openBATFile cold', openArchive, [cachePath(archivepath)] + sessions)
+        bench.measure('web view loaded after tree', waitForWebView, app, gui)
+        bench.repeat = repeat
+        bench.measure('openBATFile without session', openArchive, sessions)
+        bench.measure('openBATFile', openArchive, [])
+
+        def setup(layout):
+            gui.treemodel.setLayout(layout)
+            gui.setupFromBAT(layout)
+        bench.measure('setupFromBAT', setup, buildTree(gui.scandata.iterTreeReports()))
+
+        for (tags, description) in FILTERCONFIG:
+            def toggle(filters):
+                gui.filters = filters
+                gui.proxyModel.filterChanged()
+                gui.expandTree()
+            bench.measure('filter on %s' % tags[0], toggle, list(tags))
+            bench.measure('filter off %s' % tags[0], toggle, [])
+
+        for query in FINDQUERIES:
+            bench.measure('setFind %r' % query, gui.setFind, query)
+
+        (files, withpages, withhexdumps) = sampleFiles(gui, SAMPLECOUNT)
+        def selectAll(paths):
+            for path in paths:
+                gui.selectAndDisplay(path)
+        bench.measure('selectAndDisplay x%d' % len(files), selectAll, files)
+
+        def readPages(paths, cold):
+            if cold:
+                gui.pagecache.clear()
+                if gui.reportcache is not None:
+                    gui.reportcache.clear()
+            for path in paths:
+                gui.getPage(path, 'guireport')
+        bench.measure('getPage cold x%d' % len(withpages), readPages, withpages, True)
+        bench.measure('getPage warm x%d' % len(withpages), readPages, withpages, False)
+
+        def readHexdumps(paths):
+            for report in gui.hexdumps.itervalues():
+                report.close()
+            gui.hexdumps.clear()
+            for path in paths:
+                gui.getHexdump(path, 'hexdump')
+        bench.measure('getHexdump x%d' % len(withhexdumps), readHexdumps, withhexdumps)
+    finally:
+        gui.close()
+        app.processEvents()
+        shutil.rmtree(cachedir, True)
+    return bench
+
+
+def compare(old, new, out):
+    """
+    Write the times of the runs 'old' and 'new' next to each other, with
+    the ratio new/old.
+    """
+    print >>out, "%-32s %10s %10s %7s" % ("", (old.get('commit') or '')[:10],
+                                          (new.get('commit') or '')[:10], "ratio")
+    for name in new['order']:
+        n = new['results'][name]['seconds']
+        if not old['results'].has_key(name):
+            print >>out, "%-32s %10s %9.4fs" % (name, '-', n)
+            continue
+        o = old['results'][name]['seconds']
+        ratio = '-'
+        if o > 0:
+            ratio = "%.2f" % (n / o)
+        print >>out, "%-32s %9.4fs %9.4fs %7s" % (name, o, n, ratio)
+
+
+if __name__ == "__main__":
+	parser = OptionParser(usage="%prog [options] [archive]")
+	defaults = GeneratorOptions()
+	parser.add_option("-n", "--files", action="store", type="int", dest="files", default=defaults.files,
+                          help="number of files of the generated archive (default %default)")
+	parser.add_option("-s", "--seed", action="store", type="int", dest="seed", default=defaults.seed,
+                          help="random seed of the generated archive (default %default)")
+	parser.add_option("-r", "--repeat", action="store", type="int", dest="repeat", default=3,
+                          help="how many times every step is run (default %default)")
+	parser.add_option("-k", "--keep", action="store", dest="keep",
+                          help="keep the generated archive as FILE, or use it if it exists", metavar="FILE")
+	parser.add_option("-o", "--output", action="store", dest="output",
+                          help="write the results to FILE", metavar="FILE")
+	parser.add_option("--compare", action="store", dest="compare",
+                          help="compare the results with an earlier run", metavar="FILE")
+	(options, args) = parser.parse_args()
+	if len(args) > 1:
+		parser.error("more than one archive given")
+
+	scriptdir = os.path.dirname(os.path.realpath(__file__))
+	workdir = tempfile.mkdtemp()
+	genoptions = None
+	try:
+		if args != []:
+			archivepath = os.path.abspath(args[0])
+		else:
+			genoptions = GeneratorOptions(options.files, seed = options.seed)
+			archivepath = options.keep or os.path.join(workdir, 'bench.tar.gz')
+			if not os.path.exists(archivepath):
+				print >>sys.stderr, "generating %d files in %s" % (options.files, archivepath)
+				writeArchive(archivepath, genoptions)
+
+		bench = runBenchmarks(linkArchive(archivepath, workdir), scriptdir, options.repeat, sys.stderr)
+	finally:
+		shutil.rmtree(workdir, True)
+
+	results = {'commit':   gitCommit(),
+	           'python':   platform.python_version(),
+	           'qt':       QT_VERSION_STR,
+	           'platform': platform.platform(),
+	           'archive':  None if genoptions is not None else archivepath,
+	           'generator': None if genoptions is None else genoptions.__dict__,
+	           'repeat':   options.repeat,
+	           'order':    bench.order,
+	           'results':  bench.results}
+	if options.output != None:
+		out = open(options.output, 'w')
+		json.dump(results, out, sort_keys=True, indent=1)
+		out.close()
+	if options.compare != None:
+		compare(json.load(open(options.compare)), results, sys.stdout)
+	elif options.output is None:
+		json.dump(results, sys.stdout, sort_keys=True, indent=1)
+		print
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Cache of rendered report pages, and a thread that fills it in advance for
+the files next to the selected one. Below that a cache on disk keeps the
+decompressed reports by checksum, for all archives and sessions. This
+module does not depend on Qt.
+'''
+
+import os, re, time, sqlite3, threading, collections
+
+## default limits of a PageCache
+PAGECACHE_MAXBYTES   = 64 * 1024 * 1024
+PAGECACHE_MAXENTRIES = 512
+
+## default size limit of a ReportCache
+REPORTCACHE_MAXBYTES = 512 * 1024 * 1024
+
+## what can be used as the name of a page in a ReportCache
+PAGENAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+SHA256SUM = re.compile(r'^[0-9a-f]{64}$')
+
+
+def defaultReportCacheDir():
+    cachehome = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cachehome, 'batgui', 'reports')
+
+
+class PageCache:
+    """
+    Least recently used cache of rendered pages, keyed by (sha256, page).
+    At most 'maxentries' pages are kept, together no bigger than 'maxbytes'.
+
+    clear() starts a new generation. put() for a page that was rendered in
+    an earlier generation (as passed by the caller) is ignored, so a page
+    rendered for an archive that was closed meanwhile is not kept.
+    """
+    def __init__(self, maxbytes = PAGECACHE_MAXBYTES, maxentries = PAGECACHE_MAXENTRIES):
+        self.maxbytes   = maxbytes
+        self.maxentries = maxentries
+        self.pages      = collections.OrderedDict()
+        self.size       = 0
+        self.generation = 0
+        self.hits       = 0
+        self.misses     = 0
+        self.lock       = threading.Lock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, key):
+        return key in self.pages
+
+    def get(self, key):
+        """
+        Return the page for 'key' or None, and count the hit or miss.
+        """
+        with self.lock:
+            page = self.pages.pop(key, None)
+            if page is None:
+                self.misses += 1
+                return None
+            self.pages[key] = page
+            self.hits += 1
+            return page
+
+    def put(self, key, page, generation = None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            if len(page) > self.maxbytes:
+                return
+            if self.pages.has_key(key):
+                self.size -= len(self.pages.pop(key))
+            self.pages[key] = page
+            self.size += len(page)
+            while self.size > self.maxbytes or len(self.pages) > self.maxentries:
+                (k, old) = self.pages.popitem(last = False)
+                self.size -= len(old)
+
+    def setLimits(self, maxbytes, maxentries):
+        self.maxbytes   = maxbytes
+        self.maxentries = maxentries
+        with self.lock:
+            while self.pages and (self.size > self.maxbytes or len(self.pages) > self.maxentries):
+                (k, old) = self.pages.popitem(last = False)
+                self.size -= len(old)
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+            self.size = 0
+            self.generation += 1
+
+    def stats(self):
+        return "%d pages, %d bytes, %d hits, %d misses" % (len(self.pages), self.size,
+                                                           self.hits, self.misses)
+
+
+class PagePrefetcher(threading.Thread):
+    """
+    Renders pages into a PageCache on a background thread. render(sha256,
+    page) returns the page or None if there is no such page. Only the last
+    list of pages given to prefetch() is worked on.
+    """
+    def __init__(self, cache, render):
+        threading.Thread.__init__(self)
+        self.daemon    = True
+        self.cache     = cache
+        self.render    = render
+        self.pending   = []
+        self.stopped   = False
+        self.rendering = False
+        self.prefetched = 0
+        self.condition = threading.Condition()
+
+    def prefetch(self, keys):
+        with self.condition:
+            self.pending = list(keys)
+            self.condition.notifyAll()
+
+    def cancel(self):
+        """
+        Drop the pages that are still to be rendered and wait until the
+        page that is being rendered, if any, is done. After that render()
+        is not called until prefetch() is called again.
+        """
+        with self.condition:
+            self.pending = []
+            while self.rendering:
+                self.condition.wait()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending = []
+            self.condition.notifyAll()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                key = self.pending.pop(0)
+                if key in self.cache:
+                    continue
+                self.rendering = True
+            generation = self.cache.generation
+            try:
+                page = self.render(*key)
+            except Exception, e:
+                ## the report is broken; it is rendered (and the error
+                ## shown) when it is asked for
+                page = None
+            if page is not None:
+                self.cache.put(key, page, generation)
+                self.prefetched += 1
+            with self.condition:
+                self.rendering = False
+                self.condition.notifyAll()
+
+
+class ReportCache:
+    """
+    Reports on disk in 'cachedir', keyed by the sha256 checksum of the file
+    they are about and the name of the page. As the checksum identifies the
+    contents, a report is the same in every archive it is in, so the cache
+    is shared by all archives and sessions. When the reports together get
+    bigger than 'maxbytes' the least recently used ones are removed.
+
+    An index in SQLite keeps the size and last use of every report, and
+    their total size. The last uses are written to it in batches. It can
+    be used from more than one thread, and by more than one process.
+    """
+
+    ## how many uses are kept in memory before they are written to the index
+    USEDBATCH = 64
+
+    def __init__(self, cachedir, maxbytes = REPORTCACHE_MAXBYTES):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        self.hits     = 0
+        self.misses   = 0
+        ## key -> time of the last use, not written to the index yet
+        self.used     = {}
+        self.lock     = threading.Lock()
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.db = sqlite3.connect(os.path.join(cachedir, 'index.sqlite'),
+                                  timeout = 10, check_same_thread = False)
+        self.db.text_factory = str
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS reports "
+                        "(key TEXT PRIMARY KEY, size INTEGER, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS reports_used ON reports (used)")
+        ## the total size of the reports, kept up to date with every change
+        ## so it does not have to be summed over the whole index
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("INSERT OR IGNORE INTO meta SELECT 'total', TOTAL(size) FROM reports")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self._flushUsed()
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+    def _key(self, sha256sum, page):
+        if SHA256SUM.match(sha256sum) is None or PAGENAME.match(page) is None:
+            return None
+        return "%s-%s" % (sha256sum, page)
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def _total(self):
+        return self.db.execute("SELECT value FROM meta WHERE name = 'total'").fetchone()[0]
+
+    def _addTotal(self, delta):
+        self.db.execute("UPDATE meta SET value = value + ? WHERE name = 'total'", (delta,))
+
+    def _delete(self, key):
+        """
+        Remove 'key' from the index, the file is left alone.
+        """
+        row = self.db.execute("SELECT size FROM reports WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM reports WHERE key = ?", (key,))
+            self._addTotal(-row[0])
+        self.used.pop(key, None)
+
+    def _flushUsed(self):
+        """
+        Write the times of the last use that were kept in memory to the index.
+        """
+        if self.used:
+            self.db.executemany("UPDATE reports SET used = ? WHERE key = ?",
+                                [(used, key) for (key, used) in self.used.iteritems()])
+            self.used.clear()
+
+    def get(self, sha256sum, page):
+        """
+        Return the report 'page' for sha256sum, or None if it is not cached.
+        The time of the use is written to the index with the next put(), or
+        after USEDBATCH uses.
+        """
+        key = self._key(sha256sum, page)
+        with self.lock:
+            if key is None or self.db is None:
+                return None
+            row = self.db.execute("SELECT size FROM reports WHERE key = ?", (key,)).fetchone()
+            data = None
+            if row is not None:
+                try:
+                    f = open(self._path(key), 'rb')
+                    try:
+                        data = f.read()
+                    finally:
+                        f.close()
+                except IOError:
+                    ## removed behind our back
+                    self._delete(key)
+                    self.db.commit()
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.used[key] = time.time()
+            if len(self.used) >= self.USEDBATCH:
+                self._flushUsed()
+                self.db.commit()
+            return data
+
+    def put(self, sha256sum, page, data):
+        key = self._key(sha256sum, page)
+        with self.lock:
+            if key is None or self.db is None or len(data) > self.maxbytes:
+                return
+            path = self._path(key)
+            tmppath = path + '.tmp%d' % os.getpid()
+            try:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                f = open(tmppath, 'wb')
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+                os.rename(tmppath, path)
+            except (IOError, OSError):
+                ## the cache is full or not writable, the report is just not kept
+                return
+            self._delete(key)
+            self.db.execute("INSERT INTO reports VALUES (?, ?, ?)", (key, len(data), time.time()))
+            self._addTotal(len(data))
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        total = self._total()
+        if total <= self.maxbytes:
+            return
+        ## the order of the last uses has to be right
+        self._flushUsed()
+        evicted = []
+        for (key, size) in self.db.execute("SELECT key, size FROM reports ORDER BY used"):
+            if total <= self.maxbytes:
+                break
+            evicted.append(key)
+            total -= size
+        for key in evicted:
+            self._delete(key)
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def setLimit(self, maxbytes):
+        with self.lock:
+            self.maxbytes = maxbytes
+            if self.db is not None:
+                self._evict()
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.maxbytes, maxbytes = 0, self.maxbytes
+            self._evict()
+            self.db.commit()
+            self.maxbytes = maxbytes
+
+    def stats(self):
+        with self.lock:
+            count = self.db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+            total = self._total()
+        return "%s: %d reports, %d bytes of %d, %d hits, %d misses" % (self.cachedir, count, total,
+                                                                     self.maxbytes, self.hits, self.misses)
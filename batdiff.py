@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Differences between two scans, for comparing firmware revisions. This
+module does not depend on Qt.
+
+Files are matched on their sha256 checksum rather than only on their path:
+a file that is not at the same path anymore, but has the same contents as
+a file that disappeared, was moved. The files with a checksum are joined
+with a dictionary, so this takes time linear in the size of both scans.
+'''
+
+ADDED     = 'added'
+REMOVED   = 'removed'
+CHANGED   = 'changed'
+MOVED     = 'moved'
+UNCHANGED = 'unchanged'
+DIFFSTATES = (ADDED, REMOVED, CHANGED, MOVED, UNCHANGED)
+
+## the tags the files in a compared tree get, so the diff can be shown
+## and filtered like any other tag
+DIFFTAGS = dict((state, 'diff:' + state) for state in DIFFSTATES)
+
+
+class ScanDiff:
+    """
+    The differences between the scans 'old' and 'new', both iterables of
+    (path, checksum) for every file. The checksum is '' or None for files
+    without one, those are only compared on their path.
+
+    status[path] is one of ADDED, CHANGED, MOVED or UNCHANGED for every
+    path of the new scan, and REMOVED for the paths of the old scan which
+    are not in the new one. movedfrom[path] is the old path of a moved file.
+    """
+    def __init__(self, old, new):
+        old = dict(old)
+        new = dict(new)
+        self.status    = {}
+        self.movedfrom = {}
+
+        ## the old files that are not at the same path anymore, by checksum
+        gone = {}
+        for (path, checksum) in old.iteritems():
+            if not new.has_key(path):
+                self.status[path] = REMOVED
+                if checksum:
+                    gone.setdefault(checksum, []).append(path)
+        for paths in gone.itervalues():
+            paths.sort(reverse = True)
+
+        ## the new files that are not at an old path, in order of their
+        ## path so they are paired with the gone files in the same order
+        arrived = []
+        for (path, checksum) in new.iteritems():
+            if old.has_key(path):
+                if (old[path] or '') == (checksum or ''):
+                    self.status[path] = UNCHANGED
+                else:
+                    self.status[path] = CHANGED
+            elif checksum and gone.has_key(checksum):
+                arrived.append(path)
+            else:
+                self.status[path] = ADDED
+        arrived.sort()
+        for path in arrived:
+            paths = gone[new[path]]
+            if paths == []:
+                self.status[path] = ADDED
+                continue
+            oldpath = paths.pop()
+            self.status[path] = MOVED
+            self.movedfrom[path] = oldpath
+            del self.status[oldpath]
+
+    def __len__(self):
+        return len(self.status)
+
+    def counts(self):
+        """
+        Return a dictionary with the number of files in every state.
+        """
+        counts = dict((state, 0) for state in DIFFSTATES)
+        for state in self.status.itervalues():
+            counts[state] += 1
+        return counts
+
+    def summary(self):
+        counts = self.counts()
+        return ", ".join("%d %s" % (counts[state], state) for state in DIFFSTATES)
+
+    def treeReports(self, newreports, oldreports):
+        """
+        Yield (path, report) for the tree of both scans, for battree.buildTree:
+        the reports of the new scan and of the removed files of the old scan,
+        with the tag for their state added. newreports and oldreports are
+        iterables of (path, report) like ScanStore.iterTreeReports().
+
+        The removed files are left without their checksum: their reports and
+        scans are only in the old archive, so they are not grouped with the
+        copies in the new one.
+        """
+        for (path, report) in newreports:
+            yield (path, self._tagged(path, report))
+        for (path, report) in oldreports:
+            if self.status.get(path) == REMOVED:
+                report = dict(report)
+                report.pop('checksum', None)
+                yield (path, self._tagged(path, report))
+
+    def _tagged(self, path, report):
+        state = self.status.get(path)
+        if state is not None:
+            report['tags'] = list(report.get('tags') or []) + [DIFFTAGS[state]]
+        return report
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Index of the copies of every file in a scan, by sha256 checksum. This
+module does not depend on Qt.
+
+The groups come from TreeLayout.checksums, which is filled while the tree
+is built, so finding the other copies of a file is a dictionary lookup
+instead of a walk over the whole tree. The nodes are numbered level by
+level, so the first node of a group is the copy closest to the top.
+
+The same groups can be kept in a ChecksumGroups, three arrays which are
+written to a session file by batsession and mapped from it again.
+'''
+
+import itertools
+import numpy
+
+HEXDIGITS = frozenset('0123456789abcdef')
+
+
+class ChecksumGroups:
+    """
+    Read only mapping from sha256 checksum to the increasing ids of the
+    nodes with that checksum, in arrays instead of a dictionary of lists.
+    'digests' holds the distinct checksums as sorted 32 byte digests, the
+    ids of digests[k] are nodes[starts[k]:starts[k+1]]. The parts of the
+    dictionary interface that the indexes use are there, the values are
+    lists of ids.
+    """
+    def __init__(self, digests, starts, nodes):
+        self.digests = digests
+        self.starts  = starts
+        self.nodes   = nodes
+
+    @classmethod
+    def fromDict(cls, checksums):
+        """
+        Return the ChecksumGroups of a dictionary like TreeLayout.checksums.
+        Raises TypeError or ValueError if a checksum is not 64 hexadecimal
+        digits.
+        """
+        shas = ''.join(checksums.iterkeys())
+        if len(shas) != 64 * len(checksums):
+            raise ValueError("checksum that is not a sha256")
+        digests = numpy.frombuffer(shas.decode('hex'), dtype='S32')
+        counts = numpy.fromiter((len(ids) for ids in checksums.itervalues()),
+                                dtype=numpy.int32, count = len(checksums))
+        nodes = numpy.fromiter(itertools.chain.from_iterable(checksums.itervalues()),
+                               dtype=numpy.int32, count = int(counts.sum()))
+
+        ## sort the groups on their digest
+        order = numpy.argsort(digests, kind = 'mergesort')
+        firsts = numpy.cumsum(counts) - counts
+        counts = counts[order]
+        starts = numpy.zeros(len(counts) + 1, dtype=numpy.int32)
+        numpy.cumsum(counts, out = starts[1:])
+        moved = numpy.repeat(firsts[order] - starts[:-1], counts)
+        nodes = nodes[moved + numpy.arange(len(nodes), dtype=numpy.int32)]
+        return cls(digests[order], starts, nodes)
+
+    def _digest(self, k):
+        ## NumPy drops the trailing zero bytes of the elements of S32
+        return self.digests[k].ljust(32, '\0')
+
+    def _find(self, sha256sum):
+        try:
+            digest = sha256sum.decode('hex')
+        except (TypeError, ValueError, UnicodeError):
+            return -1
+        if len(digest) != 32:
+            return -1
+        k = int(numpy.searchsorted(self.digests, digest))
+        if k < len(self.digests) and self._digest(k) == digest:
+            return k
+        return -1
+
+    def _ids(self, k):
+        return self.nodes[self.starts[k]:self.starts[k + 1]].tolist()
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __contains__(self, sha256sum):
+        return self._find(sha256sum) >= 0
+
+    has_key = __contains__
+
+    def __getitem__(self, sha256sum):
+        k = self._find(sha256sum)
+        if k < 0:
+            raise KeyError(sha256sum)
+        return self._ids(k)
+
+    def get(self, sha256sum, default = None):
+        k = self._find(sha256sum)
+        if k < 0:
+            return default
+        return self._ids(k)
+
+    def __iter__(self):
+        for k in xrange(len(self.digests)):
+            yield self._digest(k).encode('hex')
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        for k in xrange(len(self.digests)):
+            yield self._ids(k)
+
+    def iteritems(self):
+        for k in xrange(len(self.digests)):
+            yield (self._digest(k).encode('hex'), self._ids(k))
+
+    def withPrefix(self, prefix):
+        """
+        Return the array of the ids of the nodes with a checksum that
+        starts with the hexadecimal 'prefix'. The groups are sorted, so
+        those are one run of 'nodes'.
+        """
+        prefix = prefix.lower()
+        if len(prefix) > 64 or not HEXDIGITS.issuperset(prefix):
+            return self.nodes[:0]
+        first = numpy.searchsorted(self.digests, (prefix + '0' * (64 - len(prefix))).decode('hex'), 'left')
+        last  = numpy.searchsorted(self.digests, (prefix + 'f' * (64 - len(prefix))).decode('hex'), 'right')
+        return self.nodes[self.starts[first]:self.starts[last]]
+
+    def extraCopies(self, count):
+        """
+        Like DuplicateIndex.extraCopies, on the arrays.
+        """
+        extra = numpy.zeros(count, dtype=bool)
+        later = numpy.ones(len(self.nodes), dtype=bool)
+        later[self.starts[:-1]] = False
+        extra[self.nodes[later]] = True
+        return extra
+
+
+class DuplicateIndex:
+    """
+    The copies of every file. 'checksums' maps a sha256 checksum to the
+    node ids with that checksum and sizes[i] is the size of node i, as in
+    a battree.TreeLayout.
+    """
+    def __init__(self, checksums, sizes):
+        ## the ids of a group are in increasing order, they were added
+        ## while numbering the nodes
+        self.checksums = checksums
+        self.sizes     = sizes
+
+    def __len__(self):
+        return len(self.checksums)
+
+    def copies(self, sha256sum):
+        """
+        Return [(node id, size)] of all the files with checksum sha256sum.
+        """
+        return [(i, int(self.sizes[i])) for i in self.checksums.get(sha256sum, [])]
+
+    def copyCount(self, sha256sum):
+        return len(self.checksums.get(sha256sum, []))
+
+    def nextCopy(self, sha256sum, node):
+        """
+        Return the node id of the copy after 'node' with checksum
+        sha256sum, going back to the first one after the last. Returns -1
+        if there is no other copy.
+        """
+        ids = self.checksums.get(sha256sum, [])
+        if len(ids) < 2:
+            return -1
+        n = numpy.searchsorted(ids, node, 'right')
+        return ids[n % len(ids)]
+
+    def extraCopies(self, count):
+        """
+        Return a bool array for 'count' nodes which is True for every copy
+        of a file but the first, for showing each unique file once.
+        """
+        if isinstance(self.checksums, ChecksumGroups):
+            return self.checksums.extraCopies(count)
+        extra = numpy.zeros(count, dtype=bool)
+        groups = [ids[1:] for ids in self.checksums.itervalues() if len(ids) > 1]
+        if groups != []:
+            extra[numpy.concatenate(groups)] = True
+        return extra
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Generator of synthetic BAT result archives, for testing and benchmarking
+the viewer at scale without real scans. This module does not depend on Qt.
+
+The archive has the layout BAT writes: scandata.pickle with a report for
+every file, reports/<sha256>-<page>.html.gz pages, reports/<sha256>-hexdump.gz
+hexdumps in "hexdump -Cv" format and images/<sha256>-piechart.png pictures.
+The same seed always gives the same archive.
+
+  python batgen.py -n 100000 -o scan-100k.tar.gz
+'''
+
+import sys, os, gzip, random, hashlib, tarfile, time, cPickle, StringIO
+from optparse import OptionParser
+
+## (tags, magic, weight) of the kinds of files that are generated
+FILEKINDS = [(['elf', 'binary'], 'ELF 32-bit LSB executable, ARM, version 1 (SYSV)', 20),
+             (['elf', 'binary', 'ranking'], 'ELF 32-bit LSB shared object, ARM, version 1 (SYSV)', 10),
+             (['text'], 'ASCII text', 25),
+             (['text', 'xml'], 'XML document text', 5),
+             (['graphics', 'png'], 'PNG image data, 64 x 64, 8-bit/color RGBA, non-interlaced', 8),
+             (['graphics', 'gif'], 'GIF image data, version 89a, 16 x 16', 2),
+             (['compressed', 'gzip'], 'gzip compressed data, max compression', 5),
+             (['resource'], 'data', 5),
+             (['audio', 'mp3'], 'Audio file with ID3 version 2.3.0', 1),
+             (['pdf'], 'PDF document, version 1.4', 1),
+             (['static'], 'data', 3),
+             (['linuxkernel'], 'Linux kernel ARM boot executable zImage (little-endian)', 1),
+             (['symlink'], "symbolic link to `../lib/libc.so.0'", 8),
+             ([], 'data', 6)]
+
+## the report pages of a file with reports
+REPORTPAGES = ('guireport', 'unique', 'assigned', 'unmatched', 'names', 'functionnames', 'elfreport')
+
+## the biggest hexdump that is written, bytes of the file
+HEXDUMPMAXBYTES = 64 * 1024
+
+## the printable characters of a hexdump, the others are shown as '.'
+PRINTABLE = ''.join(chr(c) if 32 <= c < 127 else '.' for c in range(256))
+
+
+class GeneratorOptions:
+    """
+    What is generated. 'files' files are spread over directories 'depth'
+    deep with 'fanout' subdirectories each. 'duplicates' of the files are
+    copies of another file, 'empty' are empty, 'reports' have report pages
+    and 'hexdumps' of those also have a hexdump. Sizes are spread log-uniform
+    between 'minsize' and 'maxsize'.
+    """
+    def __init__(self, files = 10000, depth = 5, fanout = 8, seed = 1, duplicates = 0.15,
+                 empty = 0.02, reports = 0.2, hexdumps = 0.02, minsize = 16, maxsize = 4 * 1024 * 1024):
+        self.files      = files
+        self.depth      = depth
+        self.fanout     = fanout
+        self.seed       = seed
+        self.duplicates = duplicates
+        self.empty      = empty
+        self.reports    = reports
+        self.hexdumps   = hexdumps
+        self.minsize    = minsize
+        self.maxsize    = maxsize
+
+
+def hexdumpC(data):
+    """
+    Return 'data' formatted like "hexdump -Cv" does, one row for every 16
+    bytes and the size on the last row.
+    """
+    out = []
+    for off in xrange(0, len(data), 16):
+        row = data[off:off + 16]
+        digits = row.encode('hex')
+        first = ' '.join(digits[n:n + 2] for n in xrange(0, min(len(digits), 16), 2))
+        second = ' '.join(digits[n:n + 2] for n in xrange(16, len(digits), 2))
+        out.append('%08x  %-23s  %-23s  |%s|\n' % (off, first, second, row.translate(PRINTABLE)))
+    if data:
+        out.append('%08x\n' % len(data))
+    return ''.join(out)
+
+
+def fileContents(n, size):
+    """
+    Return the first 'size' bytes of the contents of file number 'n': some
+    runs of zeroes, text and random bytes, so the hexdump looks realistic.
+    """
+    r = random.Random(n)
+    pieces = []
+    total = 0
+    while total < size:
+        kind = r.random()
+        length = min(size - total, r.randint(16, 4096))
+        if kind < 0.2:
+            piece = '\0' * length
+        elif kind < 0.5:
+            piece = ('file %d: the quick brown fox jumps over the lazy dog\n' % n) * (length // 40 + 1)
+        else:
+            piece = ('%0*x' % (length * 2, r.getrandbits(length * 8))).decode('hex')
+        pieces.append(piece[:length])
+        total += length
+    return ''.join(pieces)
+
+
+def gzipped(data):
+    buf = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj = buf, mode = 'wb', mtime = 0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def reportPage(sha256sum, page, path):
+    html = ['<h2>%s</h2>' % page, '<p>Report for <b>%s</b></p>' % path]
+    if page == 'guireport':
+        html.append('<img src="REPLACEME/%s-piechart.png"/>' % sha256sum)
+    html.append('<table>')
+    for n in xrange(40):
+        html.append('<tr><td>%s_symbol_%d</td><td>%d</td></tr>' % (page, n, (n * 7919) % 1000))
+    html.append('</table>')
+    return '\n'.join(html)
+
+
+## a 1x1 transparent PNG
+PNG = ('\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00'
+       '\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00'
+       '\x00\x00\x00IEND\xaeB`\x82')
+
+
+def generateReports(options):
+    """
+    Return (unpackreports, files with reports, files with hexdumps) for
+    'options'. The last two are lists of (sha256sum, path, size).
+    """
+    r = random.Random(options.seed)
+    dirs = ['']
+    level = ['']
+    for depth in xrange(options.depth):
+        nextlevel = []
+        for d in level:
+            for n in xrange(r.randint(1, options.fanout)):
+                nextlevel.append('%sdir%d_%d/' % (d, depth, n))
+        dirs.extend(nextlevel)
+        level = nextlevel
+    weights = [w for (tags, magic, w) in FILEKINDS]
+    totalweight = float(sum(weights))
+
+    unpackreports = {}
+    withreports = []
+    withhexdumps = []
+    checksums = []
+    for n in xrange(options.files):
+        d = r.choice(dirs)
+        path = '%sfile%d' % (d, n)
+        choice = r.random() * totalweight
+        for (tags, magic, w) in FILEKINDS:
+            choice -= w
+            if choice < 0:
+                break
+        report = {'name': os.path.basename(path), 'realpath': '/tmp/bat-generated/' + d.rstrip('/'),
+                  'magic': magic, 'tags': list(tags)}
+        if 'symlink' in tags:
+            report['size'] = 0
+            unpackreports[path] = report
+            continue
+        if r.random() < options.empty:
+            report['size'] = 0
+            report['tags'].append('empty')
+            unpackreports[path] = report
+            continue
+        if checksums and r.random() < options.duplicates:
+            (sha256sum, size) = r.choice(checksums)
+            report['tags'].append('duplicate')
+        else:
+            size = int(options.minsize * (float(options.maxsize) / options.minsize) ** r.random())
+            sha256sum = hashlib.sha256('batgen file %d' % n).hexdigest()
+            checksums.append((sha256sum, size))
+            if r.random() < options.reports:
+                withreports.append((sha256sum, path, size))
+                if r.random() < options.hexdumps / max(options.reports, 1e-9):
+                    withhexdumps.append((sha256sum, n, size))
+        report['size'] = size
+        report['checksum'] = sha256sum
+        if r.random() < 0.1:
+            report['scans'] = [{'offset': r.randint(0, size), 'scanname': 'gzip', 'size': r.randint(0, size)}]
+        unpackreports[path] = report
+    return (unpackreports, withreports, withhexdumps)
+
+
+def writeArchive(filepath, options, progress = None):
+    """
+    Write a synthetic archive for 'options' to 'filepath'. progress(text)
+    is called between the stages.
+    """
+    (unpackreports, withreports, withhexdumps) = generateReports(options)
+    tar = tarfile.open(filepath, 'w:gz')
+    def add(name, data):
+        ti = tarfile.TarInfo(name)
+        ti.size = len(data)
+        ti.mtime = 0
+        tar.addfile(ti, StringIO.StringIO(data))
+    try:
+        if progress is not None:
+            progress("scandata.pickle with %d files" % len(unpackreports))
+        add('scandata.pickle', cPickle.dumps(unpackreports, 2))
+        del unpackreports
+        if progress is not None:
+            progress("report pages for %d files" % len(withreports))
+        for (sha256sum, path, size) in withreports:
+            for page in REPORTPAGES:
+                add('reports/%s-%s.html.gz' % (sha256sum, page), gzipped(reportPage(sha256sum, page, path)))
+            add('images/%s-piechart.png' % sha256sum, PNG)
+        if progress is not None:
+            progress("hexdumps for %d files" % len(withhexdumps))
+        for (sha256sum, n, size) in withhexdumps:
+            add('reports/%s-hexdump.gz' % sha256sum,
+                gzipped(hexdumpC(fileContents(n, min(size, HEXDUMPMAXBYTES)))))
+    finally:
+        tar.close()
+
+
+if __name__ == "__main__":
+	parser = OptionParser(usage="%prog [options]")
+	defaults = GeneratorOptions()
+	parser.add_option("-n", "--files", action="store", type="int", dest="files", default=defaults.files,
+                          help="number of files (default %default)")
+	parser.add_option("-d", "--depth", action="store", type="int", dest="depth", default=defaults.depth,
+                          help="depth of the directory tree (default %default)")
+	parser.add_option("--fanout", action="store", type="int", dest="fanout", default=defaults.fanout,
+                          help="most subdirectories of a directory (default %default)")
+	parser.add_option("-s", "--seed", action="store", type="int", dest="seed", default=defaults.seed,
+                          help="random seed (default %default)")
+	parser.add_option("--duplicates", action="store", type="float", dest="duplicates",
+                          default=defaults.duplicates, help="fraction of duplicate files (default %default)")
+	parser.add_option("--empty", action="store", type="float", dest="empty", default=defaults.empty,
+                          help="fraction of empty files (default %default)")
+	parser.add_option("--reports", action="store", type="float", dest="reports", default=defaults.reports,
+                          help="fraction of files with report pages (default %default)")
+	parser.add_option("--hexdumps", action="store", type="float", dest="hexdumps", default=defaults.hexdumps,
+                          help="fraction of files with a hexdump (default %default)")
+	parser.add_option("--max-size", action="store", type="int", dest="maxsize", default=defaults.maxsize,
+                          help="biggest file size (default %default)")
+	parser.add_option("-o", "--output", action="store", dest="output",
+                          help="archive to write", metavar="FILE")
+	(options, args) = parser.parse_args()
+	if options.output is None:
+		parser.error("no output file given")
+
+	genoptions = GeneratorOptions(options.files, options.depth, options.fanout, options.seed,
+	                              options.duplicates, options.empty, options.reports,
+	                              options.hexdumps, maxsize = options.maxsize)
+	start = time.time()
+	def progress(text):
+		print >>sys.stderr, "%6.1fs %s" % (time.time() - start, text)
+	writeArchive(options.output, genoptions, progress)
+	progress("wrote %s" % options.output)
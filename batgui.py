@@ -14,36 +14,40 @@ This is a program for viewing results of the Binary Analysis Tool.
 '''
 
 
-import sys, os, string, gzip, cPickle, bz2, tarfile, tempfile, copy
+import sys, os, string, gzip, bz2, tarfile, tempfile, copy, shutil, time
+## when the viewer was started, for measuring how long starting up takes
+STARTTIME = time.time()
 from   optparse import OptionParser
 #from enum       import Enum
 from os.path    import isfile
 import ConfigParser
 from batpyqtgui             import Ui_batpyqtgui
 from batpyqtguifilterdialog import Ui_FilterDialog
+from batarchive             import openTar
+from battree                import TagColumns, TreeVisibility, FILTERCONFIG
+from battreemodel           import MainTreeCol, BATTreeModel
+from batsearch              import SearchIndex
+from batstore               import ScanStore
+from batloader              import BATLoader, DiffLoader
+from batsession             import defaultSessionDir
+from batdiff                import DIFFTAGS, UNCHANGED, REMOVED
+from batdupes               import DuplicateIndex
+from bathexdump             import HexdumpReport, BYTESPERROW
+from batscans               import ScanIndex
+from batcache               import PageCache, PagePrefetcher, ReportCache, defaultReportCacheDir
+from batsource              import SourceCache, sourceCandidates, defaultSourceCacheDir
+from batscheme              import BATNetworkAccessManager
+from battrace               import traced
+import battrace
 from PyQt5                  import QtCore, QtGui
 from PyQt5.QtGui            import QStandardItemModel, QStandardItem
 from PyQt5.QtCore           import QAbstractItemModel, QFile, QIODevice, QModelIndex, Qt
 from PyQt5.QtCore           import QSortFilterProxyModel, QRegExp, QDateTime, QDate, QTime
-from PyQt5.QtCore           import QItemSelectionModel, QVariant
+from PyQt5.QtCore           import QItemSelectionModel, QVariant, QTimer, QRunnable, QThreadPool
 from PyQt5.QtWidgets        import QApplication, QDialog, QMainWindow, QWidget, QFileDialog
 from PyQt5.QtWidgets        import QHeaderView, QErrorMessage, QMessageBox
-from PyQt5.QtWebKitWidgets  import QWebView
-import sqlite3, cgi
-
-'''
-    Each column in the batgui.treeview is described here, some of the columns are
-    not displayed and are for internal use only
-'''
-class MainTreeCol: #(Enum):
-    Name  = 0    # Shown: decorated file name that is shown in the tree
-    Mask  = 1    # Shown: mask describing object, like a circled D for directories
-    Path  = 2    # full path of the file/dir
-    HexdumpExtractFailed = 3 # have already tried to get hex dump report and failed for this entry
-    Extra = 4    # mainly for testing
-    _Max = Extra
-    
-
+from PyQt5.QtWidgets        import QProgressBar, QPushButton
+import sqlite3, cgi, collections, threading
 
 def QMIToPath(proxyModel,qmi):
     """
@@ -67,9 +71,25 @@ def treevisitor_PathToQMI( model, node, arg ):
         arg.qmi = node
         
 
-def PathToQMI(proxyModel,path):
+def PathToQMI(proxyModel,path,sourceModel = None):
     """
+    Given a path return the QModelIndex for it in proxyModel, or None if the
+    path is not in the model or is filtered out.
+
+    When sourceModel (a BATTreeModel) is given the path is looked up there and
+    only the one hit is mapped to the proxy, otherwise the whole tree has to
+    be walked.
     """
+    if sourceModel is not None:
+        node = sourceModel.findNode(path)
+        if node < 0:
+            return None
+        ## the parents of the node may not have been expanded yet
+        sourceModel.fetchParents(node)
+        qmi = proxyModel.mapFromSource(sourceModel.indexForNode(node))
+        if not qmi.isValid():
+            return None
+        return qmi
     arg = treevisitor_PathToQMI_Data( path  )
     treevisit( proxyModel, treevisitor_PathToQMI, arg )
     return arg.qmi
@@ -128,169 +148,349 @@ def treevisit( model, visitor = treevisitor_print, arg = 1 ):
 
 class myTreeFilterProxyModel(QSortFilterProxyModel):
     """ Allow filtering the treeview without throwing away the entries.
+
+    Which rows are shown is worked out in a battree.TreeVisibility, this
+    model only looks the answer up. When the filters change only the rows
+    that changed state are filtered again.
     """
     def __init__(self, batgui, parent=None):
         super(myTreeFilterProxyModel, self).__init__(parent)
         self.batgui = batgui
+        self.visibility = None
+        ## the batdiff tags of the files that are hidden when comparing
+        self.difffilter = []
 
-    def filterChanged(self):
+    def setVisibility(self, visibility):
+        self.visibility = visibility
         self.invalidateFilter()
-        
-    def filterAcceptsRow(self, sourceRow, sourceParent):
-    
-        qmi = self.sourceModel().index(sourceRow, 0, sourceParent)
-        if not qmi.isValid():
-            return False
-        filters = self.batgui.filters
-        unpackreports = self.batgui.unpackreports
-        path = QMIToPath(self.sourceModel(),qmi)
-        # item = self.sourceModel().data(qmi)
-#        print "filter() path:", path
-
-        # if tags, symlink (which is a tag), or file size
-        # mean we should ignore the entry then do so.
-        if unpackreports.has_key(path):
-            report = unpackreports[path]
-	    if report.has_key('tags'):
-                tags = report['tags']
-                #print "has tags:", tags
-		if list(set(tags).intersection(set(filters))) != []:
-                    return False
-	    if report.has_key('size'):
-		if report['size'] == 0:
-		    if "empty" in filters:
-                        return False
-                
-        ## Remove empty, or seemingly empty, directories from the
-	## view to declutter the interface.
-	## We keep traversing the tree until we know for sure that
-	## there are only directories with visible items left. There
-	## is probably a more efficient way, but this is still fast.
-	if self.batgui.filterForceRemoveEmptyDirectories or "emptydir" in filters:
-            ch = qmi.child( 0,0 )
-            removeDirectory = ch.isValid()
-            while ch.isValid():
-                # item = self.sourceModel().data(ch)
-                # path = QMIToPath(self.sourceModel(),ch)
-                
-                if self.filterAcceptsRow( ch.row(), qmi ):
-                    return True
-                ch = ch.sibling(ch.row()+1,0)
-            if removeDirectory:
-                return False
 
-        # do the default thing.
-        return super(myTreeFilterProxyModel, self).filterAcceptsRow(sourceRow, sourceParent)
+    def activeFilters(self):
+        return self.batgui.filters + self.difffilter
+
+    def setDiffFilter(self, difffilter):
+        self.difffilter = list(difffilter)
+        self.filterChanged()
+
+    @traced("filterChanged")
+    def filterChanged(self):
+        if self.visibility is None:
+            return
+        self.rowsChanged( self.visibility.setFilters( self.activeFilters(),
+                                                      self.batgui.removeEmptyDirectories() ))
+
+    @traced("findChanged")
+    def findChanged(self, findok):
+        if self.visibility is None:
+            return
+        self.rowsChanged( self.visibility.setFind( findok,
+                                                   self.batgui.removeEmptyDirectories() ))
+
+    def rowsChanged(self, changed):
+        """
+        Filter the rows for the given node ids again. The proxy is told
+        about them through dataChanged() of the source model, rows with the
+        same parent and consecutive ids are reported together. When most
+        of the tree changed it is cheaper to filter everything again.
+        """
+        if len(changed) > len(self.visibility) // 4:
+            self.invalidateFilter()
+            return
+        model   = self.sourceModel()
+        parents = self.visibility.parents
+        changed.sort()
+        first = None
+        for i in changed:
+            if first is not None and i == last + 1 and parents[i] == parents[first]:
+                last = i
+                continue
+            if first is not None:
+                model.nodesChanged( first, last )
+            first = last = i
+        if first is not None:
+            model.nodesChanged( first, last )
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        if self.visibility is None:
+            return True
+        node = self.sourceModel().childNode( sourceParent, sourceRow )
+        return bool(self.visibility.accepted[node])
 
     def filterAcceptsColumn( self, sourceRow, sourceParent):
         return True
+
+
+class TracedTreeFilterProxyModel(myTreeFilterProxyModel):
+    """
+    myTreeFilterProxyModel that counts the calls of filterAcceptsRow. It is
+    only used when tracing is on, so the count costs nothing otherwise.
+    """
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        battrace.count("filterAcceptsRow")
+        return myTreeFilterProxyModel.filterAcceptsRow(self, sourceRow, sourceParent)
         
 
             
+class PageJob(QRunnable):
+    """
+    Run function(*args) on a thread pool and emit batgui.pageRendered with
+    the result.
+    """
+    def __init__(self, batgui, requestid, element, function, args):
+        super(PageJob, self).__init__()
+        self.batgui    = batgui
+        self.requestid = requestid
+        self.element   = element
+        self.function  = function
+        self.args      = args
+
+    def run(self):
+        try:
+            html = self.function(*self.args)
+        except Exception, e:
+            html = "<p>failed to load page: %s</p>" % cgi.escape(str(e))
+        self.batgui.pageRendered.emit( self.requestid, self.element, html )
+
+
 """ This is the main object of the application.
 """
 class StartBATGUI(QMainWindow):
 
         def getSHADigestFromPath(self,path):
-            sha256sum = ''
-            if self.unpackreports.has_key(path):
-	      tag = ''
-	      if self.unpackreports[path].has_key('checksum'):
-	        sha256sum = self.unpackreports[path]['checksum']
-            return sha256sum
+            if self.scandata is None:
+                return ''
+            return self.scandata.checksum(path)
 
         @QtCore.pyqtSlot(result=str)
         def getActivePath( self ):
             return self.selectedfile
         
+        def hexdumpExtractFailed(self,key):
+            qmi = self.treemodel.indexForPath(key)
+            return qmi is not None and QMIToValue( self.treemodel, qmi, MainTreeCol.HexdumpExtractFailed ) == 1
+
+        def onHexdumpFailed(self,key):
+            ## hexdumpFailed is emitted on the worker threads, the tree is
+            ## changed on the GUI thread
+            qmi = self.treemodel.indexForPath(key)
+            if qmi is not None:
+                QMISetValue( self.treemodel, qmi, MainTreeCol.HexdumpExtractFailed, 1 )
+
+        @traced("openHexdumpReport")
+        def openHexdumpReport(self,sha256sum):
+            """
+            Return the HexdumpReport for the file with checksum sha256sum, or
+            None if there is no hexdump report for it. The report is held for
+            the caller, who has to release() it. The last few reports are kept
+            open together with their seek index. This can run on a worker
+            thread.
+            """
+            with self.hexdumplock:
+                report = self.hexdumps.pop(sha256sum, None)
+                if report is not None:
+                    battrace.count( "hexdumps.hits" )
+                else:
+                    battrace.count( "hexdumps.misses" )
+                    reportfile = self.openReport( sha256sum, "hexdump.gz" )
+                    if reportfile is None:
+                        return None
+                    report = HexdumpReport( reportfile )
+                self.hexdumps[sha256sum] = report
+                report.acquire()
+                ## a report that is still being read is closed when it is released
+                while len(self.hexdumps) > self.hexdumpCacheSize:
+                    self.hexdumps.popitem(last = False)[1].close()
+                return report
+
+        def hexdumpChecksum(self,key):
+            ## '' if there is no report, or opening it failed before
+            if self.hexdumpExtractFailed(key):
+                return ''
+            return self.getSHADigestFromPath(key)
+
+        @QtCore.pyqtSlot(str,'qlonglong','qlonglong',result=str)
+        @traced("getHexdumpRange")
+        def getHexdumpRange(self,key,offset,count):
+            """
+            Return the rows of the hexdump of the file with the path 'key' for
+            the bytes offset .. offset+count-1, as an HTML table. Row n of the
+            hexdump (counting from 1) has a cell with id "hexline<n>" for the
+            scan highlights.
+            """
+            battrace.log("getHexdumpRange() key:", key, offset, count)
+            return self.hexdumpRange( key, self.hexdumpChecksum(key), self.getScanIndex(key),
+                                      offset, count )
+
+        def hexdumpRange(self,key,sha256sum,scanindex,offset,count):
+            """
+            getHexdumpRange for the file with checksum sha256sum. The report
+            is opened here rather than by the caller, and the tree and scan
+            data are not used, so this can run on a worker thread.
+            """
+            report = None
+            if sha256sum != '':
+                report = self.openHexdumpReport( sha256sum )
+                if report is None:
+                    self.hexdumpFailed.emit( key )
+            try:
+                return self.formatHexdump( key, report, scanindex, offset, count )
+            finally:
+                if report is not None:
+                    report.release()
+
+        @traced("formatHexdump")
+        def formatHexdump(self,key,report,scanindex,offset,count):
+            """
+            Make the HTML table for getHexdumpRange from the HexdumpReport and
+            ScanIndex of 'key'. Does not use the tree or scan data, so this
+            can run on a worker thread.
+            """
+            if report is None:
+                return "<p>No report for path:%s </p>" % key
+            first = max(0, offset) // BYTESPERROW
+            end = (max(0, offset + count) + BYTESPERROW - 1) // BYTESPERROW
+            rows = report.rows(first, end - first)
+            ## the scans that start in or run through every row
+            annotations = scanindex.rowAnnotations(first, len(rows), BYTESPERROW)
+            lines = []
+            for (n, line) in enumerate(rows):
+                (starts, covers) = annotations[n]
+                if starts or covers:
+                    l = '<tr class="scanned" title="%s">' % cgi.escape(
+                        ", ".join([s[1] for s in starts + covers]), True)
+                else:
+                    l = '<tr>'
+                l = l + '<td class="codeline">' + cgi.escape(line) + '</td>'
+                l = l + ' <td class="codemeta" id="hexline%d">' % (first + n + 1)
+                l = l + ''.join([" %s at 0x%08x" % (cgi.escape(s[1]), s[0]) for s in starts])
+                l = l + '</td></tr>'
+                lines.append(l)
+            return '<table class="table">\n' + '\n'.join(lines) + '</table>'
+
         @QtCore.pyqtSlot(str,str,result=str)
+        @traced("getHexdump")
         def getHexdump(self,key,page):
             """
-            Find the report for the entry from the main qtreeview with the path 'key'
-            then read and return the selected 'page' from the archive.
+            Return the first page of the hexdump for the entry from the main
+            qtreeview with the path 'key'.
             """
-            print "getHexdump() key:", key, " sel:", self.selectedfile
-            qmi = PathToQMI(self.proxyModel,key)
-    	    sha256sum = self.getSHADigestFromPath(key)
-            if sha256sum == '':
-                return "<p>No report for path:%s </p>" % key
+            return self.getHexdumpRange( key, 0, self.hexdumpPageSize )
 
-            qmi = PathToQMI(self.proxyModel,key)
-            print "AAA qmi: ", qmi
-            print "AAA qmi.v: ", QMIToValue( self.proxyModel, qmi, MainTreeCol.HexdumpExtractFailed )
-            if QMIToValue( self.proxyModel, qmi, MainTreeCol.HexdumpExtractFailed ) != 1:
-                QMISetValue( self.proxyModel, qmi, MainTreeCol.HexdumpExtractFailed, 1 )
-
-                reportpath = "reports/%s-%s.gz" % (sha256sum,page)
-                print "reportpath:", reportpath
-                print "self.tarfile:", self.tarfile
-                print "self.tmpdir:", self.tmpdir
-
-		tar = self.openTar( self.tarfile )
-		self.tarmembers = tar.getmembers()
-		members = []
-		members = members + filter(lambda x: x.name == reportpath, self.tarmembers)
-		tar.extractall(self.tmpdir, members)
-		tar.close()
-                
-            reportpath = os.path.join(self.reportsdir, "%s-%s.gz" % (sha256sum,page))
-            print "Trying to extract hexdump report:", page
-            print "__________looking for:", reportpath
-	    if os.path.exists(reportpath):
-                lineLimit = 1000
-	        # data = self.readFile(reportpath)
-                # Dont use readFile() for this, because we want to decorate each
-                # line with some HTML
-                data = ""
-                i = 1
-                lines = [];
-                theFile = gzip.open(reportpath, 'r')
-	        for line in theFile:
-		    l = '<tr><td class="codeline">' + line + '</td>'
-		    l = l + ' <td class="codemeta" id="hexline%d"></td></tr>' % i
-                    i = i + 1
-                    lines.append(l)
-                    if i >= lineLimit:
-                        break
-                    
-                theFile.close()
-                data = '<table class="table">\n' + ''.join(lines) + '</table>'
-	        data = data.replace('REPLACEME', self.imagesdir)
-                return data
-            else:
-                return "<p>No report for path:%s </p>" % key
-            return "<p>failed to find report for page: %s</p>" % (key)
-        
+        @QtCore.pyqtSlot(str,result='qlonglong')
+        def getFileSize(self,key):
+            """
+            Return the size of the file with the path 'key', -1 if unknown.
+            """
+            if self.scandata is None:
+                return -1
+            return self.scandata.size(key)
     
         @QtCore.pyqtSlot(str,str,result=str)
+        @traced("getPage")
         def getPage(self,key,page):
             """
             Find the report for the entry from the main qtreeview with the path 'key'
             then read and return the selected 'page' from the archive.
             """
-            print "getPage() key:", key, " sel:", self.selectedfile
+            battrace.log("getPage() key:", key, " sel:", self.selectedfile)
             if page == "hexdump":
                 return self.getHexdump( key, page )
 
-    	    sha256sum = self.getSHADigestFromPath(key)
+            return self.loadPage( key, self.getSHADigestFromPath(key), page )
+
+        @traced("loadPage")
+        def loadPage(self,key,sha256sum,page):
+            """
+            Return the report 'page' for the file with the path 'key' and
+            checksum sha256sum, from the cache if it is there. Does not use
+            the tree or scan data, so this can run on a worker thread.
+            """
             if sha256sum == '':
                 return "<p>No report for path:%s </p>" % key
 
-            reportpath = os.path.join(self.reportsdir, "%s-%s.html.gz" % (sha256sum,page))
-	    if os.path.exists(reportpath):
-	       elfhtml = self.readFile(reportpath)
-	       elfhtml = elfhtml.replace('REPLACEME', self.imagesdir)
-               return elfhtml
-            else:
-                reportpath = os.path.join(self.reportsdir, "%s-%s.gz" % (sha256sum,page))
-                print "__________looking for:", reportpath
-	        if os.path.exists(reportpath):
-	            elfhtml = self.readFile(reportpath)
-	            elfhtml = elfhtml.replace('REPLACEME', self.imagesdir)
-                    return elfhtml
-                else:
+            elfhtml = self.pagecache.get( (sha256sum, page) )
+            if elfhtml is None:
+                elfhtml = self.renderPage( sha256sum, page )
+                if elfhtml is None:
                     return "<p>No report for path:%s </p>" % key
-            return "<p>failed to find report for page: %s</p>" % (key)
+                self.pagecache.put( (sha256sum, page), elfhtml )
+            return elfhtml
+
+        ## Asynchronous versions of getPage, getHexdumpRange and readFile. They
+        ## return a request id at once, the result is passed to pageReady()
+        ## later, together with the request id and the element it is for.
+
+        pageReady    = QtCore.pyqtSignal(int, str, str)
+        pageRendered = QtCore.pyqtSignal(int, str, str)
+        ## emitted on the worker threads when there is no hexdump report
+        hexdumpFailed = QtCore.pyqtSignal(str)
+
+        def startPageJob(self,element,function,*args):
+            self.pageRequests += 1
+            self.pagepool.start( PageJob( self, self.pageRequests, element, function, args ) )
+            return self.pageRequests
+
+        @QtCore.pyqtSlot(str,str,str,result=int)
+        def requestPage(self,element,key,page):
+            battrace.log("requestPage() key:", key, page)
+            return self.startPageJob( element, self.loadPage,
+                                      key, self.getSHADigestFromPath(key), page )
+
+        @QtCore.pyqtSlot(str,str,'qlonglong','qlonglong',result=int)
+        def requestHexdumpRange(self,element,key,offset,count):
+            battrace.log("requestHexdumpRange() key:", key, offset, count)
+            return self.startPageJob( element, self.hexdumpRange,
+                                      key, self.hexdumpChecksum(key), self.getScanIndex(key),
+                                      offset, count )
+
+        @QtCore.pyqtSlot(str,str,result=int)
+        def requestFile(self,element,p):
+            return self.startPageJob( element, self.readFile, p )
+
+        def onPageRendered(self,requestid,element,html):
+            ## pageRendered is emitted on the worker threads, pass the result
+            ## on from the GUI thread
+            self.pageReady.emit( requestid, element, html )
+
+        @traced("renderPage")
+        def renderPage(self,sha256sum,page):
+            """
+            Read the report 'page' for the file with checksum sha256sum and
+            return it ready to be shown, or None if there is no such report.
+            This is also called by the prefetcher, on another thread.
+            """
+            reportcache = self.reportcache
+            if reportcache is not None:
+                html = reportcache.get( sha256sum, page )
+                if html is not None:
+                    return html
+            for name in ("%s.html.gz" % page, "%s.gz" % page):
+                reportpath = self.extractReport( sha256sum, name )
+	        if reportpath is not None:
+	            ## the pictures the report refers to are served by the
+	            ## BATNetworkAccessManager, the HTML is shown as it is
+	            html = self.readFile(reportpath)
+	            if reportcache is not None:
+	                reportcache.put( sha256sum, page, html )
+	            return html
+            return None
+
+        def prefetchNeighbours(self,qmi):
+            """
+            Render the report pages of the files around 'qmi' in the tree
+            in the background, the nearest ones first.
+            """
+            keys = []
+            above = below = qmi
+            for n in range( self.prefetchNeighbourCount ):
+                above = self.treeview.indexAbove( above )
+                below = self.treeview.indexBelow( below )
+                for idx in (below, above):
+                    if not idx.isValid():
+                        continue
+                    sha256sum = self.getSHADigestFromPath( QMIToPath(self.proxyModel, idx) )
+                    if sha256sum != '':
+                        keys.extend([(sha256sum, page) for page in self.reportPages])
+            self.prefetcher.prefetch( keys )
 
         @QtCore.pyqtSlot(result=str)
         def getScriptDir(self):
@@ -298,7 +498,7 @@ class StartBATGUI(QMainWindow):
 
         @QtCore.pyqtSlot(result=str)
         def getHTMLDir(self):
-            print "getHTMLDir() ret:", self.htmldir
+            battrace.log("getHTMLDir() ret:", self.htmldir)
             return self.htmldir
 
         """Read a file, either from local storage or from inside a tar
@@ -308,19 +508,58 @@ class StartBATGUI(QMainWindow):
         Limitations: at the moment only local gz and bz2 files are supported.
         """
         @QtCore.pyqtSlot(str,result=str)
+        @traced("readFile")
         def readFile(self,p):
-            print "readFile() p-->:%s:<--" % p
+            battrace.log("readFile()", p)
+            p = self.extractIfArchiveMember(p)
             if p.endswith(".gz"):
                 theFile = gzip.open(p, 'r')
 	        data = theFile.read()
 	        theFile.close()
+                battrace.count( "readFile.bytes", len(data) )
                 return data
 
 	    theFile = bz2.BZ2File(p, 'r')
 	    data = theFile.read()
             theFile.close()
-            print "readFile() data:", data
+            battrace.count( "readFile.bytes", len(data) )
             return data
+
+        @QtCore.pyqtSlot(str,str,int,result=int)
+        def requestSource(self,element,p,anchor):
+            """
+            Load the lines of the source file 'p' around the anchor
+            "line<anchor>" asynchronously, see requestPage.
+            """
+            battrace.log("requestSource() p:", p, anchor)
+            return self.startPageJob( element, self.sourceWindow, self.sources, p, anchor, None )
+
+        @QtCore.pyqtSlot(str,str,int,int,result=int)
+        def requestSourceRange(self,element,p,first,count):
+            """
+            Load 'count' lines of the source file 'p' from line 'first' on,
+            to show more of it when scrolling.
+            """
+            return self.startPageJob( element, self.sourceWindow, self.sources, p, None, first, count )
+
+        @traced("sourceWindow")
+        def sourceWindow(self,sources,p,anchor,first,count = None):
+            """
+            Return the HTML for a window of the source file 'p', with the
+            numbers of its first line, the line after it and the line after
+            the source in the data- attributes. Only the window around the
+            anchor has the tags around the source, the others are added to it.
+            """
+            if sources is None:
+                return "<p>No archive open</p>"
+            p = self.findSourceFile(p)
+            if anchor is not None:
+                (first, end, last, html) = sources.anchorWindow( p, anchor, self.sourceLinesBefore,
+                                                                 self.sourceWindowLines )
+            else:
+                (first, end, last, html) = sources.window( p, first, count, False )
+            return '<div class="sourcewindow" data-first="%d" data-end="%d" data-last="%d">%s</div>' \
+                   % (first, end, last, html)
             
         """ Basedir where the css, js, and other web assets can be loaded from
         """
@@ -349,159 +588,122 @@ class StartBATGUI(QMainWindow):
 
         
         @QtCore.pyqtSlot(str,result=QVariant)
+	@traced("getScanHighlights")
 	def getScanHighlights(self,path):
-		unpackedfiles = []
-                if not self.unpackreports.has_key(path) or not self.unpackreports[path].has_key('scans'):
-                    return []
-
-		for i in self.unpackreports[path]['scans']:
-			unpackedfiles.append(( i['offset'], i['scanname'], i['size'] ))
-
-		## work our way backwards, so we don't have to remember to do funky math with offsets
-		unpackedfiles = sorted(unpackedfiles, reverse=True)
-                print "unpackedfiles.len:", len( unpackedfiles )
-
+                ## work our way backwards, so we don't have to remember to do funky math with offsets
                 ## remove the use of tuple so we can pass it back to javascript.
-                ret = []
-                for i in unpackedfiles:
-                    ret.append([ i[0], i[1], i[2] ])
-                    
-                print "ret:", ret
-                return ret
-                
-        def setupFromBAT(self):
-            self.treemodel.removeRows(0,self.treemodel.rowCount())
-            
-            parent   = self.treemodel.invisibleRootItem()
-            rootnode = parent
-            parents  = [parent]
-            columnData = ['hi','there']
-    	    nodes = {}
-
-
- 	    dirlist = list(set(map(lambda x: os.path.dirname(x), self.unpackreports.keys())))
-
-	    ## make sure that we have all directories
-	    for d in dirlist:
-	        if os.path.dirname(d) in dirlist:
-	            continue
-	        else:
-	            dirlist.append(os.path.dirname(d))
-	    dirlist.sort()
-
-
-	    for d in dirlist:
-	      if d == "":
-	        continue
-	      else:
-	        if d.startswith('/'):
-	          d = d[1:]
-	        parent = os.path.dirname(d)
-	        if parent == "":
-	          linktext = u"%s" % d
-                  masktext = u"\u24b9"
-                  dirnode = self.appendChild(self.treemodel, rootnode, linktext, masktext, d )
-	          nodes[d] = dirnode
-	        else:
-	          ## length of parent, plus 1 for trailing slash
-	          parentlen = len(parent) + 1
-              
-	          ## check if the parent directory is actually there. If not, we have
-	          ## a problem. Should not occur.
-	          if not nodes.has_key(parent):
-		    continue
-                  linktext = u"%s" % d[parentlen:]
-                  masktext = u"\u24b9"
-                  dirnode = self.appendChild( self.treemodel, nodes[parent], linktext,masktext,os.path.normpath(d))
-	          nodes[d] = dirnode
-
-	    filelist = self.unpackreports.keys()
-	    filelist.sort()
-        
+                return [list(s) for s in reversed(self.getScanIndex(path).scans)]
 
-	    for j in filelist:
-		    if j.startswith('/'):
-			    j = j[1:]
-		    parent = os.path.dirname(j)
-		    ## length of parent, plus 1 for trailing slash
-		    parentlen = len(parent) + 1
-		    ignore = False
-		    if parent == "":
-			    linktext = j
-		    else:
-			    linktext = j[parentlen:]
-		    tagsentities = {'text': u'\u24c9', 'graphics': u'\u24bc', 'compressed': u'\u24b8', 'resource': u'\u24c7', 'static': u'\u24c8', 'dalvik': u'\u24b6', 'ranking': u'\u272a', 'linuxkernel': u'\u24c1', 'duplicate': u'\u229c'}
-                    masktext = ''
-                
-		    if self.unpackreports[j].has_key('tags'):
-			    for t in self.unpackreports[j]['tags']:
-				    if list(set(self.unpackreports[j]['tags']).intersection(set(self.filters))) != []:
-					    ignore = True
-					    continue
-				    tagappend = u""
-				    if tagsentities.has_key(t):
-					    tagappend = tagsentities[t]
-				    if tagappend != u"":
-                                            masktext = masktext + u"  %s" % tagappend
-			    if "symlink" in self.unpackreports[j]['tags']:
-				    if "symlink" in self.filters:
-					    ignore = True
-					    continue
-				    ## if it is a link, then add the value of where the link points to
-				    ## to give a visual clue to people
-				    ## example: "symbolic link to `../../bin/busybox'"
-				    linkname = self.unpackreports[j]['magic'][:-1].rsplit("symbolic link to `", 1)[-1]
-				    linktext = u"%s \u2192 %s" % (linktext, linkname)
-		    if self.unpackreports[j].has_key('size'):
-			    if self.unpackreports[j]['size'] == 0:
-				    ## if files are empty mark them as empty
-				    if "empty" in self.filters:
-					    ignore = True
-				    else:
-					    masktext = u"\u2205"
-		    if ignore:
-			    continue
-		    if parent == "":
-                            leafnode = self.appendChild( self.treemodel, rootnode, linktext,masktext,j)
-			    nodes[j] = leafnode
-		    else:
-			    if not nodes.has_key(parent):
-				    continue
-			    else:
-                                    leafnode = self.appendChild(self.treemodel, nodes[parent],linktext,masktext,os.path.normpath(j))
-				    nodes[j] = leafnode
+        @QtCore.pyqtSlot(str,'qlonglong',result=QVariant)
+        @traced("getScansAt")
+        def getScansAt(self,path,offset):
+                """
+                Return the scans of the file with the path 'path' which cover
+                the byte at 'offset', as [offset, scanname, size] lists.
+                """
+                return [list(s) for s in self.getScanIndex(path).covering(offset)]
+
+        @QtCore.pyqtSlot(str,result=QVariant)
+        @traced("getCopies")
+        def getCopies(self,path):
+                """
+                Return [path, size] for every file with the same checksum as
+                the file with the path 'path', including itself.
+                """
+                sha256sum = self.getSHADigestFromPath(path)
+                if sha256sum == '' or self.duplicates is None:
+                    return []
+                return [[self.treemodel.nodePath(node), size]
+                        for (node, size) in self.duplicates.copies(sha256sum)]
+
+        @QtCore.pyqtSlot(str)
+        def selectPath(self,path):
+                """
+                Select the file with the path 'path' in the tree, once the
+                JavaScript that asks for it has returned.
+                """
+                QTimer.singleShot( 0, lambda: self.selectAndDisplay( unicode(path) ) )
+
+        def onNextCopy(self):
+                """
+                Select the next copy of the selected file, in the order of the tree.
+                """
+                if self.duplicates is None or self.selectedfile is None:
+                    return
+                sha256sum = self.getSHADigestFromPath( self.selectedfile )
+                node = self.treemodel.findNode( self.selectedfile )
+                if sha256sum == '' or node < 0:
+                    return
+                copy = self.duplicates.nextCopy( sha256sum, node )
+                if copy < 0:
+                    self.ui.statusbar.showMessage( "There are no other copies of this file", 5000 )
+                    return
+                if not self.selectAndDisplay( self.treemodel.nodePath(copy) ):
+                    self.ui.statusbar.showMessage( "The next copy, %s, is hidden by the filters"
+                                                   % self.treemodel.nodePath(copy), 5000 )
+                    return
+                self.ui.statusbar.showMessage( "Copy %d of %d"
+                                               % (self.duplicates.checksums[sha256sum].index(copy) + 1,
+                                                  self.duplicates.copyCount(sha256sum)), 5000 )
+
+        def getScanIndex(self,path):
+                """
+                Return the ScanIndex for the scans of the file with the path
+                'path', the last few are kept.
+                """
+                if self.scanindexes.has_key(path):
+                    battrace.count( "scanindexes.hits" )
+                    index = self.scanindexes.pop(path)
+                else:
+                    battrace.count( "scanindexes.misses" )
+                    scans = None
+                    if self.scandata is not None:
+                        scans = self.scandata.scans(path)
+                    index = ScanIndex( scans or [] )
+                self.scanindexes[path] = index
+                while len(self.scanindexes) > self.scanIndexCacheSize:
+                    self.scanindexes.popitem(last = False)
+                return index
+
+        @traced("setupFromBAT")
+        def setupFromBAT(self, layout):
+            ## the rows of the layout were added to self.treemodel while loading
+            self.searchindex = SearchIndex( self.treemodel, layout.magics, layout.magicids,
+                                            layout.checksums, layout.lnames, layout.prefixorder )
+            self.duplicates = DuplicateIndex( layout.checksums, layout.sizes )
+            filtertags = [t for (tags, description) in self.filterconfig for t in tags]
+            columns = TagColumns( layout.tagcomboids, layout.tagcombos, layout.sizes,
+                                  filtertags + DIFFTAGS.values(),
+                                  self.duplicates.extraCopies( len(layout) ) )
+            visibility = TreeVisibility( self.treemodel.parents, self.treemodel.childstart,
+                                         self.treemodel.childcount, columns )
+            visibility.setFilters( self.proxyModel.activeFilters(), self.removeEmptyDirectories() )
+            if self.findText != "":
+                visibility.setFind( self.findMatches( self.findText ),
+                                    self.removeEmptyDirectories() )
+            self.proxyModel.setVisibility( visibility )
+            self.expandTree()
+
+        def expandTree(self):
+            """
+            Expand the directories on the paths to the matches of the find,
+            or the first expandDepth levels when there is no find, instead
+            of the whole tree. The children of the other directories are
+            only added to the model when they are expanded.
+            """
+            visibility = self.proxyModel.visibility
+            if visibility is None:
+                return
+            for node in visibility.expandNodes( self.expandDepth, self.expandLimit ).tolist():
+                ## the parents come first, so they are rows by now
+                self.treemodel.fetchNode( node )
+                qmi = self.proxyModel.mapFromSource( self.treemodel.indexForNode(node) )
+                if qmi.isValid():
+                    self.treeview.expand( qmi )
+
+        def removeEmptyDirectories(self):
+            return self.filterForceRemoveEmptyDirectories or "emptydir" in self.proxyModel.activeFilters()
 
-        
-	    ## Remove empty, or seemingly empty, directories from the
-	    ## view to declutter the interface.
-	    ## We keep traversing the tree until we know for sure that
-	    ## there are only directories with visible items left. There
-	    ## is probably a more efficient way, but this is still fast.
-	    if "emptydir" in self.filters:
-		    stillempty = True
-		    while stillempty:
-			    stillempty = False
-			    for i in dirlist:
-				    if nodes.has_key(i):
-					    if not nodes[i].ItemHasChildren():
-						    nodes[i].remove()
-						    del nodes[i]
-						    stillempty = True
-                                          
-            self.treeview.expandAll()
-
-        """ Main GTreeModel: Add a new child node to the given parentNode with the associated
-            data linktext, masks, path, (and possibly future subsequent args)
-        """
-        def appendChild(self, model, parentNode, linktext, masks, path, HexdumpExtractFailed = False ):
-            item = QStandardItem( linktext )
-            parentNode.appendRow([ item,
-                                   QStandardItem( masks ),
-                                   QStandardItem( path ),
-                                   QStandardItem( HexdumpExtractFailed )
-                                   ])
-            return item
-        
         """ Use with self.filterdialog.Model: add a new entry to the list at the top level
             with the given text
         """
@@ -527,19 +729,14 @@ class StartBATGUI(QMainWindow):
                 self.filterForceRemoveEmptyDirectories = False
 		self.filterconfigstate = []
 		self.filters = []
-		self.filterconfig = [(["audio", "mp3", "ogg"], "Audio files"),
-                                     (["duplicate"], "Duplicate files"),
-                                     (["emptydir"], "Empty directories (after filters have been applied)"),
-                                     (["empty"], "Empty files"),
-                                     (["png", "bmp", "jpg", "gif", "graphics"], "Graphics files"),
-                                     (["pdf"], "PDF files"),
-                                     (["resource"], "Resource files"),
-                                     (["symlink"], "Symbolic links"),
-                                     (["text", "xml"], "Text files"),
-                                     (["video", "mp4"], "Video files"),]
+		self.filterconfig = list(FILTERCONFIG)
 #                self.tree = 'fixme'
 
-                self.unpackreports = {}
+                self.scandata = None
+                ## the batdiff.ScanDiff with the archive that is compared with
+                self.diff = None
+                ## the copies of every file, by checksum
+                self.duplicates = None
                 
 		self.filterdialog = Ui_FilterDialog()
                 self.filterdialogwindow = QDialog()
@@ -548,44 +745,50 @@ class StartBATGUI(QMainWindow):
                 self.filterdialog.Model = QStandardItemModel(0,1,parent)
                 model = self.filterdialog.Model;
                 model.setHeaderData(0, Qt.Horizontal, "Filter")
-                self.addFilterDialogItem( model, "Audio files" )
-                self.addFilterDialogItem( model, "Duplicate files" )
-                self.addFilterDialogItem( model, "Empty directories (after filters have been applied)" )
-                self.addFilterDialogItem( model, "Empty files" )
-                self.addFilterDialogItem( model, "Graphics files" )
-                self.addFilterDialogItem( model, "PDF files" )
-                self.addFilterDialogItem( model, "Resource files" )
-                self.addFilterDialogItem( model, "Symlink files" )
-                self.addFilterDialogItem( model, "Text files" )
-                self.addFilterDialogItem( model, "Video files" )
+                ## the rows of the dialog are the rows of self.filterconfig
+                for (tags, description) in self.filterconfig:
+                    self.addFilterDialogItem( model, description )
                 h = self.filterdialog.listView.horizontalHeader()
                 h.setStretchLastSection( True )
                 self.filterdialog.listView.setModel(model)
                 self.filterdialog.listView.verticalHeader().hide();
                 self.filterdialog.listView.horizontalHeader().hide();
 
-                # setup webview widget
-                webview = self.ui.web;
-                self.webview = self.ui.web
-                webview.page().mainFrame().javaScriptWindowObjectCleared.connect(
-                        self.populateJavaScriptWindowObject )
-                webview.setUrl(QtCore.QUrl(self.getWebResourceUrl('/index.html')))
+                ## the web view is created once the event loop runs, so that
+                ## loading an archive given on the command line starts first
+                ## and the tree is built while WebKit starts up. Scripts for
+                ## the page are held back until index.html is loaded.
+                self.ui.web = None
+                self.webview = None
+                self.webReady = False
+                self.pendingScript = None
+                self.networkAccessManager = None
+                self.startupReported = False
+                QTimer.singleShot( 0, self.createWebView )
 
                
                 #self.ui.button_open.clicked.connect(self.file_open_test)
                 self.ui.action_test.triggered.connect(self.onTest)
                 self.ui.find.returnPressed.connect(self.onFind)
+                ## search as you type, once the typing pauses
+                self.findTimer = QTimer(self)
+                self.findTimer.setSingleShot( True )
+                self.findTimer.setInterval( 150 )
+                self.findTimer.timeout.connect(self.onFind)
+                self.ui.find.textEdited.connect(self.onFindEdited)
 
 
                     
                 self.treeview  = self.ui.tree
-                self.treemodel = QStandardItemModel(0,MainTreeCol._Max,parent)
-                self.proxyModel = myTreeFilterProxyModel(self)
+                self.treemodel = BATTreeModel(parent)
+                if battrace.enabled():
+                    self.proxyModel = TracedTreeFilterProxyModel(self)
+                else:
+                    self.proxyModel = myTreeFilterProxyModel(self)
                 self.proxyModel.setSourceModel( self.treemodel )
                 self.treeview.setModel( self.proxyModel )
-                regExp = QRegExp(".*", Qt.CaseSensitive, QRegExp.PatternSyntax(QRegExp.RegExp))
-                self.proxyModel.setFilterRegExp(regExp)
-                self.proxyModel.setFilterKeyColumn( 0 )
+                self.findText = ""
+                self.searchindex = None
                 self.treemodel.setHeaderData( MainTreeCol.Name,  Qt.Horizontal, "Name")
                 self.treemodel.setHeaderData( MainTreeCol.Mask,  Qt.Horizontal, "Masks")
                 self.treemodel.setHeaderData( MainTreeCol.Extra, Qt.Horizontal, "Extra")
@@ -595,15 +798,29 @@ class StartBATGUI(QMainWindow):
                 self.treeview.setColumnHidden( MainTreeCol.Path,  True )
                 self.treeview.setColumnHidden( MainTreeCol.HexdumpExtractFailed,  True )
 #                self.treeview.clicked.connect(self.onTreeClicked);
-                self.treeview.selectionModel().currentChanged.connect(self.onTreeClicked);
+                self.treeview.selectionModel().currentChanged.connect(
+                        lambda qmi, oldqmi: self.onTreeClicked(qmi) )
                 #self.treeview.header.resizeColumnToContents(1)
                 self.treeview.header().setStretchLastSection( False )
                 self.treeview.header().setSectionResizeMode( 0, QHeaderView.Stretch )
 
+                ## progress of loading an archive, shown in the status bar
+                self.loader = None
+                self.loadProgress = QProgressBar()
+                self.loadProgress.setMaximumWidth( 200 )
+                self.loadCancelButton = QPushButton( "Cancel" )
+                self.loadCancelButton.clicked.connect(self.onCancelLoad)
+                self.ui.statusbar.addPermanentWidget( self.loadProgress )
+                self.ui.statusbar.addPermanentWidget( self.loadCancelButton )
+                self.loadProgress.hide()
+                self.loadCancelButton.hide()
+
                 
 		## some defaults
 		self.datadir = ""
 		self.tarfile = None
+		self.archive = None
+		self.tmpdir = None
 		self.timer = None
 		self.selectedfile = None
 		self.htmldir = None
@@ -612,21 +829,60 @@ class StartBATGUI(QMainWindow):
 		## we start in "simple" mode
 		self.advanced = True
 		self.advancedunpacked = False
+		## extract reports and images from the archive when they are
+		## first needed instead of unpacking everything when opening
+		self.extractOnDemand = True
+		## hexdump reports that are kept open, and the number of bytes
+		## shown on one page of the hex view
+		self.hexdumps = collections.OrderedDict()
+		self.hexdumplock = threading.Lock()
+		self.hexdumpCacheSize = 4
+		self.hexdumpPageSize = 16 * 1000
+		## interval indexes of the scans of the last few files
+		self.scanindexes = collections.OrderedDict()
+		self.scanIndexCacheSize = 16
+		## rendered report pages, and the pages that are rendered ahead
+		## for the files that are within prefetchNeighbourCount rows of
+		## the selected one
+		self.pagecache = PageCache()
+		self.prefetcher = PagePrefetcher( self.pagecache, self.renderPage )
+		self.prefetcher.start()
+		self.prefetchNeighbourCount = 2
+		## how many levels of the tree are expanded, and the most
+		## directories that are expanded at once (for the find as well)
+		self.expandDepth = 1
+		self.expandLimit = 1000
+		## decompressed reports on disk, shared by all archives and sessions
+		self.reportcache = self.openReportCache( defaultReportCacheDir() )
+		## where the trees of archives in directories that are not
+		## writable are kept, see batsession
+		self.sessionDir = defaultSessionDir()
+		## pages asked for by the web view are loaded on this pool
+		self.pagepool = QThreadPool(self)
+		self.pagepool.setMaxThreadCount( 4 )
+		self.pageRequests = 0
+		self.pageRendered.connect(self.onPageRendered)
+		self.hexdumpFailed.connect(self.onHexdumpFailed)
+		## decompressed source files, and how many lines of them are shown
+		## around the line that was linked to and added when scrolling
+		self.sources = None
+		self.sourceCacheDir = defaultSourceCacheDir()
+		self.sourceLinesBefore = 50
+		self.sourceWindowLines = 500
+		self.reportPages = ('guireport', 'unique', 'assigned', 'unmatched',
+		                    'names', 'functionnames', 'elfreport')
+		self.basicReportPages = ('unique.html.gz', 'unmatched.html.gz', 'assigned.html.gz',
+		                         'guireport.html.gz', 'elfreport.html.gz', 'names.html.gz')
 		self.batconfig = ["Advanced mode"]
 		self.batconfigstate = []
 
                 self.ui.FindArea.hide()
 
-        def onTreeClicked(self,qmi,oldqmi):
-            self.onTreeClicked(qmi)
-                
+        @traced("onTreeClicked")
         def onTreeClicked(self,qmi):
-                print "onTreeClicked.............."
-                print "qmi:", qmi
-                frame = self.ui.web.page().mainFrame()
                 path = QMIToPath(self.proxyModel,qmi)
                 self.selectedfile = path
-                print "onTreeClicked! path:", path
+                battrace.log("onTreeClicked! path:", path)
 
     	        sha256sum = self.getSHADigestFromPath( path )
                 if sha256sum == '':
@@ -634,22 +890,72 @@ class StartBATGUI(QMainWindow):
                     realpath =""
                     magic = ""
 		    size = "0"
-                    if self.unpackreports.has_key(path):
-                        name = self.unpackreports[path]['name']
-		        realpath = self.unpackreports[path]['realpath']
-		        magic = self.unpackreports[path]['magic']
+                    report = None
+                    if self.scandata is not None:
+                        report = self.scandata.get(path)
+                    if report is not None:
+                        name = report['name']
+		        realpath = report['realpath']
+		        magic = report['magic']
+                    elif self.diff is not None and self.diff.status.get(path) == REMOVED:
+                        ## only in the compared archive, its data is not kept
+                        name = os.path.basename(path)
+                        magic = "removed since the compared archive"
                         
-                    frame.evaluateJavaScript('OnFileWithoutReportsSelected("' + path
-                                             + '", "' + name
-                                             + '", "' + realpath
-                                             + '", "' + size
-                                             + '", "' + magic
-                                             + '");' )
+                    self.runJavaScript('OnFileWithoutReportsSelected("' + path
+                                       + '", "' + name
+                                       + '", "' + realpath
+                                       + '", "' + size
+                                       + '", "' + magic
+                                       + '");' )
                     return
                 
-                res = frame.evaluateJavaScript('OnFileSelected("' + path + '");')
-                print "OnFileSelected():", res
+                self.runJavaScript('OnFileSelected("' + path + '");')
+                self.prefetchNeighbours(qmi)
                 
+        @traced("createWebView")
+        def createWebView(self):
+                """
+                Create the web view and start loading index.html, unless
+                that was done already. QtWebKit is only imported here as
+                starting it takes a while.
+                """
+                if self.webview is not None:
+                    return
+                from PyQt5.QtWebKitWidgets import QWebView
+                webview = QWebView( self.ui.webArea )
+                webview.setObjectName( "web" )
+                self.ui.webLayout.addWidget( webview )
+                self.ui.web = webview
+                self.webview = webview
+                webview.page().mainFrame().javaScriptWindowObjectCleared.connect(
+                        self.populateJavaScriptWindowObject )
+                ## pictures of the reports are read from the archive through bat:// URLs
+                self.networkAccessManager = BATNetworkAccessManager( lambda: self.archive, self.pagepool, webview )
+                webview.page().setNetworkAccessManager( self.networkAccessManager )
+                webview.loadFinished.connect( self.onWebLoaded )
+                webview.setUrl(QtCore.QUrl(self.getWebResourceUrl('/index.html')))
+
+        def onWebLoaded(self, ok):
+                battrace.since( "startup.webloaded", STARTTIME )
+                self.webReady = True
+                script = self.pendingScript
+                self.pendingScript = None
+                if script is not None:
+                    self.runJavaScript( script )
+
+        def runJavaScript(self, script):
+                """
+                Run 'script' in the page, or once index.html is loaded if it
+                is not yet. Only the last script given before that is run,
+                the scripts all replace what the page shows. This does not
+                create the web view, so opening an archive does not wait for
+                WebKit.
+                """
+                if not self.webReady:
+                    self.pendingScript = script
+                    return
+                self.webview.page().mainFrame().evaluateJavaScript( script )
                     
         def populateJavaScriptWindowObject(self):
                 self.ui.web.page().mainFrame().addToJavaScriptWindowObject('batgui', self)
@@ -671,7 +977,7 @@ class StartBATGUI(QMainWindow):
                 self.openFile( filename )
 
 	def openFile(self, filepath ):
-            print "showing file: ", filepath
+            battrace.log("showing file: ", filepath)
 	    if isfile(filepath):
                 self.openBATFile( filepath )
             else:
@@ -680,10 +986,78 @@ class StartBATGUI(QMainWindow):
             
                     
 
+	def onCompareFile(self):
+                """
+                Compare the open archive with an older one, chosen by the user.
+                """
+                if self.scandata is None or self.loader is not None:
+                    self.showError('Open an archive to compare with first')
+                    return
+                filepath = self.runDialogToGetFilePath()
+                if filepath == '':
+                    return
+                if not isfile(filepath):
+                    self.showError('You did not select a valid file')
+                    return
+                self.startDiff( filepath )
+
+	def onStopComparing(self):
+                if self.diff is None or self.loader is not None:
+                    return
+                self.startDiff( None )
+
+	def onDiffOnlyToggled(self, checked):
+                if checked:
+                    self.proxyModel.setDiffFilter( [DIFFTAGS[UNCHANGED], "emptydir"] )
+                else:
+                    self.proxyModel.setDiffFilter( [] )
+                self.expandTree()
+
+        def startDiff(self, filepath):
+                """
+                Build the tree of the open archive compared with the archive
+                'filepath' on a DiffLoader, or the plain tree again if that
+                is None.
+                """
+                self.loader = DiffLoader( self.scandata.dbpath, filepath,
+                                          os.path.join(self.tmpdir, "compare"), self )
+                self.loader.progress.connect(self.onLoadProgress)
+                self.loader.treeReady.connect(self.onDiffTreeReady)
+                self.loader.finished.connect(self.onDiffFinished)
+                self.loadProgress.setRange( 0, 0 )
+                self.loadProgress.show()
+                self.loadCancelButton.show()
+                self.loader.start()
+
+        def onDiffTreeReady(self, layout, diff):
+                if self.sender() is not self.loader:
+                    return
+                self.diff = diff
+                if diff is None:
+                    self.ui.action_diff_only.setChecked( False )
+                self.proxyModel.setVisibility( None )
+                self.searchindex = None
+                self.treemodel.setLayout( layout )
+                self.initTree( layout )
+
+        def onDiffFinished(self):
+                loader = self.sender()
+                if loader is not self.loader:
+                    return
+                self.loader = None
+                self.loadProgress.hide()
+                self.loadCancelButton.hide()
+                self.ui.statusbar.clearMessage()
+                if loader.error is not None:
+                    self.showError( loader.error )
+                elif self.diff is not None and not loader.cancelled:
+                    self.ui.statusbar.showMessage( "Compared with %s: %s"
+                                                   % (os.path.basename(loader.filepath), self.diff.summary()) )
+
 	def onConfigurationOpen(self):
             try:
                 filename = self.runDialogToGetFilePath()
-                print "opening config file... :", filename
+                battrace.log("opening config file... :", filename)
   	        config = ConfigParser.ConfigParser()
 		configfile = open( filename, 'r' )
 		config.readfp(configfile)
@@ -697,7 +1071,7 @@ class StartBATGUI(QMainWindow):
             
                 
 	def onOpenFilterDialog(self):
-                print "onOpenFilterDialog()..."
+                battrace.log("onOpenFilterDialog()...")
                 model = self.filterdialog.Model;
 
                 for row in range( model.rowCount() ):
@@ -713,7 +1087,7 @@ class StartBATGUI(QMainWindow):
 	        self.filterdialogwindow.show()
 
         def onFilterDialogAccepted(self):
-                print "onFilterDialogAccepted()..."
+                battrace.log("onFilterDialogAccepted()...")
                 model = self.filterdialog.Model;
                 self.filters = []
                 for row in range( model.rowCount() ):
@@ -723,35 +1097,52 @@ class StartBATGUI(QMainWindow):
                     #print "d:", d
                 #print "filters:", self.filters
                 self.proxyModel.filterChanged()
-                self.treeview.expandAll()
+                self.expandTree()
                 
 	def onTest(self):
-                print "test..."
-                print "  main:", self.ui.web.page().mainFrame()
-                print "  main.p:", self.ui.web.page().mainFrame().parentFrame()
-                print "  curr:", self.ui.web.page().currentFrame()
-                print "  curr.p:", self.ui.web.page().currentFrame().parentFrame()
+                battrace.log("test...")
+                self.createWebView()
+                battrace.log("  main:", self.ui.web.page().mainFrame())
+                battrace.log("  main.p:", self.ui.web.page().mainFrame().parentFrame())
+                battrace.log("  curr:", self.ui.web.page().currentFrame())
+                battrace.log("  curr.p:", self.ui.web.page().currentFrame().parentFrame())
                 frame = self.ui.web.page().mainFrame()
 #                frame = self.ui.web.page().currentFrame()
-                print frame.evaluateJavaScript('completeAndReturnName();')
-                print frame.evaluateJavaScript('document.completeAndReturnName();')
-#                print frame.evaluateJavaScript('completeAndReturnName();')
-#                print frame.evaluateJavaScript('some_js_function(' + path + ')')
+                battrace.log(frame.evaluateJavaScript('completeAndReturnName();'))
+                battrace.log(frame.evaluateJavaScript('document.completeAndReturnName();'))
+#                battrace.log(frame.evaluateJavaScript('some_js_function(' + path + ')'))
                 
 	def onFind(self):
+            self.findTimer.stop()
             t = self.ui.find.text()
-            self.setFind(t)
+            if unicode(t) != self.findText:
+                self.setFind(t)
+
+        def onFindEdited(self,t):
+            self.findTimer.start()
             
         def onFindClosed(self):
+            self.findTimer.stop()
             self.setFind("")
 
+        @traced("setFind")
         def setFind(self,t):
-            print "find... text:", t
+            battrace.log("find... text:", t)
+            self.findText = unicode(t)
             self.filterForceRemoveEmptyDirectories = len(t) > 0
-            regExp = QRegExp( t, Qt.CaseSensitive, QRegExp.PatternSyntax(QRegExp.RegExp))
-            self.proxyModel.setFilterKeyColumn( 0 )
-            self.proxyModel.setFilterRegExp(regExp)
-            self.treeview.expandAll()
+            self.proxyModel.findChanged( self.findMatches( self.findText ) )
+            ## only the paths to the new matches are opened
+            self.treeview.collapseAll()
+            self.expandTree()
+
+        def findMatches(self,t):
+            """
+            Return for every node in the tree whether it matches the query t,
+            or None when t is empty. See batsearch for the query syntax.
+            """
+            if self.searchindex is None:
+                return None
+            return self.searchindex.search( t )
                 
 
         def setConfig(self,config):
@@ -763,6 +1154,34 @@ class StartBATGUI(QMainWindow):
 			elif s == 'viewer':
 				if config.has_option(s, 'htmldir'):
 					self.htmldir = config.get(s, 'htmldir')
+				## size of the cache of report pages, in MB and pages
+				maxbytes = self.pagecache.maxbytes
+				maxentries = self.pagecache.maxentries
+				if config.has_option(s, 'pagecachesize'):
+					maxbytes = config.getint(s, 'pagecachesize') * 1024 * 1024
+				if config.has_option(s, 'pagecacheentries'):
+					maxentries = config.getint(s, 'pagecacheentries')
+				self.pagecache.setLimits(maxbytes, maxentries)
+				if config.has_option(s, 'prefetchneighbours'):
+					self.prefetchNeighbourCount = config.getint(s, 'prefetchneighbours')
+				## how much of the tree is expanded after loading and finding
+				if config.has_option(s, 'expanddepth'):
+					self.expandDepth = config.getint(s, 'expanddepth')
+				if config.has_option(s, 'expandlimit'):
+					self.expandLimit = config.getint(s, 'expandlimit')
+				## where decompressed reports are kept between sessions, and how
+				## many MB of them
+				if config.has_option(s, 'reportcachedir'):
+					if self.reportcache is not None:
+						self.reportcache.close()
+					self.reportcache = self.openReportCache( config.get(s, 'reportcachedir') )
+				if config.has_option(s, 'reportcachesize') and self.reportcache is not None:
+					self.reportcache.setLimit( config.getint(s, 'reportcachesize') * 1024 * 1024 )
+				if config.has_option(s, 'sessiondir'):
+					self.sessionDir = config.get(s, 'sessiondir')
+				## where decompressed source files are kept between sessions
+				if config.has_option(s, 'sourcecachedir'):
+					self.sourceCacheDir = config.get(s, 'sourcecachedir')
 			else:
 				try:
 					## process each section. We need: section name, description, enabled
@@ -777,67 +1196,252 @@ class StartBATGUI(QMainWindow):
 				self.scanconfigstate.append(self.scanconfig.index(s))
                 
         def setup(self):
-                print "setup..."
+                battrace.log("setup...")
+
+        def openReportCache(self, cachedir):
+                """
+                Return the ReportCache in 'cachedir', or None if it cannot be
+                used. Reports are then read from the archive every time.
+                """
+                try:
+                    return ReportCache( cachedir )
+                except (IOError, OSError, sqlite3.Error), e:
+                    print >>sys.stderr, "Not caching reports in", cachedir, ":", e
+                    return None
 
         def openTar( self, filepath, flags = 'r' ):
-                print "openTar(1)"
-		try:
-                    tar = tarfile.open( filepath, "%s%s" % (flags,':gz'))
-                    return tar
-		except Exception, e:
-                    tar = tarfile.open( filepath, flags)
-                    return tar
-
-	def openBATFile(self,filepath):
-	        ## should be an archive with inside:
-	        ## * scandata.pickle
-	        ## * data directory
-	        ## * images directory (optional)
-	        self.tmpdir = tempfile.mkdtemp()
-		try:
-		  self.tarfile = filepath
-#		  tar = tarfile.open(self.tarfile, 'r:gz')
-                  tar = self.openTar( self.tarfile )
-                  
-		  self.tarmembers = tar.getmembers()
-		  members = []
-		  for i in ['scandata.pickle']:
-		    members = members + filter(lambda x: x.name.startswith(i), self.tarmembers)
-
-		  ## If we are not in advanced mode, there is no need to unpack everything. The hexdump
-		  ## files and "TV static" pictures can be quite big, so don't unpack them when not needed.
-		  if not self.advanced:
-		    members = members + filter(lambda x: x.name.startswith('reports') and x.name.endswith('unique.html.gz'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('reports') and x.name.endswith('unmatched.html.gz'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('reports') and x.name.endswith('assigned.html.gz'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('reports') and x.name.endswith('guireport.html.gz'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('reports') and x.name.endswith('elfreport.html.gz'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('reports') and x.name.endswith('names.html.gz'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('images') and len(os.path.basename(x.name)) != 68, self.tarmembers)
-		  else:
-		    members = members + filter(lambda x: x.name.startswith('reports'), self.tarmembers)
-		    members = members + filter(lambda x: x.name.startswith('images'), self.tarmembers)
-                    
-	          self.advancedunpacked = True
-		  tar.extractall(self.tmpdir, members)
-		  tar.close()
-		except Exception, e:
-		  os.rmdir(self.tmpdir)
-		  return
-		self.datadir = os.path.join(self.tmpdir, "data")
-		self.imagesdir = os.path.join(self.tmpdir, "images")
-		self.reportsdir = os.path.join(self.tmpdir, "reports")
-		picklefile = open(os.path.join(self.tmpdir, "scandata.pickle") , 'rb')
-		self.unpackreports = cPickle.load(picklefile)
-		picklefile.close()
-#		self.selectedfile = None
-		self.initTree(self.datadir)
+                return openTar( filepath, flags )
+
+        def openBATFile(self,filepath):
+                ## should be an archive with inside:
+                ## * scandata.pickle
+                ## * data directory
+                ## * images directory (optional)
+                ##
+                ## The archive is loaded by a BATLoader on a worker thread. Only
+                ## scandata.pickle is extracted there, reports are extracted by
+                ## the archive the first time they are needed and images are
+                ## read from it through bat:// URLs without extracting them. The
+                ## pickle is converted to a database next to the archive once,
+                ## after that it is not even extracted.
+                self.cancelLoad()
+                self.closeArchive()
+                self.tmpdir = tempfile.mkdtemp()
+                self.tarfile = filepath
+                self.datadir = os.path.join(self.tmpdir, "data")
+                self.reportsdir = os.path.join(self.tmpdir, "reports")
+                ## the decompressed sources are kept between sessions
+                self.sources = SourceCache(self.sourceCacheDir)
+
+                extractAll = None
+                if not self.extractOnDemand:
+                    ## If we are not in advanced mode, there is no need to unpack everything. The hexdump
+                    ## files can be quite big, so don't unpack them when not needed.
+                    if not self.advanced:
+                        basicReportPages = self.basicReportPages
+                        extractAll = lambda x: x.startswith('reports') and x.endswith(basicReportPages)
+                    else:
+                        extractAll = lambda x: x.startswith('reports')
+                self.advancedunpacked = self.advanced
+
+                self.cleanWindows()
+                self.ui.action_diff_only.setChecked( False )
+                self.proxyModel.setVisibility( None )
+                self.searchindex = None
+                self.duplicates = None
+                self.treemodel.clear()
+
+                self.loader = BATLoader( self.tarfile, self.tmpdir, extractAll, self, self.sessionDir )
+                self.loader.progress.connect(self.onLoadProgress)
+                self.loader.storeReady.connect(self.onLoadStoreReady)
+                self.loader.layoutStarted.connect(self.onLoadLayoutStarted)
+                self.loader.levelReady.connect(self.onLoadLevelReady)
+                self.loader.layoutFinished.connect(self.onLoadLayoutFinished)
+                self.loader.finished.connect(self.onLoadFinished)
+                self.loadProgress.setRange( 0, 0 )
+                self.loadProgress.show()
+                self.loadCancelButton.show()
+                self.loader.start()
+
+        def closeArchive(self):
+                ## the page jobs and the prefetcher read from the archive and
+                ## the extraction directory, let them finish before those go.
+                ## Jobs that have not started yet are dropped.
+                self.pagepool.clear()
+                self.pagepool.waitForDone()
+                self.prefetcher.cancel()
+                with self.hexdumplock:
+                    for report in self.hexdumps.itervalues():
+                        report.close()
+                    self.hexdumps.clear()
+                self.scanindexes.clear()
+                self.diff = None
+                if self.sources is not None:
+                    self.sources.close()
+                    self.sources = None
+                self.pagecache.clear()
+                if self.archive is not None:
+                    self.archive.close()
+                    self.archive = None
+                if self.scandata is not None:
+                    self.scandata.close()
+                    self.scandata = None
+                if self.tmpdir is not None:
+                    shutil.rmtree( self.tmpdir, True )
+                    self.tmpdir = None
+
+        def cancelLoad(self):
+                """
+                Stop loading an archive, if that is going on, and wait for it.
+                """
+                if self.loader is not None:
+                    self.loader.cancel()
+                    self.loader.wait()
+                    self.loader = None
+                    self.loadProgress.hide()
+                    self.loadCancelButton.hide()
+                    self.ui.statusbar.clearMessage()
+
+        def onCancelLoad(self):
+                if self.loader is not None:
+                    self.loader.cancel()
+
+        ## The slots below ignore signals of a loader that was replaced
+        ## by a newer one, those can still be queued.
+
+        def onLoadProgress(self, stage, done, total):
+                if self.sender() is not self.loader:
+                    return
+                self.ui.statusbar.showMessage( stage )
+                self.loadProgress.setRange( 0, total )
+                self.loadProgress.setValue( done )
+
+        def onLoadStoreReady(self, archive, dbpath):
+                if self.sender() is not self.loader:
+                    archive.close()
+                    return
+                self.archive = archive
+                self.scandata = ScanStore( dbpath )
+
+        def onLoadLayoutStarted(self, layout):
+                if self.sender() is not self.loader:
+                    return
+                self.treemodel.startLayout( layout )
+
+        def onLoadLevelReady(self, end):
+                if self.sender() is not self.loader:
+                    return
+                self.treemodel.appendNodes( end )
+
+        def onLoadFinished(self):
+                loader = self.sender()
+                if loader is not self.loader:
+                    return
+                self.loader = None
+                self.loadProgress.hide()
+                self.loadCancelButton.hide()
+                self.ui.statusbar.clearMessage()
+                if loader.error is not None or loader.cancelled:
+                    self.treemodel.clear()
+                    self.closeArchive()
+                    if loader.error is not None:
+                        self.showError( loader.error )
+                    else:
+                        self.ui.statusbar.showMessage( "Loading cancelled", 5000 )
+
+        def onLoadLayoutFinished(self):
+                """
+                The tree is complete, the loader may still write its session.
+                """
+                if self.sender() is not self.loader:
+                    return
+                self.loadCancelButton.hide()
+                layout = self.treemodel.layout
+                self.treemodel.finishLayout()
+                if layout is not None:
+                    self.initTree( layout )
+                if not self.startupReported:
+                    self.startupReported = True
+                    battrace.since( "startup.treeloaded", STARTTIME )
+
+        def closeEvent(self, event):
+                self.cancelLoad()
+                self.prefetcher.stop()
+                self.pagepool.waitForDone()
+                self.closeArchive()
+                battrace.setCounter( "pagecache.hits", self.pagecache.hits )
+                battrace.setCounter( "pagecache.misses", self.pagecache.misses )
+                battrace.setCounter( "prefetched", self.prefetcher.prefetched )
+                if self.reportcache is not None:
+                    battrace.setCounter( "reportcache.hits", self.reportcache.hits )
+                    battrace.setCounter( "reportcache.misses", self.reportcache.misses )
+                    self.reportcache.close()
+                QMainWindow.closeEvent( self, event )
+
+        def extractIfArchiveMember(self, p):
+                """
+                If 'p' points into the extraction directory of the open archive
+                make sure the member it refers to has been extracted.
+                """
+                if self.archive is None or os.path.exists(p):
+                    return p
+                prefix = os.path.join(self.tmpdir, '')
+                if p.startswith(prefix):
+                    self.archive.extract(p[len(prefix):])
+                return p
+
+        def findSourceFile(self, p):
+                """
+                Return the path of the source file 'p', with the extension
+                of the compression it was written with when 'p' has none,
+                extracted from the open archive if needed.
+                """
+                candidates = sourceCandidates(p)
+                for candidate in candidates:
+                    if os.path.exists(candidate):
+                        return candidate
+                    if self.archive is not None:
+                        prefix = os.path.join(self.tmpdir, '')
+                        if candidate.startswith(prefix) and self.archive.hasMember(candidate[len(prefix):]):
+                            return self.extractIfArchiveMember(candidate)
+                return candidates[0]
+
+        def openReport(self, sha256sum, name):
+                """
+                Return a file object for the report 'name' for the file with
+                checksum sha256sum, read straight from the archive without
+                extracting it. Returns None if there is no such report.
+                """
+                if self.archive is None:
+                    return None
+                membername = "reports/%s-%s" % (sha256sum, name)
+                if not self.extractOnDemand:
+                    reportpath = self.archive.localPath(membername)
+                    if os.path.exists(reportpath):
+                        return open(reportpath, 'rb')
+                    return None
+                return self.archive.openMember(membername)
+
+        def extractReport(self, sha256sum, name):
+                """
+                Return the local path of the report 'name' for the file with
+                checksum sha256sum, extracting it from the archive if needed.
+                Returns None if there is no such report.
+                """
+                if self.archive is None:
+                    return None
+                membername = "reports/%s-%s" % (sha256sum, name)
+                if not self.extractOnDemand:
+                    reportpath = self.archive.localPath(membername)
+                    if os.path.exists(reportpath):
+                        return reportpath
+                    return None
+                return self.archive.extract(membername)
                 
 
 	def cleanWindows(self):
-                print "cleanwindows..."
-                frame = self.ui.web.page().mainFrame()
-                frame.evaluateJavaScript('OnSelectionCleared();')
+                battrace.log("cleanwindows...")
+                self.runJavaScript('OnSelectionCleared();')
 		# self.overviewwindow.SetPage(helphtml)
 		# self.matcheswindow.SetPage('<html></html>')
 		# self.matchesbrowser.SetPage("<html></html>")
@@ -848,48 +1452,36 @@ class StartBATGUI(QMainWindow):
 		# self.elfwindow.SetPage("<html></html>")
 
                 
-	def initTree(self, tmpdir):
-		if tmpdir == None:
-			return
-		self.cleanWindows()
-
-                print "initTree() self.selectedfile:", self.selectedfile
-                    
-		## construct a tree from a pickle
-		if tmpdir.endswith('/'):
-			tmpdir = tmpdir[:-1]
+	def initTree(self, layout):
+                battrace.log("initTree() self.selectedfile:", self.selectedfile)
 
-                self.setupFromBAT()
+                self.setupFromBAT( layout )
 
                 hadSelectedAnything = False
 		if self.selectedfile != None:
-                    print "reslectring self.selectedfile:", self.selectedfile
+                    battrace.log("reslectring self.selectedfile:", self.selectedfile)
                     hadSelectedAnything = self.selectAndDisplay( self.selectedfile )
 
                 #if not hadSelectedAnything:
 		#    self.cleanWindows()
                     
 
-        def treevisitor_selectFile( self, model, node, arg ):
-            j = QMIToPath(model,node)
-            #print "xx arg:", arg, " child: ", j
-            if j == arg:
-                self.hadSelectedAnything = True
-                self.treeview.selectionModel().setCurrentIndex(
-                    node,
-                    QItemSelectionModel.Select | QItemSelectionModel.Rows  )
-                self.onTreeClicked(node)
-
-                
         """ Select the file in the main treeview with the given path and Scroll to show 
             it in the main UI
         """
+        @traced("selectAndDisplay")
         def selectAndDisplay( self, path ):
-                print "selecting:", path
+                battrace.log("selecting:", path)
                 self.treeview.clearSelection()
-                self.hadSelectedAnything = False
-                treevisit( self.proxyModel, self.treevisitor_selectFile, path )
-                return self.hadSelectedAnything
+                node = PathToQMI( self.proxyModel, path, self.treemodel )
+                if node is None:
+                    return False
+                self.treeview.selectionModel().setCurrentIndex(
+                    node,
+                    QItemSelectionModel.Select | QItemSelectionModel.Rows  )
+                self.treeview.scrollTo( node )
+                self.onTreeClicked(node)
+                return True
                 
 
                 
@@ -901,6 +1493,16 @@ if __name__ == "__main__":
                           help="path to configuration file", metavar="FILE")
 	parser.add_option("-f", "--file",   action="store", dest="inputfilename",
                           help="path to bat-scan output file to open", metavar="FILE")
+	parser.add_option("--cache-stats", action="store_true", dest="cachestats",
+                          help="show what is in the report cache and exit")
+	parser.add_option("--clear-cache", action="store_true", dest="clearcache",
+                          help="empty the report cache and exit")
+	parser.add_option("--trace", action="store", dest="trace",
+                          help="write the time taken by the traced functions and the counters to FILE at exit "
+                               "(also $%s)" % battrace.TRACEENV, metavar="FILE")
+	parser.add_option("--trace-events", action="store", dest="traceevents",
+                          help="write every traced call to FILE as a Chrome trace at exit "
+                               "(also $%s)" % battrace.EVENTSENV, metavar="FILE")
 	(options, args) = parser.parse_args()
 
 	if options.cfg != None:
@@ -912,11 +1514,26 @@ if __name__ == "__main__":
                         print >>sys.stderr, "Reason:", e
 			sys.exit(1)
 
+	if options.cachestats or options.clearcache:
+		cachedir = defaultReportCacheDir()
+		if config.has_option('viewer', 'reportcachedir'):
+			cachedir = config.get('viewer', 'reportcachedir')
+		reportcache = ReportCache(cachedir)
+		if options.clearcache:
+			reportcache.clear()
+		print reportcache.stats()
+		reportcache.close()
+		sys.exit(0)
+
+	if options.trace != None or options.traceevents != None:
+		battrace.enable(options.trace, options.traceevents)
+
 	app = QApplication(sys.argv)
 	myapp = StartBATGUI(scriptDir)
         myapp.setConfig(config)
         myapp.setup()
 	myapp.show()
+	battrace.since("startup.shown", STARTTIME)
 
 	if options.inputfilename != None:
 	    myapp.openFile( options.inputfilename )
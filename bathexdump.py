@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Random access to the rows of a hexdump report (reports/<sha256>-hexdump.gz).
+
+A hexdump report has one row of text for every 16 bytes of a file, which
+makes it about five times as big as the file itself. Rather than reading
+it from the start, the report is decompressed through a GzipSeekIndex.
+When all rows have the same length (the usual "hexdump -C" layout) row n
+starts at n times that length, so any window of rows is read with a seek.
+Reports with rows of different lengths are scanned once to record where
+every LINEINDEXSPACING'th row starts.
+'''
+
+import threading
+import numpy
+from batarchive import GzipSeekIndex, READ_CHUNKSIZE
+
+BYTESPERROW      = 16
+LINEINDEXSPACING = 1024
+
+
+class HexdumpReport:
+    """
+    The rows of one hexdump report, 'fileobj' is the gzip compressed report.
+    rows(first, count) returns the text of rows first .. first+count-1,
+    it can be called from more than one thread.
+
+    A thread that uses the report holds it with acquire() and gives it
+    back with release(). close() waits for the last release() before the
+    report is really closed.
+    """
+    def __init__(self, fileobj):
+        self.data = GzipSeekIndex(fileobj)
+        firstline = self._readFrom(0, 1)
+        if len(firstline) == 1:
+            self.width = len(firstline[0]) + 1
+        else:
+            self.width = 0
+        ## offset of every LINEINDEXSPACING'th row, for reports with rows
+        ## which are not all the same length
+        self.linestarts = None
+        self.lock = threading.Lock()
+        self.users = 0
+        self.closing = False
+        self.uselock = threading.Lock()
+
+    def acquire(self):
+        with self.uselock:
+            self.users += 1
+
+    def release(self):
+        with self.uselock:
+            self.users -= 1
+            if self.users > 0 or not self.closing:
+                return
+        self.data.close()
+
+    def close(self):
+        with self.uselock:
+            self.closing = True
+            if self.users > 0:
+                return
+        self.data.close()
+
+    def _readFrom(self, pos, count):
+        """
+        Return up to 'count' lines, without their newline, starting at 'pos'.
+        """
+        self.data.seek(pos)
+        lines = []
+        rest = ''
+        while len(lines) < count:
+            chunk = self.data.read(READ_CHUNKSIZE)
+            if chunk == '':
+                if rest != '':
+                    lines.append(rest)
+                break
+            pieces = (rest + chunk).split('\n')
+            rest = pieces.pop()
+            lines.extend(pieces)
+        return lines[:count]
+
+    def _fixedRows(self, first, count, backedup = False):
+        """
+        Read rows assuming they all have the same width. Returns None if
+        that turns out not to be the case.
+        """
+        self.data.seek(first * self.width)
+        data = self.data.read(count * self.width)
+        if len(data) < count * self.width and first > 0 and not backedup:
+            ## near the end of the report, the last row with data can be
+            ## shorter, which moves the row after it. Read from a bit earlier.
+            back = min(first, 2)
+            lines = self._fixedRows(first - back, count + back, True)
+            if lines is None:
+                return None
+            return lines[back:]
+        atend = len(data) < count * self.width
+        lines = data.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        for (n, line) in enumerate(lines):
+            if line.startswith('%08x' % ((first + n) * BYTESPERROW)) \
+               and (len(line) + 1 == self.width or atend):
+                continue
+            ## the report ends with a row that only has the size of the file
+            if atend and n == len(lines) - 1 and len(line.split()) == 1:
+                continue
+            return None
+        return lines[:count]
+
+    def _buildLineIndex(self):
+        starts = [numpy.zeros(1, dtype=numpy.int64)]
+        self.data.seek(0)
+        pos = 0
+        row = 0
+        while True:
+            chunk = self.data.read(READ_CHUNKSIZE)
+            if chunk == '':
+                break
+            newlines = numpy.flatnonzero(numpy.frombuffer(chunk, dtype=numpy.uint8) == 10)
+            ## the row after newlines[i] is row + i + 1
+            i = (LINEINDEXSPACING - (row + 1) % LINEINDEXSPACING) % LINEINDEXSPACING
+            starts.append(pos + newlines[i::LINEINDEXSPACING] + 1)
+            row += len(newlines)
+            pos += len(chunk)
+        self.linestarts = numpy.concatenate(starts)
+
+    def rows(self, first, count):
+        with self.lock:
+            return self._rows(first, count)
+
+    def _rows(self, first, count):
+        if self.linestarts is None and self.width > 0:
+            lines = self._fixedRows(first, count)
+            if lines is not None:
+                return lines
+        if self.linestarts is None:
+            self._buildLineIndex()
+        k = first // LINEINDEXSPACING
+        if k >= len(self.linestarts):
+            return []
+        lines = self._readFrom(int(self.linestarts[k]), first % LINEINDEXSPACING + count)
+        return lines[first % LINEINDEXSPACING:]
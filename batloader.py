@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Loading of a BAT result archive on a worker thread.
+
+The loader opens the archive, reads (or converts) the scan data and builds
+the file tree, while the GUI stays responsive. The tree is handed over one
+level at a time, so the top level directories can be browsed while the
+deeper levels are still being built.
+
+A tree that was built before for the same archive is mapped from its
+session file (see batsession) instead, a new tree is written to one.
+'''
+
+import os
+from PyQt5.QtCore import QThread, pyqtSignal
+import battrace
+from batarchive   import BATArchive
+from batstore     import ScanStore
+from battree      import iterBuildTree, treeLevels, TreeLayout
+from batsession   import openSession, writeSession
+from batdiff      import ScanDiff
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class BATLoader(QThread):
+    """
+    Load the archive 'filepath', extracting into 'extractdir'.
+
+    The signals are emitted in this order:
+      progress(stage, done, total)  while loading, total is 0 when unknown
+      storeReady(archive, dbpath)   the archive and scan data can be used,
+                                    the GUI thread has to open its own
+                                    ScanStore on dbpath
+      layoutStarted(layout)         the battree.TreeLayout that is built
+      levelReady(end)               the layout has nodes up to 'end'
+      layoutFinished()              the layout is complete
+    followed by finished(). If loading failed 'error' is set afterwards,
+    if it was cancelled 'cancelled' is. A tree that was built is written
+    to its session between layoutFinished() and finished(), that can no
+    longer be cancelled and does not fail the load.
+
+    With 'extractAll' set to a predicate, the members for which it is
+    true are all extracted before the archive is handed over. Sessions
+    that cannot be kept next to the archive are kept in 'sessiondir'.
+    """
+    progress      = pyqtSignal(str, int, int)
+    storeReady    = pyqtSignal(object, str)
+    layoutStarted = pyqtSignal(object)
+    levelReady    = pyqtSignal(int)
+    layoutFinished = pyqtSignal()
+
+    def __init__(self, filepath, extractdir, extractAll = None, parent = None, sessiondir = None):
+        super(BATLoader, self).__init__(parent)
+        self.filepath   = filepath
+        self.extractdir = extractdir
+        self.extractAll = extractAll
+        self.sessiondir = sessiondir
+        self.cancelled  = False
+        self.error      = None
+        self.layoutDone = False
+
+    def cancel(self):
+        """
+        Stop loading at the next opportunity, call wait() to wait for that.
+        """
+        if not self.layoutDone:
+            self.cancelled = True
+
+    def _progress(self, stage, done = 0, total = 0):
+        if self.cancelled:
+            raise LoadCancelled()
+        self.progress.emit(stage, done, total)
+
+    def _extractScanData(self):
+        self._progress("Reading archive index")
+        picklepath = self.archive.extract('scandata.pickle')
+        if picklepath is None:
+            raise Exception("no scandata.pickle in %s" % self.filepath)
+        return picklepath
+
+    def run(self):
+        self.archive = None
+        store = None
+        try:
+            self._progress("Opening archive")
+            self.archive = BATArchive( self.filepath, self.extractdir )
+            store = ScanStore.open( self.filepath, self._extractScanData, self.extractdir,
+                                    lambda done, total: self._progress("Converting scan data", done, total) )
+            if self.extractAll is not None:
+                self._progress("Extracting reports")
+                self.archive.extractAll( self.extractAll )
+            self.storeReady.emit( self.archive, store.dbpath )
+            self.archive = None
+
+            self._progress("Opening session")
+            layout = openSession( self.filepath, self.sessiondir )
+            if layout is not None:
+                self.layoutStarted.emit( layout )
+                for (start, end) in treeLevels( layout.parents, layout.childstart, layout.childcount ):
+                    self.levelReady.emit( end )
+                self._finishLayout()
+            else:
+                self._buildLayout( store )
+        except LoadCancelled:
+            pass
+        except Exception, e:
+            self.error = "Could not load %s: %s" % (os.path.basename(self.filepath), e)
+        if store is not None:
+            store.close()
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def _buildLayout(self, store):
+        """
+        Build the tree from the scan data in 'store', one level at a time,
+        and write it to the session of the archive.
+        """
+        self._progress("Reading scan data")
+        total = len(store)
+        started = False
+        for (layout, end) in iterBuildTree( store.iterTreeReports(),
+                                            lambda done: self._progress("Building tree", done, total) ):
+            if not started:
+                self.layoutStarted.emit( layout )
+                started = True
+            self._progress("Building tree", total, total)
+            self.levelReady.emit( end )
+        self._finishLayout()
+        if started:
+            ## the GUI goes on with the tree meanwhile
+            self.progress.emit("Writing session", 0, 0)
+            try:
+                writeSession( self.filepath, layout, self.sessiondir )
+            except Exception, e:
+                battrace.log("Could not write the session of", self.filepath, ":", e)
+
+    def _finishLayout(self):
+        if self.cancelled:
+            raise LoadCancelled()
+        self.layoutDone = True
+        self.layoutFinished.emit()
+
+
+class DiffLoader(BATLoader):
+    """
+    Compare the scan data in the database 'dbpath' (of the open archive)
+    with the older archive 'filepath', extracting into 'extractdir'. The
+    tree of both is built, with the files tagged with their batdiff state.
+    Without 'filepath' the tree of the open archive alone is built again.
+
+    Emits progress(stage, done, total) while working and then
+    treeReady(layout, diff), where diff is the batdiff.ScanDiff or None,
+    followed by finished(). 'error' and 'cancelled' are as for BATLoader.
+    """
+    treeReady = pyqtSignal(object, object)
+
+    def __init__(self, dbpath, filepath, extractdir, parent = None):
+        super(DiffLoader, self).__init__(filepath, extractdir, None, parent)
+        self.dbpath = dbpath
+
+    def run(self):
+        self.archive = None
+        store = None
+        other = None
+        try:
+            store = ScanStore( self.dbpath )
+            if self.filepath is None:
+                self.treeReady.emit( self._buildTree( store.iterTreeReports(), len(store) ), None )
+                return
+            self._progress("Opening archive")
+            self.archive = BATArchive( self.filepath, self.extractdir )
+            other = ScanStore.open( self.filepath, self._extractScanData, self.extractdir,
+                                    lambda done, total: self._progress("Converting scan data", done, total) )
+            self._progress("Comparing")
+            diff = ScanDiff( other.iterChecksums(), store.iterChecksums() )
+            reports = diff.treeReports( store.iterTreeReports(), other.iterTreeReports() )
+            self.treeReady.emit( self._buildTree( reports, len(diff) ), diff )
+        except LoadCancelled:
+            pass
+        except Exception, e:
+            self.error = "Could not compare with %s: %s" % (os.path.basename(self.filepath or ''), e)
+        finally:
+            if store is not None:
+                store.close()
+            if other is not None:
+                other.close()
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+
+    def _buildTree(self, reports, total):
+        layout = TreeLayout()
+        for (layout, end) in iterBuildTree( reports,
+                                            lambda done: self._progress("Building tree", done, total) ):
+            self._progress("Building tree", total, total)
+        return layout
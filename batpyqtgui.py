@@ -36,6 +36,8 @@ class Ui_batpyqtgui(object):
         self.menu_edit.setObjectName("menu_edit")
         self.action_find = QtWidgets.QAction(batpyqtgui)
         self.action_find.setObjectName("action_find")
+        self.action_next_copy = QtWidgets.QAction(batpyqtgui)
+        self.action_next_copy.setObjectName("action_next_copy")
         self.menu_configuration = QtWidgets.QMenu(self.My_menu)
         self.menu_configuration.setObjectName("menu_configuration")
         self.action_configation_open = QtWidgets.QAction(batpyqtgui)
@@ -44,6 +46,15 @@ class Ui_batpyqtgui(object):
         self.action_configation_filter.setObjectName("action_configation_filter")
         self.action_configation_general = QtWidgets.QAction(batpyqtgui)
         self.action_configation_general.setObjectName("action_configation_general")
+        self.menu_compare = QtWidgets.QMenu(self.My_menu)
+        self.menu_compare.setObjectName("menu_compare")
+        self.action_compare = QtWidgets.QAction(batpyqtgui)
+        self.action_compare.setObjectName("action_compare")
+        self.action_diff_only = QtWidgets.QAction(batpyqtgui)
+        self.action_diff_only.setCheckable(True)
+        self.action_diff_only.setObjectName("action_diff_only")
+        self.action_stop_comparing = QtWidgets.QAction(batpyqtgui)
+        self.action_stop_comparing.setObjectName("action_stop_comparing")
         self.actionA = QtWidgets.QAction(batpyqtgui)
         self.actionA.setObjectName("actionA")
         self.actionB = QtWidgets.QAction(batpyqtgui)
@@ -86,8 +97,11 @@ class Ui_batpyqtgui(object):
         self.verticalLayout.addWidget(self.tree)
         self.action_show_find_area = QtWidgets.QAction(batpyqtgui)
         self.action_show_find_area.setObjectName("action_show_find_area")
-        self.web = QtWebKitWidgets.QWebView(self.splits)
-        self.web.setObjectName("web")
+        self.webArea = QtWidgets.QWidget(self.splits)
+        self.webArea.setObjectName("webArea")
+        self.webLayout = QtWidgets.QVBoxLayout(self.webArea)
+        self.webLayout.setContentsMargins(0, 0, 0, 0)
+        self.webLayout.setObjectName("webLayout")
         self.gridlayout.addWidget(self.splits, 1, 0, 100, 3)
         batpyqtgui.setCentralWidget(self.centralwidget)
         self.menubar = QtWidgets.QMenuBar(batpyqtgui)
@@ -100,16 +114,25 @@ class Ui_batpyqtgui(object):
         self.menu_file.addAction(self.action_open)
         self.menu_file.addAction(self.action_exit)
         self.menu_edit.addAction(self.action_find)
+        self.menu_edit.addAction(self.action_next_copy)
+        self.menu_compare.addAction(self.action_compare)
+        self.menu_compare.addAction(self.action_diff_only)
+        self.menu_compare.addAction(self.action_stop_comparing)
         self.menu_configuration.addAction(self.action_configation_open)
         self.menu_configuration.addAction(self.action_configation_general)
         self.menu_configuration.addAction(self.action_configation_filter)
         self.My_menu.addAction(self.menu_file.menuAction())
         self.My_menu.addAction(self.menu_edit.menuAction())
+        self.My_menu.addAction(self.menu_compare.menuAction())
         self.My_menu.addAction(self.menu_configuration.menuAction())
 
         self.retranslateUi(batpyqtgui)
         self.action_open.triggered.connect(batpyqtgui.onOpenFile)
         self.action_exit.triggered.connect(batpyqtgui.close)
+        self.action_next_copy.triggered.connect(batpyqtgui.onNextCopy)
+        self.action_compare.triggered.connect(batpyqtgui.onCompareFile)
+        self.action_diff_only.toggled['bool'].connect(batpyqtgui.onDiffOnlyToggled)
+        self.action_stop_comparing.triggered.connect(batpyqtgui.onStopComparing)
         self.action_configation_filter.triggered.connect(batpyqtgui.onOpenFilterDialog)
         self.action_configation_open.triggered.connect(batpyqtgui.onConfigurationOpen)
         self.action_find.triggered.connect(self.FindArea.show)
@@ -130,6 +153,12 @@ class Ui_batpyqtgui(object):
         self.menu_edit.setTitle(_translate("batpyqtgui", "Edit"))
         self.action_find.setText(_translate("batpyqtgui", "Find"))
         self.action_find.setShortcut(_translate("batpyqtgui", "Ctrl+F"))
+        self.action_next_copy.setText(_translate("batpyqtgui", "Next copy"))
+        self.action_next_copy.setShortcut(_translate("batpyqtgui", "Ctrl+J"))
+        self.menu_compare.setTitle(_translate("batpyqtgui", "Compare"))
+        self.action_compare.setText(_translate("batpyqtgui", "Compare with..."))
+        self.action_diff_only.setText(_translate("batpyqtgui", "Only show differences"))
+        self.action_stop_comparing.setText(_translate("batpyqtgui", "Stop comparing"))
         self.menu_configuration.setTitle(_translate("batpyqtgui", "Configuration"))
         self.action_configation_open.setText(_translate("batpyqtgui", "Open Configration"))
         self.action_configation_filter.setText(_translate("batpyqtgui", "Filter Configration"))
@@ -140,5 +169,3 @@ class Ui_batpyqtgui(object):
         self.closeFindAreaButton.setText(_translate("batpyqtgui", "X"))
         self.action_show_find_area.setText(_translate("batpyqtgui", "Find..."))
         self.action_show_find_area.setShortcut(_translate("batpyqtgui", "Ctrl+F"))
-
-from PyQt5 import QtWebKitWidgets
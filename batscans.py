@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Index of the scans of one file (the files that were unpacked from it), by
+the range of bytes they cover. This module does not depend on Qt.
+
+The scans are sorted on their start offset. Next to the end offsets the
+running maximum of the end offsets is kept, which never decreases, so the
+scans that can cover an offset are found with two binary searches and
+checked with a single vectorized comparison.
+'''
+
+import numpy
+
+
+class ScanIndex:
+    """
+    Interval index over a list of scans, dictionaries with 'offset',
+    'scanname' and 'size' as in the unpackreports. A scan of size 0 is
+    taken to cover the byte at its offset.
+    """
+    def __init__(self, scans):
+        scans = sorted((s['offset'], s['scanname'], s['size']) for s in scans)
+        self.scans  = scans
+        self.starts = numpy.array([s[0] for s in scans], dtype=numpy.int64)
+        self.ends   = self.starts + numpy.maximum(numpy.array([s[2] for s in scans], dtype=numpy.int64), 1)
+        if len(scans) > 0:
+            self.maxends = numpy.maximum.accumulate(self.ends)
+        else:
+            self.maxends = self.ends
+
+    def __len__(self):
+        return len(self.scans)
+
+    def overlapping(self, start, end):
+        """
+        Return the numbers of the scans which cover any of the bytes
+        start .. end-1, in order of their offset.
+        """
+        lo = numpy.searchsorted(self.maxends, start, 'right')
+        hi = numpy.searchsorted(self.starts, end, 'left')
+        if lo >= hi:
+            return []
+        return (lo + numpy.flatnonzero(self.ends[lo:hi] > start)).tolist()
+
+    def covering(self, offset):
+        """
+        Return the scans (offset, scanname, size) which cover the byte at
+        'offset'.
+        """
+        return [self.scans[n] for n in self.overlapping(offset, offset + 1)]
+
+    def rowAnnotations(self, first, count, rowsize):
+        """
+        Return for the rows first .. first+count-1, of 'rowsize' bytes
+        each, a list of (starts, covers): the scans which start in that
+        row and the scans which cover it without starting in it.
+        """
+        rows = [([], []) for n in xrange(count)]
+        for n in self.overlapping(first * rowsize, (first + count) * rowsize):
+            scan = self.scans[n]
+            startrow = int(self.starts[n]) // rowsize
+            endrow   = (int(self.ends[n]) - 1) // rowsize
+            if startrow >= first:
+                rows[startrow - first][0].append(scan)
+            for r in xrange(max(startrow + 1, first), min(endrow, first + count - 1) + 1):
+                rows[r - first][1].append(scan)
+        return rows
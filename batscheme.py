@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+The bat:// URL scheme of the web view.
+
+bat://images/<name> is the member images/<name> of the open archive, read
+straight from the archive without extracting it, on a thread pool. The reports refer to their
+pictures as REPLACEME/<name>, relative to the page. Those URLs are served
+the same way, so the report HTML can be shown as it is in the archive.
+'''
+
+import mimetypes
+from PyQt5.QtCore    import QIODevice, QRunnable, pyqtSignal
+from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkReply, QNetworkRequest
+from batarchive      import READ_CHUNKSIZE
+
+SCHEME = 'bat'
+
+## the directory the reports put in front of the names of their pictures
+REPORTIMAGEDIR = 'REPLACEME'
+
+
+def memberForUrl(url):
+    """
+    Return the name of the archive member that the QUrl 'url' refers to,
+    or None if it is not a bat:// URL or a picture of a report.
+    """
+    path = url.path()
+    if url.scheme() == SCHEME:
+        member = url.host() + path
+    else:
+        parts = path.split('/')
+        if len(parts) < 2 or parts[-2] != REPORTIMAGEDIR:
+            return None
+        member = 'images/' + parts[-1]
+    if member == '' or '..' in member.split('/'):
+        return None
+    return member
+
+
+class MemberReader(QRunnable):
+    """
+    Read the member 'member' of 'archive' in chunks on a thread pool and
+    pass them on to the MemberReply 'reply', so big pictures do not hold
+    up the GUI thread.
+    """
+    def __init__(self, reply, archive, member):
+        super(MemberReader, self).__init__()
+        self.reply   = reply
+        self.archive = archive
+        self.member  = member
+
+    def run(self):
+        try:
+            f = None
+            if self.archive is not None:
+                try:
+                    f = self.archive.openMember(self.member)
+                except (IOError, OSError, ValueError):
+                    f = None
+            if f is None:
+                self.reply.opened.emit(None)
+                return
+            self.reply.opened.emit(f.size)
+            while not self.reply.aborted:
+                try:
+                    data = f.read(READ_CHUNKSIZE)
+                except (IOError, OSError, ValueError):
+                    break
+                if data == '':
+                    break
+                self.reply.chunkRead.emit(data)
+            self.reply.done.emit()
+        except RuntimeError:
+            ## the web view deleted the reply meanwhile
+            pass
+
+
+class MemberReply(QNetworkReply):
+    """
+    Reply with the contents of the archive member 'member', which a
+    MemberReader reads on 'pool', or with a ContentNotFoundError if it is
+    not in the archive. The signals below come from the reader and are
+    handled on the thread of the reply.
+    """
+    opened    = pyqtSignal(object)
+    chunkRead = pyqtSignal(object)
+    done      = pyqtSignal()
+
+    def __init__(self, parent, request, operation, archive, member, pool):
+        super(MemberReply, self).__init__(parent)
+        self.setRequest(request)
+        self.setUrl(request.url())
+        self.setOperation(operation)
+        self.data    = ''
+        self.pos     = 0
+        self.aborted = False
+        self.open(QIODevice.ReadOnly | QIODevice.Unbuffered)
+        self.opened.connect(self._opened)
+        self.chunkRead.connect(self._chunkRead)
+        self.done.connect(self._done)
+        pool.start(MemberReader(self, archive, member))
+
+    def _opened(self, size):
+        if size is None:
+            self.setError(QNetworkReply.ContentNotFoundError, "%s is not in the archive" % self.url().toString())
+            self.error.emit(QNetworkReply.ContentNotFoundError)
+            self.finished.emit()
+            return
+        mimetype = mimetypes.guess_type(self.url().path())[0] or 'application/octet-stream'
+        self.setHeader(QNetworkRequest.ContentTypeHeader, mimetype)
+        self.setHeader(QNetworkRequest.ContentLengthHeader, size)
+        self.metaDataChanged.emit()
+
+    def _chunkRead(self, data):
+        if self.aborted:
+            return
+        ## drop what was read already
+        self.data = self.data[self.pos:] + data
+        self.pos  = 0
+        self.readyRead.emit()
+
+    def _done(self):
+        if not self.aborted:
+            self.finished.emit()
+
+    def abort(self):
+        self.aborted = True
+        self.close()
+
+    def isSequential(self):
+        return True
+
+    def bytesAvailable(self):
+        return len(self.data) - self.pos + super(MemberReply, self).bytesAvailable()
+
+    def readData(self, maxlen):
+        data = self.data[self.pos:self.pos + maxlen]
+        self.pos += len(data)
+        return data
+
+
+class BATNetworkAccessManager(QNetworkAccessManager):
+    """
+    Network access manager which serves bat:// URLs (and the pictures of
+    the reports) from the archive that getArchive() returns. The members
+    are read on the thread pool 'pool'.
+    """
+    def __init__(self, getArchive, pool, parent = None):
+        super(BATNetworkAccessManager, self).__init__(parent)
+        self.getArchive = getArchive
+        self.pool       = pool
+
+    def createRequest(self, operation, request, outgoingData = None):
+        member = memberForUrl(request.url())
+        if member is None or operation != QNetworkAccessManager.GetOperation:
+            return super(BATNetworkAccessManager, self).createRequest(operation, request, outgoingData)
+        return MemberReply(self, request, operation, self.getArchive(), member, self.pool)
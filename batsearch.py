@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Search index for the Find bar of the main window. This module does not
+depend on Qt.
+
+The index is built once when a scan is loaded. Names and libmagic strings
+are searched over their distinct values only (many files share a name or
+a file type) and the result is spread over the nodes with NumPy. A path
+matches when one of its components matches, so the matches of the names
+are passed down the tree one level at a time. Checksums are looked up in a
+sorted list, or in the sorted arrays of a batdupes.ChecksumGroups.
+
+Query syntax:
+
+  text          substring of the name, path, symlink target or file type
+  text*         name that starts with text
+  re:regexp     regular expression on the name or file type
+  path:text     substring of the path only
+  magic:text    substring of the file type only
+  sha256:hex    checksum that starts with hex, a full checksum of 64 hex
+                digits can also be given without the sha256: prefix
+
+All but the regular expression searches ignore the case of ASCII letters.
+A directory that matches by name or path shows everything below it.
+
+The names are kept as the byte strings of the scan data, queries are
+searched for as UTF-8 (see battree.nameBytes), so comparing them never
+mixes byte strings and unicode.
+'''
+
+import re, bisect
+import numpy
+from battree  import treeLevels, nameBytes
+from batdupes import ChecksumGroups
+
+HEXDIGITS = frozenset('0123456789abcdef')
+
+
+class SearchIndex:
+    """
+    Search index over the nodes of a BATTreeModel. 'magics', 'magicids'
+    and 'checksums' are those of the battree.TreeLayout the model was made
+    from. 'lnames' and 'prefixorder', if given, are the names of the model
+    in lower case and their ids sorted on those, as a session file has
+    them, otherwise they are computed here. search() returns a bool array
+    indexed by node id.
+    """
+    def __init__(self, model, magics, magicids, checksums, lnames = None, prefixorder = None):
+        self.parents    = numpy.frombuffer(model.parents, dtype=numpy.intc)
+        self.childstart = numpy.frombuffer(model.childstart, dtype=numpy.intc)
+        self.childcount = numpy.frombuffer(model.childcount, dtype=numpy.intc)
+        self.nameids    = numpy.frombuffer(model.nameids, dtype=numpy.intc)
+        self.levels     = treeLevels(self.parents, self.childstart, self.childcount)
+
+        self.names  = model.names
+        if lnames is None:
+            lnames = [n.lower() for n in model.names]
+        self.lnames = lnames
+        ## name ids sorted on the name, for prefix searches
+        if prefixorder is None:
+            prefixorder = sorted(xrange(len(self.lnames)), key = self.lnames.__getitem__)
+        self.prefixids  = numpy.asarray(prefixorder, dtype=numpy.intp)
+        ## the sorted names and the link targets are made by the first
+        ## search that needs them, so opening a scan does not wait for them
+        self.prefixkeys = None
+        ## the names of nodes with children, the only ones a path can go through
+        self.dirnameids = numpy.unique(self.nameids[self.childcount > 0]).tolist()
+
+        self.magics   = magics
+        self.lmagics  = [m.lower() for m in magics]
+        self.magicids = numpy.asarray(magicids, dtype=numpy.intp)
+
+        self.linknames   = model.linknames
+        self.linktargets = None
+
+        self.checksums = checksums
+        self.shas      = None
+        if not isinstance(checksums, ChecksumGroups):
+            self.shas = sorted(checksums)
+
+        ## last substring search on the names, a longer query that starts
+        ## with the same text only has to look at the names that matched
+        self.lastsubstring = None
+
+    def __len__(self):
+        return len(self.parents)
+
+    ## matches on distinct values
+
+    def _nameSubstring(self, text):
+        if self.lastsubstring is not None and text.startswith(self.lastsubstring[0]):
+            candidates = self.lastsubstring[1]
+        else:
+            candidates = xrange(len(self.lnames))
+        lnames = self.lnames
+        hits = [n for n in candidates if text in lnames[n]]
+        self.lastsubstring = (text, hits)
+        return hits
+
+    def _namePrefix(self, text):
+        if self.prefixkeys is None:
+            self.prefixkeys = map(self.lnames.__getitem__, self.prefixids.tolist())
+        first = bisect.bisect_left(self.prefixkeys, text)
+        last  = first
+        while last < len(self.prefixkeys) and self.prefixkeys[last].startswith(text):
+            last += 1
+        return self.prefixids[first:last]
+
+    def _valueMask(self, hits, count):
+        m = numpy.zeros(count, dtype=bool)
+        m[numpy.asarray(hits, dtype=numpy.intp)] = True
+        return m
+
+    ## spreading matches over the nodes
+
+    def _nodes(self, namehits):
+        """
+        Return the bool array of the nodes which have one of the names in
+        namehits.
+        """
+        return self._valueMask(namehits, len(self.names))[self.nameids]
+
+    def _magicNodes(self, test):
+        hits = [n for (n, m) in enumerate(self.lmagics) if n > 0 and test(m)]
+        if len(hits) == 0:
+            return numpy.zeros(len(self), dtype=bool)
+        return self._valueMask(hits, len(self.magics))[self.magicids]
+
+    def _linkNodes(self, text, m):
+        if self.linktargets is None:
+            self.linktargets = [(i, t.lower()) for (i, t) in self.linknames.iteritems()]
+        for (i, target) in self.linktargets:
+            if text in target:
+                m[i] = True
+
+    def _propagate(self, m):
+        """
+        Mark everything below a marked node as well, m is changed in place.
+        """
+        for (start, end) in self.levels[1:]:
+            m[start:end] |= m[self.parents[start:end]]
+        return m
+
+    def _pathNodes(self, text):
+        """
+        Return the bool array of the nodes where 'text', which contains a
+        '/', ends in their own path component. The first piece of text
+        has to be the end of an ancestor's name, the pieces in between
+        whole names and the last piece the start of the node's name.
+        """
+        pieces = text.split('/')
+        if pieces[-1] == '':
+            ## ends on a separator, match the directory and search below it
+            m = self._pathNodes(text[:-1])
+            self._propagate(m)
+            below = numpy.zeros(len(self), dtype=bool)
+            below[self.parents >= 0] = m[self.parents[self.parents >= 0]]
+            return below
+
+        lnames = self.lnames
+        last = pieces[-1]
+        m = self._nodes(self._namePrefix(last))
+        node = numpy.arange(len(self), dtype=numpy.intc)
+        for (n, piece) in enumerate(reversed(pieces[:-1])):
+            node = numpy.where(node >= 0, self.parents[numpy.maximum(node, 0)], -1)
+            m &= node >= 0
+            if n == len(pieces) - 2:
+                ok = [k for k in self.dirnameids if lnames[k].endswith(piece)]
+            else:
+                ok = [k for k in self.dirnameids if lnames[k] == piece]
+            m &= self._valueMask(ok, len(lnames))[self.nameids[numpy.maximum(node, 0)]]
+        return m
+
+    ## queries
+
+    def search(self, query):
+        """
+        Return a bool array which is True for the nodes that match 'query',
+        or None for an empty query.
+        """
+        query = nameBytes(query).strip()
+        if query == '':
+            return None
+
+        if query.startswith('sha256:'):
+            return self.searchChecksum(query[7:])
+        if len(query) == 64 and HEXDIGITS.issuperset(query.lower()):
+            return self.searchChecksum(query)
+        if query.startswith('re:'):
+            return self.searchRegexp(query[3:])
+        if query.startswith('magic:'):
+            text = query[6:].lower()
+            return self._magicNodes(lambda m: text in m)
+        if query.startswith('path:'):
+            return self.searchPath(query[5:].lower())
+        if query.endswith('*'):
+            return self.searchPrefix(query[:-1].lower())
+
+        text = query.lower()
+        m = self.searchPath(text)
+        self._linkNodes(text, m)
+        m |= self._magicNodes(lambda x: text in x)
+        return m
+
+    def searchChecksum(self, prefix):
+        prefix = prefix.strip().lower()
+        m = numpy.zeros(len(self), dtype=bool)
+        if self.shas is None:
+            m[self.checksums.withPrefix(prefix)] = True
+            return m
+        n = bisect.bisect_left(self.shas, prefix)
+        while n < len(self.shas) and self.shas[n].startswith(prefix):
+            m[self.checksums[self.shas[n]]] = True
+            n += 1
+        return m
+
+    def searchPrefix(self, text):
+        text = nameBytes(text)
+        if '/' in text:
+            m = self._pathNodes(text)
+        else:
+            m = self._nodes(self._namePrefix(text))
+        return self._propagate(m)
+
+    def searchPath(self, text):
+        text = nameBytes(text)
+        if '/' in text:
+            m = self._pathNodes(text)
+        else:
+            m = self._nodes(self._nameSubstring(text))
+        return self._propagate(m)
+
+    def searchRegexp(self, pattern):
+        """
+        Search the names and file types with a regular expression. If the
+        pattern is not valid it is searched for literally.
+        """
+        pattern = nameBytes(pattern)
+        try:
+            regexp = re.compile(pattern, re.UNICODE)
+        except re.error:
+            regexp = re.compile(re.escape(pattern), re.UNICODE)
+        hits = [n for (n, name) in enumerate(self.names) if regexp.search(name)]
+        m = self._propagate(self._nodes(hits))
+        hits = [n for (n, magic) in enumerate(self.magics) if n > 0 and regexp.search(magic)]
+        if len(hits) > 0:
+            m |= self._valueMask(hits, len(self.magics))[self.magicids]
+        return m
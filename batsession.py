@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Session files of BAT result archives: the file tree and the indexes that
+are derived from the scan data, kept in a binary file that is mapped into
+memory when the archive is opened again. This module does not depend on
+Qt.
+
+Building the tree of a big scan means reading every report from the scan
+data and sorting all paths, while the result only depends on the archive.
+So once it is built the battree.TreeLayout is written to a session file:
+the arrays of the layout as they are in memory, the distinct names, file
+types, link targets and tag combinations as tables of strings, the
+checksums as a batdupes.ChecksumGroups and the names in lower case with
+their sorted order, for the search index. Opening the session maps the
+file and puts NumPy arrays on top of it, nothing is parsed per node.
+
+The file starts with a header that has SESSION_VERSION, the key of the
+archive (see archiveKey) and a table of the sections. A session with
+another version or key is ignored, and written anew after the tree has
+been built. Sessions are kept next to the archive, like the scan data, or
+by key under the cache directory of the user if that is not writable.
+'''
+
+import os, mmap, struct, hashlib, itertools
+from array import array
+import numpy
+from batstore import archiveStamp
+from battree  import TreeLayout, InternedNames, LayoutPaths
+from batdupes import ChecksumGroups
+
+## bump this when the layout of the file or the way the tree is built changes
+SESSION_VERSION = 2
+
+MAGIC = 'BATSESS\0'
+
+## magic, version, key of the archive, number of top level nodes, number
+## of sections
+HEADER = struct.Struct('<8sI64sqI')
+## name, NumPy type or STRINGS, offset, size in bytes, number of elements
+SECTION = struct.Struct('<16s8sqqq')
+STRINGS = 'strings'
+## sections start at a multiple of this
+ALIGNMENT = 8
+
+## how much of the start and the end of the archive goes into its key
+KEYBYTES = 1024 * 1024
+
+
+def sessionPath(archivepath):
+    return archivepath + '.session'
+
+
+def defaultSessionDir():
+    cachehome = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cachehome, 'batgui', 'sessions')
+
+
+def archiveKey(archivepath):
+    """
+    Return the key of an archive: the sha256 of its size and modification
+    time and of the first and last KEYBYTES of its contents. For a
+    .tar.gz the last bytes have the CRC of all of the contents.
+    """
+    h = hashlib.sha256(archiveStamp(archivepath))
+    f = open(archivepath, 'rb')
+    try:
+        h.update(f.read(KEYBYTES))
+        size = os.fstat(f.fileno()).st_size
+        if size > KEYBYTES:
+            f.seek(max(KEYBYTES, size - KEYBYTES))
+            h.update(f.read(KEYBYTES))
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def _candidates(archivepath, key, sessiondir):
+    candidates = [sessionPath(archivepath)]
+    if sessiondir is not None:
+        candidates.append(os.path.join(sessiondir, key + '.session'))
+    return candidates
+
+
+def openSession(archivepath, sessiondir = None):
+    """
+    Return the TreeLayout from the session of the archive 'archivepath',
+    or None if there is no valid one.
+    """
+    key = archiveKey(archivepath)
+    for sessionpath in _candidates(archivepath, key, sessiondir):
+        layout = loadSession(sessionpath, key)
+        if layout is not None:
+            return layout
+    return None
+
+
+def writeSession(archivepath, layout, sessiondir = None):
+    """
+    Write the session of the archive 'archivepath' with its tree
+    'layout', next to the archive or else in 'sessiondir'. Returns the
+    path of the session, or None if it could not be written.
+    """
+    key = archiveKey(archivepath)
+    try:
+        sections = layoutSections(layout)
+    except (TypeError, ValueError):
+        ## names with a NUL or checksums that are not hexadecimal
+        return None
+    for sessionpath in _candidates(archivepath, key, sessiondir):
+        try:
+            if not os.path.isdir(os.path.dirname(sessionpath) or '.'):
+                os.makedirs(os.path.dirname(sessionpath))
+            saveSession(sessionpath, key, layout.toplevelcount, sections)
+        except (IOError, OSError):
+            continue
+        return sessionpath
+    return None
+
+
+def _bytes(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def _strings(strings):
+    """
+    Return a list of strings as one string, separated by NUL bytes.
+    """
+    try:
+        data = '\0'.join(strings)
+    except UnicodeError:
+        data = u''
+    if isinstance(data, unicode):
+        data = '\0'.join([_bytes(s) for s in strings])
+    if len(strings) > 0 and data.count('\0') != len(strings) - 1:
+        raise ValueError("string with a NUL byte")
+    return (data, len(strings))
+
+
+def layoutSections(layout):
+    """
+    Return the sections of the session of 'layout' as [(name, data)],
+    where data is a NumPy array or a (string, count) from _strings.
+    """
+    if layout.nametable is not None:
+        nametable = layout.nametable
+        nameids = numpy.asarray(layout.nameids, dtype=numpy.int32)
+        lnames = layout.lnames
+        prefixorder = layout.prefixorder
+    else:
+        ## intern the names, many files share a name
+        nameindex = {}
+        nametable = []
+        nameids = array('i', [0]) * len(layout)
+        for (i, name) in enumerate(layout.names):
+            n = nameindex.get(name)
+            if n is None:
+                n = nameindex[name] = len(nametable)
+                nametable.append(name)
+            nameids[i] = n
+        nameids = numpy.frombuffer(nameids, dtype=numpy.intc).astype(numpy.int32)
+        lnames = [n.lower() for n in nametable]
+        prefixorder = sorted(xrange(len(lnames)), key = lnames.__getitem__)
+
+    checksums = layout.checksums
+    if not isinstance(checksums, ChecksumGroups):
+        checksums = ChecksumGroups.fromDict(checksums)
+    linkids = sorted(layout.linknames)
+
+    return [('parents',     numpy.asarray(layout.parents, dtype=numpy.int32)),
+            ('childstart',  numpy.asarray(layout.childstart, dtype=numpy.int32)),
+            ('childcount',  numpy.asarray(layout.childcount, dtype=numpy.int32)),
+            ('maskbits',    numpy.asarray(layout.maskbits, dtype=numpy.uint16)),
+            ('isdir',       numpy.asarray(layout.isdir, dtype=numpy.uint8)),
+            ('tagcomboids', numpy.asarray(layout.tagcomboids, dtype=numpy.int32)),
+            ('sizes',       numpy.asarray(layout.sizes, dtype=numpy.int64)),
+            ('magicids',    numpy.asarray(layout.magicids, dtype=numpy.int32)),
+            ('nameids',     nameids),
+            ('names',       _strings(nametable)),
+            ('lnames',      _strings(lnames)),
+            ('prefixorder', numpy.asarray(prefixorder, dtype=numpy.int32)),
+            ('magics',      _strings(layout.magics)),
+            ('tagcombos',   _strings(['\1'.join(sorted(_bytes(t) for t in combo))
+                                      for combo in layout.tagcombos])),
+            ('linkids',     numpy.array(linkids, dtype=numpy.int32)),
+            ('linktargets', _strings([layout.linknames[i] for i in linkids])),
+            ('digests',     numpy.asarray(checksums.digests, dtype='S32')),
+            ('groupstarts', numpy.asarray(checksums.starts, dtype=numpy.int32)),
+            ('groupnodes',  numpy.asarray(checksums.nodes, dtype=numpy.int32))]
+
+
+def saveSession(sessionpath, key, toplevelcount, sections):
+    """
+    Write 'sections' from layoutSections() to the session file
+    'sessionpath'. The file is written under a temporary name first, so
+    a session that was not written completely is never used.
+    """
+    table = []
+    offset = HEADER.size + SECTION.size * len(sections)
+    for (name, data) in sections:
+        offset += -offset % ALIGNMENT
+        if isinstance(data, tuple):
+            (data, count) = data
+            table.append((name, STRINGS, offset, len(data), count, data))
+        else:
+            ## little endian, as the header
+            data = data.astype(data.dtype.newbyteorder('<'), copy = False)
+            table.append((name, data.dtype.str, offset, data.nbytes, len(data), data))
+        offset += table[-1][3]
+
+    tmppath = sessionpath + '.tmp'
+    f = open(tmppath, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, SESSION_VERSION, key, toplevelcount, len(table)))
+        for (name, kind, offset, nbytes, count, data) in table:
+            f.write(SECTION.pack(name, kind, offset, nbytes, count))
+        for (name, kind, offset, nbytes, count, data) in table:
+            f.write('\0' * (offset - f.tell()))
+            if kind == STRINGS:
+                f.write(data)
+            else:
+                data.tofile(f)
+    except:
+        f.close()
+        os.unlink(tmppath)
+        raise
+    f.close()
+    os.rename(tmppath, sessionpath)
+
+
+def loadSession(sessionpath, key):
+    """
+    Return the TreeLayout from the session file 'sessionpath', or None if
+    it is not a valid session for the archive with key 'key'.
+    """
+    try:
+        f = open(sessionpath, 'rb')
+    except IOError:
+        return None
+    try:
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            return None
+        (magic, version, filekey, toplevelcount, count) = HEADER.unpack(header)
+        if magic != MAGIC or version != SESSION_VERSION or filekey != key:
+            return None
+        table = f.read(SECTION.size * count)
+        if len(table) != SECTION.size * count:
+            return None
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError, mmap.error):
+        return None
+    finally:
+        f.close()
+
+    sections = {}
+    try:
+        for n in xrange(count):
+            (name, kind, offset, nbytes, elements) = SECTION.unpack_from(table, n * SECTION.size)
+            (name, kind) = (name.rstrip('\0'), kind.rstrip('\0'))
+            if offset < 0 or nbytes < 0 or offset + nbytes > len(data):
+                return None
+            if kind == STRINGS:
+                strings = []
+                if elements > 0:
+                    strings = data[offset:offset + nbytes].split('\0')
+                if len(strings) != elements:
+                    return None
+                sections[name] = strings
+            else:
+                dtype = numpy.dtype(kind)
+                if dtype.itemsize * elements != nbytes:
+                    return None
+                sections[name] = numpy.frombuffer(data, dtype, elements, offset)
+        return _layout(sections, toplevelcount)
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def _layout(sections, toplevelcount):
+    layout = TreeLayout()
+    for name in ('parents', 'childstart', 'childcount', 'maskbits', 'tagcomboids',
+                 'sizes', 'magicids', 'nameids', 'lnames', 'prefixorder', 'magics'):
+        setattr(layout, name, sections[name])
+    layout.isdir     = sections['isdir'].view(bool)
+    layout.nametable = sections['names']
+    layout.names     = InternedNames(layout.nametable, layout.nameids)
+    layout.paths     = LayoutPaths(layout)
+    layout.tagcombos = [frozenset(combo.split('\1')) if combo else frozenset()
+                        for combo in sections['tagcombos']]
+    layout.linknames = dict(itertools.izip(sections['linkids'].tolist(), sections['linktargets']))
+    layout.checksums = ChecksumGroups(sections['digests'], sections['groupstarts'],
+                                      sections['groupnodes'])
+    layout.toplevelcount = toplevelcount
+    if len(layout.nametable) != len(layout.lnames) or len(layout.parents) != len(layout.nameids):
+        raise ValueError("inconsistent session")
+    return layout
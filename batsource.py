@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Windowed access to the source files that the reports link to
+(<sha256>.html.bz2 and friends). This module does not depend on Qt.
+
+A source file is decompressed once into a cache directory that is shared
+by all archives and sessions, by the checksum of the compressed file.
+After that a window of lines around a "lineNNN" anchor is read with a
+seek, using an index of where every line starts, so the whole file never
+has to be kept in memory or pushed into the web view.
+'''
+
+import os, re, bz2, gzip, hashlib, mmap, threading, collections
+import numpy
+from batarchive import READ_CHUNKSIZE
+from battree    import nameBytes
+import battrace
+
+## xz and zstd need modules which are not in the Python 2 standard library
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+## how many decompressed files are kept open by a SourceCache, and how
+## many bytes of them are kept on disk
+SOURCECACHE_MAXFILES = 16
+SOURCECACHE_MAXBYTES = 256 * 1024 * 1024
+
+## the extensions of compressed source files, in the order they are looked for
+COMPRESSEDEXTENSIONS = ('.bz2', '.gz', '.xz', '.zst')
+
+## the anchors pygments puts in front of every line: <a name="line12"></a>
+ANCHOR = re.compile(r'''(?:name|id)=["']?line-?(\d+)\b''')
+
+
+def openCompressed(path):
+    """
+    Open the possibly compressed file 'path' for reading, by its extension.
+    """
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'r')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.xz'):
+        if lzma is None:
+            raise IOError("no lzma module to read %s" % os.path.basename(path))
+        return lzma.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise IOError("no zstandard module to read %s" % os.path.basename(path))
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    return open(path, 'rb')
+
+
+def defaultSourceCacheDir():
+    cachehome = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cachehome, 'batgui', 'sources')
+
+
+def fileChecksum(path):
+    """
+    Return the sha256 of the contents of the file 'path'.
+    """
+    h = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(READ_CHUNKSIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def sourceCandidates(path):
+    """
+    Return the paths the source file 'path' may have. A path without the
+    extension of a compression method may be compressed with any of them,
+    BAT writes <sha256>.html.bz2 but other compressions are possible.
+    """
+    if path.endswith(COMPRESSEDEXTENSIONS):
+        return [path]
+    return [path + ext for ext in COMPRESSEDEXTENSIONS] + [path]
+
+
+def decompress(path, destination):
+    """
+    Decompress 'path' into 'destination'. The file is written under a
+    temporary name first, so an interrupted run does not leave half a
+    file behind.
+    """
+    tmppath = destination + '.tmp%d' % threading.current_thread().ident
+    source = openCompressed(path)
+    try:
+        out = open(tmppath, 'wb')
+        try:
+            while True:
+                chunk = source.read(READ_CHUNKSIZE)
+                if not chunk:
+                    break
+                battrace.count("source.decompressed", len(chunk))
+                out.write(chunk)
+        finally:
+            out.close()
+    except:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+    finally:
+        source.close()
+    os.rename(tmppath, destination)
+
+
+class SourceFile:
+    """
+    The lines of one decompressed source file. The lines before the first
+    and after the last line anchor (the opening and closing tags around
+    the source) are added to every window, so each window is a complete
+    piece of HTML.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = ''
+        newlines = numpy.flatnonzero(numpy.frombuffer(self.data, dtype=numpy.uint8) == 10)
+        ## linestarts[n] is where line n starts, the last entry is the end
+        self.linestarts = numpy.concatenate(([0], newlines + 1))
+        if len(self.data) > 0 and self.data[-1] != '\n':
+            self.linestarts = numpy.append(self.linestarts, len(self.data))
+        self.anchors = {}
+        for m in ANCHOR.finditer(self.data):
+            self.anchors.setdefault(int(m.group(1)), m.start())
+        if self.anchors:
+            positions = numpy.array(sorted(self.anchors.values()), dtype=numpy.int64)
+            self.firstline = self.lineAt(positions[0])
+            self.endline = self.lineAt(positions[-1]) + 1
+        else:
+            self.firstline = 0
+            self.endline = len(self)
+
+    def __len__(self):
+        return len(self.linestarts) - 1
+
+    def close(self):
+        if not isinstance(self.data, str):
+            self.data.close()
+        self.file.close()
+
+    def lineAt(self, pos):
+        """
+        Return the number of the line with the byte at 'pos'.
+        """
+        return int(numpy.searchsorted(self.linestarts, pos, 'right')) - 1
+
+    def anchorLine(self, anchor):
+        """
+        Return the line with the anchor "line<anchor>", or the first line
+        of the source if there is no such anchor.
+        """
+        if self.anchors.has_key(anchor):
+            return self.lineAt(self.anchors[anchor])
+        return self.firstline
+
+    def _text(self, first, end):
+        if first >= end:
+            return ''
+        return self.data[int(self.linestarts[first]):int(self.linestarts[end])]
+
+    def window(self, first, count, whole = True):
+        """
+        Return (first, end, html): the source lines first .. end-1, which
+        are at most 'count' lines from 'first'. When 'whole' is set the
+        opening and closing tags of the source are around them, otherwise
+        html only has the lines, for adding them to a window shown before.
+        """
+        first = min(max(first, self.firstline), self.endline)
+        end = min(first + max(count, 0), self.endline)
+        html = self._text(first, end)
+        if whole:
+            html = self._text(0, self.firstline) + html + self._text(self.endline, len(self))
+        return (first, end, html)
+
+
+class SourceCache:
+    """
+    Decompressed copies of source files in 'cachedir', and the most
+    recently used SourceFiles opened on them. The copies are named by the
+    checksum of the compressed file, so they can be used for every archive
+    the file is in. When they take more than 'maxbytes' the least recently
+    used ones are removed. It can be used from more than one thread.
+    """
+    def __init__(self, cachedir, maxfiles = SOURCECACHE_MAXFILES, maxbytes = SOURCECACHE_MAXBYTES):
+        self.cachedir = cachedir
+        self.maxfiles = maxfiles
+        self.maxbytes = maxbytes
+        self.files    = collections.OrderedDict()
+        ## path of a compressed file -> path of its copy
+        self.copies   = {}
+        ## bytes in the cache directory, counted when it is first needed
+        self.size     = None
+        self.lock     = threading.Lock()
+
+    def cachedPath(self, path):
+        """
+        Return the path of the decompressed copy of the compressed file 'path'.
+        """
+        path = nameBytes(path)
+        cached = self.copies.get(path)
+        if cached is None:
+            key = fileChecksum(path)
+            cached = self.copies[path] = os.path.join(self.cachedir, key[:2], key + '.html')
+        return cached
+
+    def _cachedFiles(self):
+        """
+        Return [(last use, size, path)] of the copies in the cache directory.
+        """
+        files = []
+        for (dirpath, dirnames, filenames) in os.walk(self.cachedir):
+            for name in filenames:
+                if not name.endswith('.html'):
+                    continue
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+        return files
+
+    def _added(self, cached):
+        """
+        Count the new copy 'cached' and remove the least recently used
+        copies (other than the open ones) while there are too many bytes.
+        """
+        if self.size is None:
+            self.size = sum([size for (used, size, p) in self._cachedFiles()])
+        else:
+            self.size += os.path.getsize(cached)
+        if self.size <= self.maxbytes:
+            return
+        files = self._cachedFiles()
+        self.size = sum([size for (used, size, p) in files])
+        inuse = set([source.path for source in self.files.itervalues()] + [cached])
+        for (used, size, p) in sorted(files):
+            if self.size <= self.maxbytes:
+                break
+            if p in inuse:
+                continue
+            try:
+                os.unlink(p)
+            except OSError:
+                continue
+            self.size -= size
+
+    def _get(self, path):
+        path = nameBytes(path)
+        source = self.files.pop(path, None)
+        if source is None:
+            cached = self.cachedPath(path)
+            if os.path.exists(cached):
+                ## the time of the last use, for removing the oldest ones
+                os.utime(cached, None)
+            else:
+                try:
+                    os.makedirs(os.path.dirname(cached))
+                except OSError:
+                    ## there already, or made by another viewer meanwhile
+                    if not os.path.isdir(os.path.dirname(cached)):
+                        raise
+                decompress(path, cached)
+                self._added(cached)
+            source = SourceFile(cached)
+        self.files[path] = source
+        while len(self.files) > self.maxfiles:
+            self.files.popitem(last = False)[1].close()
+        return source
+
+    def window(self, path, first, count, whole = True):
+        """
+        Return SourceFile.window(first, count, whole) of the (compressed)
+        file 'path', with the total number of lines added: (first, end,
+        total, html).
+        """
+        with self.lock:
+            source = self._get(path)
+            (first, end, html) = source.window(first, count, whole)
+            return (first, end, source.endline, html)
+
+    def anchorWindow(self, path, anchor, before, count):
+        """
+        Like window(), for the lines starting 'before' lines before the
+        line with the anchor "line<anchor>", with the tags around them.
+        """
+        with self.lock:
+            first = self._get(path).anchorLine(anchor) - before
+        return self.window(path, first, count)
+
+    def close(self):
+        with self.lock:
+            for source in self.files.itervalues():
+                source.close()
+            self.files.clear()
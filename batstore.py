@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Scan data of a BAT result archive, kept in an SQLite database.
+
+The scandata.pickle in an archive holds a report for every unpacked file.
+It is converted once into a database with one row per file, which is
+cached next to the archive (or in the extraction directory if that is not
+possible). Opening the archive again only checks that the cache belongs to
+the same archive, after that every report is read with a lookup on its path
+when it is needed, instead of keeping all of them in memory.
+'''
+
+import os, sqlite3, cPickle
+
+## bump this when the layout of the database changes
+SCHEMA_VERSION = 1
+
+## how many reports are converted between two calls of the progress function
+PROGRESSINTERVAL = 10000
+
+## the fields of a report that get their own column, the other fields are
+## kept together in the 'other' column
+REPORTFIELDS = ('name', 'realpath', 'magic', 'checksum', 'size', 'tags', 'scans')
+PICKLEDFIELDS = ('tags', 'scans')
+
+
+def cachePath(archivepath):
+    return archivepath + '.scandata.sqlite'
+
+
+class ScanStore:
+    """
+    Read only access to the reports of one scan. get(path) returns the
+    report dictionary for a path, like unpackreports[path] did, or None.
+    """
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self.db = sqlite3.connect(dbpath)
+        self.db.text_factory = str
+
+    @classmethod
+    def open(cls, archivepath, picklepath, fallbackdir = None, progress = None, writecache = True):
+        """
+        Return the ScanStore for the archive 'archivepath'. If there is no
+        cached database for this archive yet, picklepath() is called for
+        the path of the extracted scandata.pickle, which is then converted.
+        The cache is written next to the archive, or in 'fallbackdir' if
+        the directory of the archive is not writable or 'writecache' is
+        False. progress(done, total) is called while converting.
+        """
+        stamp = archiveStamp(archivepath)
+        candidates = [cachePath(archivepath)]
+        if fallbackdir is not None:
+            candidates.append(os.path.join(fallbackdir, 'scandata.sqlite'))
+        for dbpath in candidates:
+            if isValidCache(dbpath, stamp):
+                return cls(dbpath)
+
+        if not writecache:
+            candidates = candidates[1:]
+        unpackreports = loadPickle(picklepath())
+        for dbpath in candidates:
+            try:
+                convert(unpackreports, dbpath, stamp, progress)
+            except (IOError, OSError, sqlite3.Error):
+                continue
+            return cls(dbpath)
+        raise IOError("cannot write the scan data of %s" % archivepath)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def _report(self, row):
+        report = {}
+        if row[-1] is not None:
+            report.update(cPickle.loads(str(row[-1])))
+        for (field, value) in zip(REPORTFIELDS, row[:-1]):
+            if value is None:
+                continue
+            if field in PICKLEDFIELDS:
+                value = cPickle.loads(str(value))
+            report[field] = value
+        return report
+
+    def get(self, path):
+        row = self.db.execute("SELECT %s, other FROM reports WHERE path = ?" % ", ".join(REPORTFIELDS),
+                              (path,)).fetchone()
+        if row is None:
+            return None
+        return self._report(row)
+
+    def checksum(self, path):
+        """
+        Return the sha256 checksum of the file at 'path' or '' if it has none.
+        """
+        row = self.db.execute("SELECT checksum FROM reports WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] is None:
+            return ''
+        return row[0]
+
+    def size(self, path):
+        """
+        Return the size of the file at 'path' or -1 if it is not known.
+        """
+        row = self.db.execute("SELECT size FROM reports WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] is None:
+            return -1
+        return row[0]
+
+    def scans(self, path):
+        """
+        Return the list of scans (the files unpacked from the file at
+        'path') or None if there are none.
+        """
+        row = self.db.execute("SELECT scans FROM reports WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return cPickle.loads(str(row[0]))
+
+    def iterChecksums(self):
+        """
+        Yield (path, checksum) for every file, checksum is None if it has none.
+        """
+        return iter(self.db.execute("SELECT path, checksum FROM reports"))
+
+    def iterTreeReports(self):
+        """
+        Yield (path, report) for every file, where the report only has the
+        fields that are needed for battree.buildTree.
+        """
+        cursor = self.db.execute("SELECT path, tags, size, magic, checksum FROM reports")
+        for (path, tags, size, magic, checksum) in cursor:
+            report = {}
+            if tags is not None:
+                report['tags'] = cPickle.loads(str(tags))
+            if size is not None:
+                report['size'] = size
+            if magic is not None:
+                report['magic'] = magic
+            if checksum is not None:
+                report['checksum'] = checksum
+            yield (path, report)
+
+
+def archiveStamp(archivepath):
+    """
+    Identify the contents of an archive by its size and modification time.
+    """
+    st = os.stat(archivepath)
+    return "%d:%d" % (st.st_size, int(st.st_mtime))
+
+
+def isValidCache(dbpath, stamp):
+    if not os.path.exists(dbpath):
+        return False
+    try:
+        db = sqlite3.connect(dbpath)
+        try:
+            meta = dict(db.execute("SELECT key, value FROM meta"))
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return False
+    return meta.get('version') == str(SCHEMA_VERSION) and meta.get('archive') == stamp
+
+
+def loadPickle(picklepath):
+    picklefile = open(picklepath, 'rb')
+    try:
+        return cPickle.load(picklefile)
+    finally:
+        picklefile.close()
+
+
+def _rows(unpackreports, progress):
+    for (n, (path, report)) in enumerate(unpackreports.iteritems()):
+        if progress is not None and n % PROGRESSINTERVAL == 0:
+            progress(n, len(unpackreports))
+        row = [path]
+        other = {}
+        for (field, value) in report.iteritems():
+            if field not in REPORTFIELDS or value is None:
+                other[field] = value
+        for field in REPORTFIELDS:
+            value = report.get(field)
+            if value is not None and field in PICKLEDFIELDS:
+                value = sqlite3.Binary(cPickle.dumps(value, 2))
+            row.append(value)
+        if other:
+            row.append(sqlite3.Binary(cPickle.dumps(other, 2)))
+        else:
+            row.append(None)
+        yield row
+
+
+def convert(unpackreports, dbpath, stamp, progress = None):
+    """
+    Write unpackreports to a new database at 'dbpath'. The database is
+    written under a temporary name first, so a conversion which is
+    interrupted does not leave a cache behind, also not when progress()
+    raises an exception to stop it.
+    """
+    tmppath = dbpath + '.tmp'
+    if os.path.exists(tmppath):
+        os.unlink(tmppath)
+    db = sqlite3.connect(tmppath)
+    try:
+        _write(db, unpackreports, stamp, progress)
+    except:
+        db.close()
+        os.unlink(tmppath)
+        raise
+    db.close()
+    os.rename(tmppath, dbpath)
+
+
+def _write(db, unpackreports, stamp, progress):
+    db.text_factory = str
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE reports (path TEXT PRIMARY KEY, %s, other BLOB)"
+               % ", ".join(REPORTFIELDS))
+    db.executemany("INSERT INTO reports VALUES (%s)" % ", ".join(["?"] * (len(REPORTFIELDS) + 2)),
+                   _rows(unpackreports, progress))
+    db.execute("CREATE INDEX reports_checksum ON reports (checksum)")
+    db.executemany("INSERT INTO meta VALUES (?, ?)",
+                   [('version', str(SCHEMA_VERSION)), ('archive', stamp)])
+    db.commit()
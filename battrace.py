@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Opt-in tracing of the hot paths of the viewer. This module does not depend
+on Qt.
+
+Tracing is off unless the environment variable BATGUI_TRACE (or the --trace
+option of batgui) names a file. The time every traced function takes is
+then kept in a histogram per function, together with counters (bytes
+decompressed, cache hits and misses, rows filtered), and written to that
+file as JSON when the viewer exits. BATGUI_TRACE_EVENTS (or --trace-events)
+names a file for every call and message as a Chrome trace, which can be
+loaded in chrome://tracing or Perfetto.
+
+When tracing is off, traced() functions only check a global before
+calling the function, and count() and log() return at once.
+'''
+
+import os, sys, time, json, atexit, threading
+
+TRACEENV  = 'BATGUI_TRACE'
+EVENTSENV = 'BATGUI_TRACE_EVENTS'
+
+## at most this many events are kept for the Chrome trace, the ones after
+## that are only counted
+MAXEVENTS = 1000000
+
+## the Tracer when tracing is on, None otherwise
+tracer = None
+
+
+class Tracer:
+    """
+    Latencies and counters of one session. The latencies of a name are
+    kept as a histogram with a bucket per power of two microseconds:
+    bucket n counts the calls that took from 2**(n-1) up to 2**n us.
+    """
+    def __init__(self, summarypath = None, eventspath = None):
+        self.summarypath = summarypath
+        self.eventspath  = eventspath
+        self.start     = time.time()
+        self.latencies = {}
+        self.counters  = {}
+        self.events    = []
+        self.dropped   = 0
+        self.lock      = threading.Lock()
+
+    def _event(self, event):
+        if len(self.events) < MAXEVENTS:
+            event['pid'] = os.getpid()
+            event['tid'] = threading.current_thread().ident
+            self.events.append(event)
+        else:
+            self.dropped += 1
+
+    def add(self, name, start, seconds):
+        """
+        Record a call of 'name' that started at time 'start' and took
+        'seconds'.
+        """
+        us = seconds * 1e6
+        bucket = int(us).bit_length()
+        with self.lock:
+            latency = self.latencies.get(name)
+            if latency is None:
+                latency = self.latencies[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'buckets': {}}
+            latency['count'] += 1
+            latency['total'] += seconds
+            latency['max'] = max(latency['max'], seconds)
+            latency['buckets'][bucket] = latency['buckets'].get(bucket, 0) + 1
+            if self.eventspath is not None:
+                self._event({'name': name, 'ph': 'X', 'ts': (start - self.start) * 1e6, 'dur': us})
+
+    def count(self, name, n):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def setCounter(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+
+    def message(self, text):
+        if self.eventspath is None:
+            return
+        with self.lock:
+            self._event({'name': text[:200], 'ph': 'i', 's': 't', 'ts': (time.time() - self.start) * 1e6})
+
+    def summary(self):
+        """
+        Return the latencies and counters as a dictionary for JSON, the
+        buckets as [lowest microseconds, count] pairs.
+        """
+        with self.lock:
+            latencies = {}
+            for (name, latency) in self.latencies.iteritems():
+                latencies[name] = {'count': latency['count'],
+                                   'total': latency['total'],
+                                   'mean':  latency['total'] / latency['count'],
+                                   'max':   latency['max'],
+                                   'histogram': [[(1 << b) >> 1, n] for (b, n)
+                                                 in sorted(latency['buckets'].iteritems())]}
+            return {'seconds':   time.time() - self.start,
+                    'latencies': latencies,
+                    'counters':  dict(self.counters),
+                    'droppedevents': self.dropped}
+
+    def dump(self):
+        """
+        Write the summary and the events to their files.
+        """
+        if self.summarypath is not None:
+            f = open(self.summarypath, 'w')
+            try:
+                json.dump(self.summary(), f, sort_keys=True, indent=1)
+            finally:
+                f.close()
+        if self.eventspath is not None:
+            with self.lock:
+                events = list(self.events)
+            f = open(self.eventspath, 'w')
+            try:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            finally:
+                f.close()
+
+
+def enable(summarypath = None, eventspath = None):
+    """
+    Start tracing, the results are written to the given files at exit.
+    """
+    global tracer
+    if summarypath is None and eventspath is None:
+        return
+    if tracer is None:
+        atexit.register(dump)
+    tracer = Tracer(summarypath, eventspath)
+
+
+def enabled():
+    return tracer is not None
+
+
+def dump():
+    t = tracer
+    if t is None:
+        return
+    try:
+        t.dump()
+    except (IOError, OSError), e:
+        print >>sys.stderr, "Could not write the trace:", e
+
+
+def traced(name):
+    """
+    Decorator which records how long every call of the function takes,
+    under 'name'.
+    """
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            t = tracer
+            if t is None:
+                return function(*args, **kwargs)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                t.add(name, start, time.time() - start)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__  = function.__doc__
+        return wrapper
+    return decorate
+
+
+def since(name, start):
+    """
+    Record the time from 'start' until now under 'name', for events that
+    are not a single function call.
+    """
+    t = tracer
+    if t is not None:
+        t.add(name, start, time.time() - start)
+
+
+def count(name, n = 1):
+    t = tracer
+    if t is not None:
+        t.count(name, n)
+
+
+def setCounter(name, value):
+    t = tracer
+    if t is not None:
+        t.setCounter(name, value)
+
+
+def log(*args):
+    """
+    Record a message, instead of printing it, when tracing is on.
+    """
+    t = tracer
+    if t is not None:
+        try:
+            text = " ".join(["%s" % a for a in args])
+        except UnicodeError:
+            text = " ".join([repr(a) for a in args])
+        t.message(text)
+
+
+enable(os.environ.get(TRACEENV) or None, os.environ.get(EVENTSENV) or None)
@@ -0,0 +1,583 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Construction of the file tree that is shown in the main window, from the
+unpackreports of a BAT scan. This module does not depend on Qt.
+
+The tree is built in a single pass over the sorted paths. The result is
+a TreeLayout: flat lists indexed by node id, with the nodes numbered level
+by level so the children of every node have consecutive ids.
+
+The tags, sizes and empty flags of the nodes are kept as NumPy arrays in
+a TagColumns, so that which nodes are hidden by the active filters is a
+single vectorized operation. Which nodes are shown is kept in a
+TreeVisibility, which is updated incrementally when the filters change.
+'''
+
+import os
+import numpy
+
+DIRECTORYMASK = u"\u24b9"
+EMPTYMASK     = u"\u2205"
+TAGENTITIES   = {'text': u'\u24c9', 'graphics': u'\u24bc', 'compressed': u'\u24b8',
+                 'resource': u'\u24c7', 'static': u'\u24c8', 'dalvik': u'\u24b6',
+                 'ranking': u'\u272a', 'linuxkernel': u'\u24c1', 'duplicate': u'\u229c',
+                 'diff:added': u'\u2295', 'diff:removed': u'\u2296', 'diff:changed': u'\u229b',
+                 'diff:moved': u'\u21b7'}
+
+## The masks of a node are kept as a bitfield, with one bit for each of
+## these tags. Bit 0 and 1 are for directories and empty files.
+MASKTAGS = ['text', 'graphics', 'compressed', 'resource', 'static', 'dalvik',
+            'ranking', 'linuxkernel', 'duplicate',
+            'diff:added', 'diff:removed', 'diff:changed', 'diff:moved']
+MASK_DIRECTORY = 1 << 0
+MASK_EMPTY     = 1 << 1
+MASKTAGBITS    = dict((t, 1 << (n + 2)) for (n, t) in enumerate(MASKTAGS))
+
+## The filters that can be chosen: the tags that are hidden, and what the
+## filter is called. "empty" hides empty files and "emptydir" directories
+## without any shown files.
+FILTERCONFIG = [(["audio", "mp3", "ogg"], "Audio files"),
+                (["duplicate"], "Duplicate files"),
+                (["extracopy"], "Extra copies of duplicate files (show each file once)"),
+                (["emptydir"], "Empty directories (after filters have been applied)"),
+                (["empty"], "Empty files"),
+                (["png", "bmp", "jpg", "gif", "graphics"], "Graphics files"),
+                (["pdf"], "PDF files"),
+                (["resource"], "Resource files"),
+                (["symlink"], "Symbolic links"),
+                (["text", "xml"], "Text files"),
+                (["video", "mp4"], "Video files"),]
+
+
+class TreeLayout:
+    """
+    The shape and the shown text of the file tree.
+
+    For node id i:
+      parents[i]     id of the parent node, -1 for top level nodes
+      childstart[i]  id of the first child
+      childcount[i]  number of children
+      names[i]       name of the file or directory
+      maskbits[i]    bitfield of the masks shown next to the name
+      paths[i]       full path of the file or directory
+      isdir[i]       True for directories
+      tagcomboids[i] index in tagcombos of the tags of the node
+      sizes[i]       size of the file, -1 for directories
+      magicids[i]    index in magics of the file type, 0 for none
+
+    linknames maps the ids of symbolic links to where the link points to.
+    tagcombos lists each distinct combination of tags as a frozenset,
+    tagcombos[0] is the empty set. checksums maps each sha256 checksum to
+    the ids of the nodes with that checksum.
+
+    The top level nodes have ids 0 .. toplevelcount-1.
+
+    A layout that was loaded from a session file (see batsession) has
+    NumPy arrays instead of lists, a batdupes.ChecksumGroups as checksums
+    and the names interned: names[i] is nametable[nameids[i]]. lnames are
+    the names of nametable in lower case and prefixorder the ids in
+    nametable sorted on those, for batsearch.SearchIndex. These are None
+    for a layout that was built by buildTree.
+    """
+    def __init__(self):
+        self.parents    = []
+        self.childstart = []
+        self.childcount = []
+        self.names      = []
+        self.maskbits   = []
+        self.linknames  = {}
+        self.paths      = []
+        self.isdir      = []
+        self.tagcomboids = []
+        self.sizes      = []
+        self.magicids   = []
+        self.magics     = [u'']
+        self.checksums  = {}
+        self.tagcombos  = [frozenset()]
+        self.toplevelcount = 0
+        self.nametable  = None
+        self.nameids    = None
+        self.lnames     = None
+        self.prefixorder = None
+
+    def __len__(self):
+        return len(self.parents)
+
+    def children(self, i):
+        """
+        Return the ids of the children of node i, or of the top level
+        nodes when i is -1.
+        """
+        if i < 0:
+            return xrange(0, self.toplevelcount)
+        return xrange(self.childstart[i], self.childstart[i] + self.childcount[i])
+
+
+class InternedNames:
+    """
+    The names of the nodes of a layout with interned names, as a read
+    only sequence.
+    """
+    def __init__(self, nametable, nameids):
+        self.nametable = nametable
+        self.nameids   = nameids
+
+    def __len__(self):
+        return len(self.nameids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.nametable[n] for n in self.nameids[i].tolist()]
+        return self.nametable[self.nameids[i]]
+
+
+class LayoutPaths:
+    """
+    The paths of the nodes of a layout as a read only sequence, made from
+    the names and the parents when they are asked for.
+    """
+    def __init__(self, layout):
+        self.layout = layout
+
+    def __len__(self):
+        return len(self.layout)
+
+    def __getitem__(self, i):
+        parts = []
+        while i >= 0:
+            parts.append(self.layout.names[i])
+            i = self.layout.parents[i]
+        parts.reverse()
+        return '/'.join(parts)
+
+
+def normalisePath(path):
+    """
+    os.path.normpath(), skipping the work for paths that are already normal.
+    """
+    if '//' in path or '/.' in path or path.startswith('.') or path.endswith('/'):
+        return os.path.normpath(path)
+    return path
+
+
+def maskForTags(tags, cache):
+    """
+    Return the mask bits for a list of tags. The masks for each distinct
+    combination of tags are computed only once and kept in 'cache'.
+    """
+    key = tuple(tags)
+    if cache.has_key(key):
+        return cache[key]
+    maskbits = 0
+    for t in tags:
+        if MASKTAGBITS.has_key(t):
+            maskbits |= MASKTAGBITS[t]
+    cache[key] = maskbits
+    return maskbits
+
+
+_masktextcache = {}
+def maskText(maskbits):
+    """
+    Return the text shown in the tree for a mask bitfield.
+    """
+    if _masktextcache.has_key(maskbits):
+        return _masktextcache[maskbits]
+    if maskbits & MASK_DIRECTORY:
+        masktext = DIRECTORYMASK
+    elif maskbits & MASK_EMPTY:
+        masktext = EMPTYMASK
+    else:
+        masktext = u''
+        for t in MASKTAGS:
+            if maskbits & MASKTAGBITS[t]:
+                masktext = masktext + u"  %s" % TAGENTITIES[t]
+    _masktextcache[maskbits] = masktext
+    return masktext
+
+
+def nameBytes(name):
+    """
+    Return a name or path as the byte string the tree keeps it as. The
+    scan data has byte strings, text from Qt or JavaScript is unicode and
+    is taken to be UTF-8.
+    """
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+
+def displayName(name, linkname):
+    """
+    Return the text shown in the tree for a file, symbolic links
+    also show where they point to.
+    """
+    if linkname is None:
+        return name
+    return u"%s \u2192 %s" % (name, linkname)
+
+
+## how many reports are read between two calls of the progress function
+PROGRESSINTERVAL = 10000
+
+
+def buildTree(reports):
+    """
+    Build a TreeLayout from 'reports', an iterable of (path, report) pairs
+    such as unpackreports.iteritems(). Directories are listed before files,
+    both sorted by name. Filters are not applied here, see TreeVisibility.
+    """
+    layout = None
+    for (layout, end) in iterBuildTree(reports):
+        pass
+    if layout is None:
+        layout = TreeLayout()
+    return layout
+
+
+def iterBuildTree(reports, progress = None):
+    """
+    Build a TreeLayout like buildTree, one level at a time. After a level
+    has been added (layout, end) is yielded, where end is the number of
+    nodes in the layout so far. The same layout is yielded every time, the
+    nodes it has are not changed anymore, although the children of the
+    last level are still to come. Children are sorted when their parent is
+    numbered, so the first level comes as soon as the reports have been
+    read. progress(n) is called after every PROGRESSINTERVAL reports that
+    were read and every PROGRESSINTERVAL nodes that were numbered, n is
+    the number of reports, so it can stop the build by raising.
+    """
+    maskcache  = {}
+    tagcomboid = {frozenset(): 0}
+    magicid    = {u'': 0}
+
+    ## path -> (name, mask bits, isdir, link name, tag combination id, size,
+    ##          magic id, checksum) for every file;
+    ## parent path -> [file paths]
+    ## and all directories, including the ones that only contain directories
+    entries  = {}
+    subfiles = {}
+    dirs     = set()
+    count    = 0
+    for (k, report) in reports:
+        if progress is not None and count % PROGRESSINTERVAL == 0:
+            progress(count)
+        count += 1
+        d = os.path.dirname(k)
+        while d not in dirs:
+            dirs.add(d)
+            d = os.path.dirname(d)
+        linkname = None
+        maskbits = 0
+        tags = report.get('tags')
+        if tags:
+            maskbits = maskForTags(tags, maskcache)
+            if "symlink" in tags:
+                ## if it is a link, then add the value of where the link points to
+                ## to give a visual clue to people
+                ## example: "symbolic link to `../../bin/busybox'"
+                linkname = report['magic'][:-1].rsplit("symbolic link to `", 1)[-1]
+        if report.get('size') == 0:
+            ## if files are empty mark them as empty
+            maskbits = MASK_EMPTY
+        combo = frozenset(tags or ())
+        if not tagcomboid.has_key(combo):
+            tagcomboid[combo] = len(tagcomboid)
+        magic = report.get('magic', u'')
+        if not magicid.has_key(magic):
+            magicid[magic] = len(magicid)
+        j = k.lstrip('/')
+        if os.path.dirname(j) != "":
+            j = normalisePath(j)
+        parent = os.path.dirname(j)
+        if entries.has_key(j):
+            ## the same file under another spelling of its path
+            continue
+        entries[j] = (os.path.basename(j), maskbits, False, linkname, tagcomboid[combo],
+                      report.get('size', -1), magicid[magic], report.get('checksum'))
+        subfiles.setdefault(parent, []).append(j)
+
+    ## parent path -> [directory paths], only for directories whose parents
+    ## are there
+    subdirs = {"": []}
+    for d in sorted(set([normalisePath(d.lstrip('/')) for d in dirs if d.lstrip('/') != ""])):
+        parent = os.path.dirname(d)
+        if not subdirs.has_key(parent):
+            ## the parent directory is not there. Should not occur.
+            continue
+        subdirs[d] = []
+        subdirs[parent].append(d)
+        if entries.has_key(d):
+            ## a file that is also a directory keeps its children
+            entries[d] = entries[d][:2] + (True,) + entries[d][3:]
+        else:
+            entries[d] = (os.path.basename(d), MASK_DIRECTORY, True, None, 0, -1, 0, None)
+
+    ## number the nodes level by level
+    layout = TreeLayout()
+    layout.tagcombos = [None] * len(tagcomboid)
+    for (combo, n) in tagcomboid.iteritems():
+        layout.tagcombos[n] = combo
+    layout.magics = [None] * len(magicid)
+    for (magic, n) in magicid.iteritems():
+        layout.magics[n] = magic
+    level = subdirs[""] + sorted([j for j in subfiles.get("", ()) if not subdirs.has_key(j)])
+    layout.toplevelcount = len(level)
+    parentids = [-1] * len(level)
+    while level != []:
+        nextlevel = []
+        nextparents = []
+        firstid = len(layout.paths)
+        for (n, p) in enumerate(level):
+            if progress is not None and (firstid + n) % PROGRESSINTERVAL == 0:
+                progress(count)
+            (name, maskbits, isdir, linkname, comboid, size, magic, checksum) = entries[p]
+            if linkname is not None:
+                layout.linknames[len(layout.paths)] = linkname
+            if checksum:
+                layout.checksums.setdefault(checksum, []).append(len(layout.paths))
+            layout.parents.append(parentids[n])
+            layout.names.append(name)
+            layout.maskbits.append(maskbits)
+            layout.paths.append(p)
+            layout.isdir.append(isdir)
+            layout.tagcomboids.append(comboid)
+            layout.sizes.append(size)
+            layout.magicids.append(magic)
+            kids = []
+            if isdir and subdirs.has_key(p):
+                kids = subdirs[p]
+                if subfiles.has_key(p):
+                    kids = kids + sorted([j for j in subfiles[p] if not subdirs.has_key(j)])
+            layout.childstart.append(firstid + len(level) + len(nextlevel))
+            layout.childcount.append(len(kids))
+            nextlevel.extend(kids)
+            nextparents.extend([firstid + n] * len(kids))
+        level = nextlevel
+        parentids = nextparents
+        yield (layout, len(layout.paths))
+
+
+def treeLevels(parents, childstart, childcount):
+    """
+    Return (first, end) of the node ids on every level of a tree, given
+    its shape as NumPy arrays. The children of the nodes on one level are
+    the nodes on the next level.
+    """
+    levels = []
+    (start, end) = (0, int((parents < 0).sum()))
+    while start < end:
+        levels.append((start, end))
+        haskids = childcount[start:end] > 0
+        if not haskids.any():
+            break
+        lastkids = (childstart[start:end] + childcount[start:end])[haskids]
+        (start, end) = (end, int(lastkids.max()))
+    return levels
+
+
+class TagColumns:
+    """
+    Column store of the tags of every node in a tree.
+
+    Every tag is interned once to a bit number in 'tagbits'. tagmask[i] has
+    the bits for the tags of node i, size[i] is its size (-1 for
+    directories) and empty[i] is True for empty files. Only the first 64
+    distinct tags get a bit, the tags used by filters are interned first.
+    extracopy[i], if given, is True for the nodes that are hidden by the
+    "extracopy" filter (see batdupes.DuplicateIndex.extraCopies).
+    """
+    def __init__(self, tagcomboids, tagcombos, sizes, filtertags = (), extracopy = None):
+        self.tagbits = {}
+        alltags = set()
+        for combo in tagcombos:
+            alltags.update(combo)
+        for t in list(filtertags) + sorted(alltags):
+            if not self.tagbits.has_key(t) and len(self.tagbits) < 64:
+                self.tagbits[t] = len(self.tagbits)
+
+        combomasks = numpy.zeros(len(tagcombos), dtype=numpy.uint64)
+        for (n, combo) in enumerate(tagcombos):
+            combomasks[n] = self.tagMask(combo)
+        self.tagmask = combomasks[numpy.asarray(tagcomboids, dtype=numpy.intp)]
+        self.size    = numpy.asarray(sizes, dtype=numpy.int64)
+        self.empty   = self.size == 0
+        self.extracopy = extracopy
+
+    def __len__(self):
+        return len(self.size)
+
+    def tagMask(self, tags):
+        """
+        Return the bitmask for a collection of tags, tags without a bit
+        are ignored.
+        """
+        m = 0
+        for t in tags:
+            if self.tagbits.has_key(t):
+                m |= 1 << self.tagbits[t]
+        return numpy.uint64(m)
+
+    def hidden(self, filters):
+        """
+        Return a bool array which is True for the nodes that are hidden by
+        'filters', a collection of tags with "empty" for empty files and
+        "extracopy" for all but the first copy of a file.
+        """
+        hidden = (self.tagmask & self.tagMask(filters)) != 0
+        if "empty" in filters:
+            hidden |= self.empty
+        if "extracopy" in filters and self.extracopy is not None:
+            hidden |= self.extracopy
+        return hidden
+
+
+class TreeVisibility:
+    """
+    Which nodes of a tree are shown, for the active filters and find.
+
+    A node is hidden when one of its tags is filtered. When empty
+    directories are removed, a node with children is shown only if at
+    least one of its children is shown, otherwise it is shown if it
+    matches the find. For every node the number of shown children is kept,
+    so a small change only has to be followed up the parents of the nodes
+    it affects, as long as their state keeps changing. Bigger changes are
+    recomputed for the whole tree, one level of the tree at a time.
+
+    accepted[i] is True for shown nodes.
+    """
+
+    ## above this fraction of changed nodes everything is recomputed
+    RECOMPUTEFRACTION = 0.02
+
+    def __init__(self, parents, childstart, childcount, columns):
+        self.parents     = numpy.frombuffer(parents, dtype=numpy.intc)
+        self.childstart  = numpy.frombuffer(childstart, dtype=numpy.intc)
+        self.childcount  = numpy.frombuffer(childcount, dtype=numpy.intc)
+        self.columns     = columns
+        self.filters     = frozenset()
+        self.removeEmpty = False
+        self.findok      = None
+
+        n = len(self.parents)
+        self.selfok   = numpy.ones(n, dtype=bool)
+        self.accepted = numpy.zeros(n, dtype=bool)
+        self.count    = numpy.zeros(n, dtype=numpy.intc)
+
+        self.levels   = treeLevels(self.parents, self.childstart, self.childcount)
+        self.recompute()
+
+    def __len__(self):
+        return len(self.parents)
+
+    def recompute(self):
+        """
+        Compute the state of all nodes, starting at the deepest level so
+        that the children of a level are done before the level itself.
+        """
+        self.count[:] = 0
+        for (start, end) in reversed(self.levels):
+            acc = self.selfok[start:end].copy()
+            if self.removeEmpty:
+                haskids = self.childcount[start:end] > 0
+                if self.findok is not None:
+                    ok = numpy.where(haskids, self.count[start:end] > 0, self.findok[start:end])
+                else:
+                    ok = ~haskids | (self.count[start:end] > 0)
+                acc &= ok
+            elif self.findok is not None:
+                acc &= self.findok[start:end]
+            self.accepted[start:end] = acc
+            if start > 0:
+                ## the parents of this level are all on the level before
+                parents = self.parents[start:end][acc]
+                if len(parents) > 0:
+                    first = int(parents[0])
+                    counts = numpy.bincount(parents - first)
+                    self.count[first:first + len(counts)] += counts.astype(numpy.intc)
+
+    def _recomputeChanged(self):
+        old = self.accepted.copy()
+        self.recompute()
+        return numpy.flatnonzero(old != self.accepted).tolist()
+
+    def _accept(self, i):
+        if not self.selfok[i]:
+            return False
+        if self.removeEmpty and self.childcount[i] > 0:
+            return self.count[i] > 0
+        if self.findok is not None and not self.findok[i]:
+            return False
+        return True
+
+    def _refresh(self, i, changed):
+        """
+        Recompute node i, and its parents as long as their state changes.
+        """
+        while i >= 0:
+            a = self._accept(i)
+            if a == self.accepted[i]:
+                return
+            self.accepted[i] = a
+            changed.append(i)
+            p = int(self.parents[i])
+            if p >= 0:
+                if a:
+                    self.count[p] += 1
+                else:
+                    self.count[p] -= 1
+            i = p
+
+    def setFilters(self, filters, removeEmpty):
+        """
+        Apply a new set of filtered tags. Returns the ids of the nodes that
+        were shown and are hidden now, or the other way around.
+        """
+        self.filters = frozenset(filters)
+        selfok = ~self.columns.hidden(self.filters)
+        toggled = numpy.flatnonzero(selfok != self.selfok)
+        self.selfok = selfok
+        if removeEmpty != self.removeEmpty or len(toggled) > len(self) * self.RECOMPUTEFRACTION:
+            self.removeEmpty = removeEmpty
+            return self._recomputeChanged()
+        changed = []
+        for i in toggled.tolist():
+            self._refresh(i, changed)
+        return changed
+
+    def expandNodes(self, depth, limit):
+        """
+        Return the ids of the shown directories to expand, at most 'limit'
+        of them: the ones above a shown match of the find, or when there
+        is no find the ones on the first 'depth' levels. The ids are in
+        increasing order, so every parent comes before its children.
+        """
+        expand = self.accepted & (self.childcount > 0)
+        if self.findok is None:
+            if depth <= 0 or self.levels == []:
+                return numpy.zeros(0, dtype=numpy.intp)
+            end = self.levels[min(depth, len(self.levels)) - 1][1]
+            return numpy.flatnonzero(expand[:end])[:limit]
+        ## mark the parents of the matches, one level at a time from the
+        ## deepest one up
+        matches = self.accepted & self.findok
+        above = numpy.zeros(len(self.parents), dtype=bool)
+        for (start, end) in reversed(self.levels[1:]):
+            found = matches[start:end] | above[start:end]
+            above[self.parents[start:end][found]] = True
+        return numpy.flatnonzero(above & expand)[:limit]
+
+    def setFind(self, findok, removeEmpty):
+        """
+        Apply a new find result, findok is a bool array which is True for
+        the nodes that match, or None when nothing is searched for. Returns
+        the ids of the nodes that changed state.
+        """
+        self.findok = findok
+        self.removeEmpty = removeEmpty
+        return self._recomputeChanged()
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+'''
+Item model for the file tree in the main window.
+
+Instead of four QStandardItem objects per row the tree is kept in a few
+arrays indexed by node id, see battree.TreeLayout for the numbering. The
+text for each column is made in data() when the view asks for it.
+
+A layout that is still being built can be shown one level at a time, see
+startLayout() and appendNodes().
+
+The children of a directory only become rows when a view asks for them
+with fetchMore(), usually when the directory is first expanded, so the
+views and proxy models above this model never hold the nodes nobody
+looked at.
+'''
+
+from array        import array
+import numpy
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+from battree      import maskText, displayName, nameBytes
+
+
+'''
+    Each column in the batgui.treeview is described here, some of the columns are
+    not displayed and are for internal use only
+'''
+class MainTreeCol: #(Enum):
+    Name  = 0    # Shown: decorated file name that is shown in the tree
+    Mask  = 1    # Shown: mask describing object, like a circled D for directories
+    Path  = 2    # full path of the file/dir
+    HexdumpExtractFailed = 3 # have already tried to get hex dump report and failed for this entry
+    Extra = 4    # mainly for testing
+    _Max = Extra
+
+
+## bits in BATTreeModel.nodeflags
+FLAG_DIRECTORY            = 1 << 0
+FLAG_HEXDUMPEXTRACTFAILED = 1 << 1
+FLAG_FETCHED              = 1 << 2
+
+
+class BATTreeModel(QAbstractItemModel):
+    """
+    Read only tree model backed by arrays.
+
+    For node id i, parents[i] is the id of the parent (-1 at the top level),
+    the children are the nodes childstart[i] .. childstart[i]+childcount[i]-1,
+    the name is names[nameids[i]], masks[i] is the mask bitfield and nodeflags[i]
+    holds the FLAG_ bits. The internal id of every QModelIndex is the node id.
+
+    Only the children of nodes before 'published' are shown, so the arrays
+    can already hold the next level of a tree while it is being announced.
+    Of those, only the children of top level nodes and of nodes with
+    FLAG_FETCHED are rows of the model; childCount(), children() and the
+    lookups by path do not depend on that.
+    """
+    def __init__(self, parent=None):
+        super(BATTreeModel, self).__init__(parent)
+        self.headers = {}
+        self.clearArrays()
+
+    def clearArrays(self):
+        self.parents    = array('i')
+        self.childstart = array('i')
+        self.childcount = array('i')
+        self.nameids    = array('i')
+        self.masks      = array('H')
+        self.nodeflags  = bytearray()
+        self.names      = []
+        self.nameindex  = {}
+        self.linknames  = {}
+        self.toplevelcount = 0
+        self.published  = 0
+        self.layout     = None
+
+    def _extend(self, end):
+        """
+        Copy the nodes up to 'end' of self.layout into the arrays.
+        """
+        layout = self.layout
+        first  = len(self.parents)
+        if layout.nametable is not None:
+            ## a layout from a session file, its arrays are copied as a
+            ## whole and the names are interned already
+            self.parents.fromstring(layout.parents[first:end].astype(numpy.intc).tostring())
+            self.childstart.fromstring(layout.childstart[first:end].astype(numpy.intc).tostring())
+            self.childcount.fromstring(layout.childcount[first:end].astype(numpy.intc).tostring())
+            self.masks.fromstring(layout.maskbits[first:end].astype(numpy.uint16).tostring())
+            self.nodeflags.extend((layout.isdir[first:end] * numpy.uint8(FLAG_DIRECTORY)).tostring())
+            self.nameids.fromstring(layout.nameids[first:end].astype(numpy.intc).tostring())
+            self.names = layout.nametable
+            return
+        self.parents.extend(layout.parents[first:end])
+        self.childstart.extend(layout.childstart[first:end])
+        self.childcount.extend(layout.childcount[first:end])
+        self.masks.extend(layout.maskbits[first:end])
+        self.nodeflags.extend(FLAG_DIRECTORY if d else 0 for d in layout.isdir[first:end])
+
+        ## intern the names, many files share a name. They are kept as byte
+        ## strings, like a session has them
+        nameindex = self.nameindex
+        nameids = array('i', [0]) * (end - first)
+        for (i, name) in enumerate(layout.names[first:end]):
+            n = nameindex.get(name)
+            if n is None:
+                n = nameindex[name] = len(self.names)
+                self.names.append(nameBytes(name))
+            nameids[i] = n
+        self.nameids.extend(nameids)
+
+    def setLayout(self, layout):
+        """
+        Replace the contents of the model with a battree.TreeLayout.
+        """
+        self.beginResetModel()
+        self.clearArrays()
+        self.layout     = layout
+        self.linknames  = layout.linknames
+        self.toplevelcount = layout.toplevelcount
+        self._extend(len(layout))
+        self.published  = len(self)
+        self.nameindex  = {}
+        self.layout     = None
+        self.endResetModel()
+
+    def startLayout(self, layout):
+        """
+        Replace the contents of the model with an empty tree, the nodes of
+        'layout' are added later with appendNodes() while it is built.
+        """
+        self.beginResetModel()
+        self.clearArrays()
+        self.layout    = layout
+        self.linknames = layout.linknames
+        self.endResetModel()
+
+    def appendNodes(self, end):
+        """
+        Show the nodes of the layout given to startLayout() up to 'end',
+        which has to be the end of a level of the tree.
+        """
+        first = len(self)
+        if end <= first:
+            return
+        self._extend(end)
+        if first == 0:
+            self.beginInsertRows(QModelIndex(), 0, end - 1)
+            self.toplevelcount = end
+            self.published = end
+            self.endInsertRows()
+            return
+        ## the parents of the new level are on the level before. Their
+        ## children are only inserted as rows for the ones that were
+        ## fetched already, the others may now have children, which views
+        ## learn from layoutChanged()
+        inserted = False
+        (lo, hi) = (self.parents[first], self.parents[end - 1] + 1)
+        flags = numpy.frombuffer(self.nodeflags, dtype=numpy.uint8)[lo:hi]
+        for p in (numpy.flatnonzero(flags & FLAG_FETCHED) + lo).tolist():
+            count = self.childcount[p]
+            if count == 0:
+                continue
+            inserted = True
+            self.published = self.childstart[p]
+            self.beginInsertRows(self.indexForNode(p), 0, count - 1)
+            self.published = self.childstart[p] + count
+            self.endInsertRows()
+        self.published = end
+        if not inserted:
+            self.layoutAboutToBeChanged.emit()
+            self.layoutChanged.emit()
+
+    def finishLayout(self):
+        """
+        The layout given to startLayout() is complete.
+        """
+        self.published = len(self)
+        self.nameindex = {}
+        self.layout    = None
+
+    def clear(self):
+        self.beginResetModel()
+        self.clearArrays()
+        self.endResetModel()
+
+    def __len__(self):
+        return len(self.parents)
+
+    ## node ids
+
+    def nodeId(self, index):
+        """
+        Return the node id for a QModelIndex, -1 for the invisible root.
+        """
+        if not index.isValid():
+            return -1
+        return index.internalId()
+
+    def rowOf(self, node):
+        p = self.parents[node]
+        if p < 0:
+            return node
+        return node - self.childstart[p]
+
+    def childNode(self, parent, row):
+        """
+        Return the node id of row 'row' under the QModelIndex 'parent'.
+        """
+        p = self.nodeId(parent)
+        if p < 0:
+            return row
+        return self.childstart[p] + row
+
+    def indexForNode(self, node, column = 0):
+        if node < 0:
+            return QModelIndex()
+        return self.createIndex(self.rowOf(node), column, node)
+
+    def childCount(self, node):
+        if node < 0:
+            return self.toplevelcount
+        if self.childstart[node] >= self.published:
+            return 0
+        return self.childcount[node]
+
+    def children(self, node):
+        if node < 0:
+            return xrange(0, self.toplevelcount)
+        return xrange(self.childstart[node], self.childstart[node] + self.childCount(node))
+
+    def isFetched(self, node):
+        return node < 0 or bool(self.nodeflags[node] & FLAG_FETCHED)
+
+    def rowsOf(self, node):
+        """
+        Return the number of rows under 'node', 0 if it was not fetched.
+        """
+        if not self.isFetched(node):
+            return 0
+        return self.childCount(node)
+
+    def fetchNode(self, node):
+        """
+        Make the children of 'node' rows of the model, if they are not yet.
+        """
+        if self.isFetched(node):
+            return
+        count = self.childCount(node)
+        if count == 0:
+            return
+        self.beginInsertRows(self.indexForNode(node), 0, count - 1)
+        self.nodeflags[node] |= FLAG_FETCHED
+        self.endInsertRows()
+
+    def fetchParents(self, node):
+        """
+        Fetch the parents of 'node' from the top down, so that it is a row
+        of the model.
+        """
+        parents = []
+        p = self.parents[node]
+        while p >= 0:
+            parents.append(p)
+            p = self.parents[p]
+        for p in reversed(parents):
+            self.fetchNode(p)
+
+    def nodeName(self, node):
+        return self.names[self.nameids[node]]
+
+    def nodePath(self, node):
+        parts = []
+        while node >= 0:
+            parts.append(self.names[self.nameids[node]])
+            node = self.parents[node]
+        parts.reverse()
+        return '/'.join(parts)
+
+    def nodesChanged(self, first, last):
+        """
+        Emit dataChanged() for the nodes first .. last, which must have
+        the same parent. Nothing is emitted when they are not rows yet.
+        """
+        if not self.isFetched(self.parents[first]):
+            return
+        self.dataChanged.emit(self.indexForNode(first),
+                              self.indexForNode(last, MainTreeCol._Max - 1))
+
+    def findChild(self, node, name):
+        """
+        Return the id of the child of 'node' called 'name', or -1. The
+        directories come first and then the files, both sorted by name, so
+        both runs are searched with a binary search.
+        """
+        name = nameBytes(name)
+        kids = self.children(node)
+        if len(kids) == 0:
+            return -1
+        lo = kids[0]
+        hi = kids[-1] + 1
+
+        ## the first file after the run of directories
+        l, h = lo, hi
+        while l < h:
+            m = (l + h) // 2
+            if self.nodeflags[m] & FLAG_DIRECTORY:
+                l = m + 1
+            else:
+                h = m
+        firstfile = l
+
+        for (l, end) in ((lo, firstfile), (firstfile, hi)):
+            h = end
+            while l < h:
+                m = (l + h) // 2
+                if self.names[self.nameids[m]] < name:
+                    l = m + 1
+                else:
+                    h = m
+            if l < end and self.names[self.nameids[l]] == name:
+                return l
+        return -1
+
+    def findNode(self, path):
+        """
+        Return the node id for 'path', or -1 if it is not in the tree.
+        Unicode paths, from Qt or JavaScript, are looked up as UTF-8.
+        """
+        path = nameBytes(path)
+        node = -1
+        for name in path.split('/'):
+            node = self.findChild(node, name)
+            if node < 0:
+                return -1
+        return node
+
+    def indexForPath(self, path, column = 0):
+        """
+        Return the QModelIndex for 'path', or None if it is not in the tree.
+        """
+        node = self.findNode(path)
+        if node < 0:
+            return None
+        return self.indexForNode(node, column)
+
+    ## QAbstractItemModel
+
+    def index(self, row, column, parent = QModelIndex()):
+        p = self.nodeId(parent)
+        if p < 0:
+            if row < 0 or row >= self.toplevelcount:
+                return QModelIndex()
+            return self.createIndex(row, column, row)
+        if row < 0 or row >= self.rowsOf(p):
+            return QModelIndex()
+        return self.createIndex(row, column, self.childstart[p] + row)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        p = self.parents[index.internalId()]
+        if p < 0:
+            return QModelIndex()
+        return self.createIndex(self.rowOf(p), 0, p)
+
+    def rowCount(self, parent = QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return self.rowsOf(self.nodeId(parent))
+
+    def hasChildren(self, parent = QModelIndex()):
+        if parent.column() > 0:
+            return False
+        return self.childCount(self.nodeId(parent)) > 0
+
+    def canFetchMore(self, parent):
+        node = self.nodeId(parent)
+        return not self.isFetched(node) and self.childCount(node) > 0
+
+    def fetchMore(self, parent):
+        self.fetchNode(self.nodeId(parent))
+
+    def columnCount(self, parent = QModelIndex()):
+        return MainTreeCol._Max
+
+    def data(self, index, role = Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        node = index.internalId()
+        col  = index.column()
+        if col == MainTreeCol.Name:
+            return displayName(self.names[self.nameids[node]], self.linknames.get(node))
+        if col == MainTreeCol.Mask:
+            return maskText(self.masks[node])
+        if col == MainTreeCol.Path:
+            return self.nodePath(node)
+        if col == MainTreeCol.HexdumpExtractFailed:
+            if self.nodeflags[node] & FLAG_HEXDUMPEXTRACTFAILED:
+                return 1
+            return 0
+        return None
+
+    def setData(self, index, value, role = Qt.EditRole):
+        if not index.isValid() or index.column() != MainTreeCol.HexdumpExtractFailed:
+            return False
+        node = index.internalId()
+        if value:
+            self.nodeflags[node] |= FLAG_HEXDUMPEXTRACTFAILED
+        else:
+            self.nodeflags[node] &= ~FLAG_HEXDUMPEXTRACTFAILED & 0xff
+        if self.isFetched(self.parents[node]):
+            self.dataChanged.emit(index, index)
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def headerData(self, section, orientation, role = Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers.get(section)
+        return None
+
+    def setHeaderData(self, section, orientation, value, role = Qt.EditRole):
+        if orientation != Qt.Horizontal:
+            return False
+        self.headers[section] = value
+        self.headerDataChanged.emit(orientation, section, section)
+        return True
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os, sys
+from array import array
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from battree import buildTree, nameBytes
+
+
+class ArrayModel:
+    """
+    The arrays of a battreemodel.BATTreeModel for a layout, for the
+    indexes that only need those, without Qt.
+    """
+    def __init__(self, layout):
+        self.parents    = array('i', layout.parents)
+        self.childstart = array('i', layout.childstart)
+        self.childcount = array('i', layout.childcount)
+        self.linknames  = layout.linknames
+        self.names      = []
+        nameindex = {}
+        self.nameids = array('i')
+        for name in layout.names:
+            name = nameBytes(name)
+            if not nameindex.has_key(name):
+                nameindex[name] = len(self.names)
+                self.names.append(name)
+            self.nameids.append(nameindex[name])
+
+
+def report(tags = (), size = 1, magic = 'data', checksum = None):
+    r = {'tags': list(tags), 'size': size, 'magic': magic}
+    if checksum is not None:
+        r['checksum'] = checksum
+    return r
+
+
+## a small scan: directories, duplicates, an empty file, a symbolic link
+## and a name that is not ASCII
+REPORTS = [('bin/busybox',        report(['elf', 'binary'], 1000, 'ELF 32-bit LSB executable', 'a' * 64)),
+           ('bin/sh',             report(['symlink'], 0, "symbolic link to `busybox'")),
+           ('etc/caf\xc3\xa9.conf', report(['text'], 10, 'ASCII text', 'b' * 64)),
+           ('etc/init.d/rcS',     report(['text'], 20, 'POSIX shell script', 'c' * 64)),
+           ('etc/empty',          report([], 0)),
+           ('lib/libc.so',        report(['elf', 'ranking'], 500, 'ELF 32-bit LSB shared object', 'd' * 64)),
+           ('lib/copy/libc.so',   report(['elf', 'ranking', 'duplicate'], 500,
+                                         'ELF 32-bit LSB shared object', 'd' * 64)),
+           ('usr/share/logo.png', report(['graphics', 'png'], 300, 'PNG image data', 'e' * 64))]
+
+
+@pytest.fixture
+def layout():
+    return buildTree(iter(REPORTS))
+
+
+@pytest.fixture
+def arrayModel():
+    return ArrayModel
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os, random, tarfile, gzip, cStringIO
+import pytest
+
+from batarchive import BATArchive, GzipSeekIndex
+
+SHA = 'a' * 64
+
+
+def randomData(rnd, size):
+    ## compressible, but not so much that a seek point covers everything
+    words = ['%08x' % rnd.getrandbits(32) for n in xrange(64)]
+    return ''.join(rnd.choice(words) for n in xrange(size // 8 + 1))[:size]
+
+
+def archiveMembers(seed = 0):
+    rnd = random.Random(seed)
+    members = {'scandata.pickle': 'pickle'}
+    for n in xrange(40):
+        members['reports/%064x-elf.html.gz' % n] = randomData(rnd, rnd.randint(0, 50000))
+    members['images/%s.png' % SHA] = randomData(rnd, 1000)
+    members['images/%s-piechart.png' % SHA] = randomData(rnd, 100)
+    return members
+
+
+def writeArchive(path, members, mode):
+    tar = tarfile.open(path, mode)
+    for (name, data) in sorted(members.iteritems()):
+        ti = tarfile.TarInfo(name)
+        ti.size = len(data)
+        tar.addfile(ti, cStringIO.StringIO(data))
+    tar.close()
+
+
+@pytest.fixture(params = ['w', 'w:gz', 'w:bz2'])
+def archive(request, tmpdir):
+    members = archiveMembers()
+    path = str(tmpdir.join('result.tar'))
+    writeArchive(path, members, request.param)
+    archive = BATArchive(path, str(tmpdir.join('extract')))
+    yield (archive, members)
+    archive.close()
+
+
+def test_readMember(archive):
+    (archive, members) = archive
+    names = sorted(members)
+    ## in random order, so the gzip index has to seek back
+    random.Random(1).shuffle(names)
+    for name in names:
+        assert archive.readMember(name) == members[name]
+    assert archive.readMember('reports/missing') is None
+    assert not archive.hasMember('reports/missing')
+    assert archive.complete
+
+
+def test_MemberFile(archive):
+    (archive, members) = archive
+    name = max(members, key = lambda name: len(members[name]))
+    data = members[name]
+    f = archive.openMember(name)
+    rnd = random.Random(2)
+    for n in xrange(50):
+        offset = rnd.randint(0, len(data))
+        size = rnd.randint(0, 3000)
+        f.seek(offset)
+        assert f.read(size) == data[offset:offset + size]
+        assert f.tell() == min(offset + size, len(data))
+    f.seek(-10, 2)
+    assert f.read() == data[-10:]
+
+
+def test_extract(archive):
+    (archive, members) = archive
+    name = 'reports/%064x-elf.html.gz' % 3
+    path = archive.extract(name)
+    assert path == archive.localPath(name)
+    assert open(path, 'rb').read() == members[name]
+    assert archive.extract('reports/missing') is None
+    archive.extractImages(SHA, includeStatic = False)
+    assert os.path.exists(archive.localPath('images/%s-piechart.png' % SHA))
+    assert not os.path.exists(archive.localPath('images/%s.png' % SHA))
+
+
+def test_GzipSeekIndex(tmpdir):
+    ## two gzip members, with a seek point after every chunk
+    rnd = random.Random(3)
+    data = randomData(rnd, 700000)
+    path = str(tmpdir.join('data.gz'))
+    for (mode, part) in (('wb', data[:300000]), ('ab', data[300000:])):
+        f = gzip.open(path, mode)
+        f.write(part)
+        f.close()
+    index = GzipSeekIndex(open(path, 'rb'), spacing = 64 * 1024)
+    assert index.read() == data
+    assert len(index.points) > 1
+    for n in xrange(100):
+        offset = rnd.randint(0, len(data))
+        size = rnd.randint(0, 100000)
+        index.seek(offset)
+        assert index.read(size) == data[offset:offset + size]
+    index.seek(-5, 2)
+    assert index.read() == data[-5:]
+    index.close()
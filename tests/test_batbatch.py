@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os
+import pytest
+
+from batgen import GeneratorOptions, generateReports, writeArchive, REPORTPAGES
+from batbatch import summarise, summariseAll
+
+OPTIONS = GeneratorOptions(300, depth = 3, seed = 2, reports = 0.3, hexdumps = 0.1, maxsize = 4096)
+
+
+@pytest.fixture(scope = 'module')
+def generated(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('batbatch').join('scan.tar.gz'))
+    writeArchive(path, OPTIONS)
+    (unpackreports, withreports, withhexdumps) = generateReports(OPTIONS)
+    return (path, unpackreports, withreports, withhexdumps)
+
+
+def test_summarise(generated):
+    (path, unpackreports, withreports, withhexdumps) = generated
+    summary = summarise(path)
+    assert summary['archive'] == path
+    assert summary['files'] == summary['shown'] == len(unpackreports)
+    tagcounts = {}
+    for report in unpackreports.itervalues():
+        for t in report['tags']:
+            tagcounts[t] = tagcounts.get(t, 0) + 1
+    assert summary['tags'] == tagcounts
+
+    ranked = [p for (p, report) in unpackreports.iteritems() if 'ranking' in report['tags']]
+    assert summary['rankedcount'] == len(ranked)
+    sizes = [r['size'] for r in summary['ranked']]
+    assert sizes == sorted(sizes, reverse = True)
+
+    ## the copies of a file with reports have the same reports
+    reportsums = set(sha256sum for (sha256sum, p, size) in withreports)
+    hexdumpsums = set(sha256sum for (sha256sum, n, size) in withhexdumps)
+    assert sorted(r['path'] for r in summary['reports']) == \
+           sorted(p for (p, report) in unpackreports.iteritems() if report.get('checksum') in reportsums)
+    for r in summary['reports']:
+        pages = list(REPORTPAGES)
+        if r['checksum'] in hexdumpsums:
+            pages.append('hexdump')
+        assert r['pages'] == sorted(pages)
+    ## nothing is written next to the archive
+    assert os.listdir(os.path.dirname(path)) == ['scan.tar.gz']
+
+
+def test_summarise_filters(generated):
+    (path, unpackreports, withreports, withhexdumps) = generated
+    summary = summarise(path, ['text', 'emptydir'], rankedcount = 3)
+    assert summary['filters'] == ['emptydir', 'text']
+    assert summary['shown'] == len([p for (p, report) in unpackreports.iteritems()
+                                    if 'text' not in report['tags']])
+    assert not summary['tags'].has_key('text')
+    assert len(summary['ranked']) == min(3, summary['rankedcount'])
+
+
+def test_summariseAll(generated, tmpdir):
+    path = generated[0]
+    missing = str(tmpdir.join('missing.tar.gz'))
+    summaries = list(summariseAll([path, missing, path], jobs = 2))
+    assert [s['archive'] for s in summaries] == [path, missing, path]
+    assert summaries[1].has_key('error')
+    assert summaries[0] == summaries[2] == summarise(path)
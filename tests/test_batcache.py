@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os, threading
+import pytest
+
+from batcache import PageCache, PagePrefetcher, ReportCache
+
+SHA = ['%064x' % n for n in xrange(10)]
+
+
+def test_PageCache():
+    cache = PageCache(maxbytes = 100, maxentries = 3)
+    assert cache.get('a') is None
+    for key in 'abc':
+        cache.put(key, key * 10)
+    assert cache.get('a') == 'a' * 10
+    ## too many pages, the least recently used one goes
+    cache.put('d', 'd' * 10)
+    assert sorted(cache.pages) == ['a', 'c', 'd']
+    ## too many bytes
+    cache.put('e', 'e' * 85)
+    assert sorted(cache.pages) == ['d', 'e']
+    assert cache.size == 95
+    ## too big to be kept at all
+    cache.put('f', 'f' * 101)
+    assert 'f' not in cache
+    assert cache.stats() == "2 pages, 95 bytes, 1 hits, 1 misses"
+
+
+def test_PageCache_generation():
+    cache = PageCache()
+    generation = cache.generation
+    cache.put('a', 'page', generation)
+    cache.clear()
+    assert len(cache) == 0 and cache.size == 0
+    ## rendered before clear(), for an archive that is gone
+    cache.put('b', 'page', generation)
+    assert 'b' not in cache
+    cache.put('b', 'page', cache.generation)
+    cache.put('c', 'page')
+    assert sorted(cache.pages) == ['b', 'c']
+
+
+def test_PageCache_setLimits():
+    cache = PageCache()
+    for key in 'abcde':
+        cache.put(key, key * 10)
+    cache.setLimits(1000, 3)
+    assert sorted(cache.pages) == ['c', 'd', 'e']
+    cache.setLimits(15, 3)
+    assert cache.pages.keys() == ['e'] and cache.size == 10
+
+
+class Renderer:
+    """
+    render() for a PagePrefetcher, which waits in render() until it is
+    told to go on.
+    """
+    def __init__(self):
+        self.rendered = []
+        self.started  = threading.Event()
+        self.go       = threading.Event()
+
+    def render(self, sha256sum, page):
+        self.started.set()
+        self.go.wait(10)
+        self.rendered.append((sha256sum, page))
+        if page == 'missing':
+            return None
+        if page == 'broken':
+            raise ValueError(page)
+        return '%s %s' % (sha256sum, page)
+
+
+def test_PagePrefetcher():
+    cache = PageCache()
+    renderer = Renderer()
+    renderer.go.set()
+    prefetcher = PagePrefetcher(cache, renderer.render)
+    prefetcher.start()
+    cache.put(('a', 'cached'), 'page')
+    ## a broken or missing report is left to be shown when it is asked for
+    prefetcher.prefetch([('a', 'elf'), ('a', 'cached'), ('a', 'broken'), ('a', 'missing'), ('b', 'elf')])
+    with prefetcher.condition:
+        while prefetcher.pending or prefetcher.rendering:
+            prefetcher.condition.wait(1)
+    prefetcher.stop()
+    prefetcher.join(10)
+    assert not prefetcher.isAlive()
+    assert sorted(cache.pages) == [('a', 'cached'), ('a', 'elf'), ('b', 'elf')]
+    assert ('a', 'cached') not in renderer.rendered
+    assert prefetcher.prefetched == 2
+
+
+def test_PagePrefetcher_cancel():
+    cache = PageCache()
+    renderer = Renderer()
+    prefetcher = PagePrefetcher(cache, renderer.render)
+    prefetcher.start()
+    prefetcher.prefetch([('a', 'elf'), ('b', 'elf'), ('c', 'elf')])
+    assert renderer.started.wait(10)
+    ## cancel() waits for the page that is being rendered
+    cancelled = threading.Event()
+    def cancel():
+        prefetcher.cancel()
+        cancelled.set()
+    canceller = threading.Thread(target = cancel)
+    canceller.start()
+    assert not cancelled.wait(0.1)
+    renderer.go.set()
+    canceller.join(10)
+    assert cancelled.is_set()
+    assert renderer.rendered == [('a', 'elf')]
+    assert prefetcher.pending == [] and not prefetcher.rendering
+    prefetcher.stop()
+    prefetcher.join(10)
+    assert not prefetcher.isAlive()
+    assert renderer.rendered == [('a', 'elf')]
+
+
+@pytest.fixture
+def reports(tmpdir):
+    cache = ReportCache(str(tmpdir.join('reports')), maxbytes = 1000)
+    yield cache
+    cache.close()
+
+
+def cached(cache):
+    return sorted(key for (key,) in cache.db.execute("SELECT key FROM reports"))
+
+
+def test_ReportCache(reports):
+    assert reports.get(SHA[0], 'elf.html') is None
+    reports.put(SHA[0], 'elf.html', 'x' * 100)
+    assert reports.get(SHA[0], 'elf.html') == 'x' * 100
+    ## names that could leave the cache directory are not used
+    reports.put(SHA[0], '../elf.html', 'x')
+    reports.put('../' + SHA[0][3:], 'elf.html', 'x')
+    assert reports.get(SHA[0], '../elf.html') is None
+    assert cached(reports) == ['%s-elf.html' % SHA[0]]
+    ## a new version replaces the old one, and the total follows it
+    reports.put(SHA[0], 'elf.html', 'y' * 200)
+    assert reports.get(SHA[0], 'elf.html') == 'y' * 200
+    assert reports._total() == 200
+    assert (reports.hits, reports.misses) == (2, 1)
+
+
+def test_ReportCache_lru(reports):
+    for n in xrange(5):
+        reports.put(SHA[n], 'elf.html', str(n) * 200)
+    ## the uses are not written to the index until the next put
+    assert reports.get(SHA[0], 'elf.html') == '0' * 200
+    assert reports.get(SHA[2], 'elf.html') == '2' * 200
+    reports.put(SHA[5], 'elf.html', '5' * 300)
+    assert cached(reports) == ['%s-elf.html' % SHA[n] for n in (0, 2, 4, 5)]
+    assert not os.path.exists(reports._path('%s-elf.html' % SHA[1]))
+    assert not os.path.exists(reports._path('%s-elf.html' % SHA[3]))
+    assert reports._total() == 900
+
+
+def test_ReportCache_maxbytes(reports):
+    ## too big to be kept at all
+    reports.put(SHA[0], 'elf.html', 'x' * 1001)
+    assert reports.get(SHA[0], 'elf.html') is None
+    for n in xrange(10):
+        reports.put(SHA[n], 'elf.html', 'x' * 300)
+        assert reports._total() <= reports.maxbytes
+    assert cached(reports) == ['%s-elf.html' % SHA[n] for n in (7, 8, 9)]
+    reports.setLimit(500)
+    assert cached(reports) == ['%s-elf.html' % SHA[9]]
+    assert reports._total() == 300
+
+
+def test_ReportCache_removed(reports):
+    reports.put(SHA[0], 'elf.html', 'x' * 100)
+    reports.put(SHA[1], 'elf.html', 'y' * 100)
+    os.unlink(reports._path('%s-elf.html' % SHA[0]))
+    assert reports.get(SHA[0], 'elf.html') is None
+    assert cached(reports) == ['%s-elf.html' % SHA[1]]
+    assert reports._total() == 100
+
+
+def test_ReportCache_shared(tmpdir, reports):
+    ## another process sees the reports and the total
+    reports.put(SHA[0], 'elf.html', 'x' * 600)
+    other = ReportCache(reports.cachedir, maxbytes = 1000)
+    assert other.get(SHA[0], 'elf.html') == 'x' * 600
+    other.put(SHA[1], 'elf.html', 'y' * 600)
+    other.close()
+    assert reports.get(SHA[0], 'elf.html') is None
+    assert reports.get(SHA[1], 'elf.html') == 'y' * 600
+    assert reports._total() == 600
+
+
+def test_ReportCache_clear(tmpdir, reports):
+    for n in xrange(3):
+        reports.put(SHA[n], 'elf.html', 'x' * 100)
+    reports.get(SHA[0], 'elf.html')
+    reports.get(SHA[5], 'elf.html')
+    assert reports.stats() == "%s: 3 reports, 300 bytes of 1000, 1 hits, 1 misses" % reports.cachedir
+    reports.clear()
+    assert reports.stats() == "%s: 0 reports, 0 bytes of 1000, 1 hits, 1 misses" % reports.cachedir
+    assert [f for (d, dirs, files) in os.walk(reports.cachedir) for f in files] == ['index.sqlite']
+    ## the limit is kept, and the index total is there for a new session
+    reports.put(SHA[0], 'elf.html', 'x' * 100)
+    reports.close()
+    reports = ReportCache(reports.cachedir, maxbytes = 1000)
+    assert reports._total() == 100
+    reports.close()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+from conftest import report
+from battree import buildTree
+from batdiff import ScanDiff, ADDED, REMOVED, CHANGED, MOVED, UNCHANGED, DIFFTAGS
+
+OLD = [('bin/busybox', 'a' * 64),
+       ('etc/passwd',  'b' * 64),
+       ('etc/old.conf', 'c' * 64),
+       ('lib/libc.so', 'd' * 64),
+       ('lib/libm.so', 'd' * 64),
+       ('etc/nochecksum', None),
+       ('etc/gone', '')]
+NEW = [('bin/busybox', 'a' * 64),
+       ('etc/passwd',  'e' * 64),
+       ('etc/new.conf', 'c' * 64),
+       ('lib2/libc.so', 'd' * 64),
+       ('lib2/libm.so', 'd' * 64),
+       ('lib2/libz.so', 'd' * 64),
+       ('etc/nochecksum', ''),
+       ('etc/added', 'f' * 64)]
+
+
+def test_ScanDiff():
+    diff = ScanDiff(OLD, NEW)
+    assert diff.status == {'bin/busybox':    UNCHANGED,
+                           'etc/passwd':     CHANGED,
+                           'etc/new.conf':   MOVED,
+                           'lib2/libc.so':   MOVED,
+                           'lib2/libm.so':   MOVED,
+                           'lib2/libz.so':   ADDED,
+                           'etc/nochecksum': UNCHANGED,
+                           'etc/added':      ADDED,
+                           'etc/gone':       REMOVED}
+    ## moved files are paired in the order of their paths
+    assert diff.movedfrom == {'etc/new.conf': 'etc/old.conf',
+                              'lib2/libc.so': 'lib/libc.so',
+                              'lib2/libm.so': 'lib/libm.so'}
+    assert len(diff) == 9
+    counts = diff.counts()
+    assert (counts[ADDED], counts[REMOVED], counts[CHANGED], counts[MOVED], counts[UNCHANGED]) == \
+           (2, 1, 1, 3, 2)
+    assert diff.summary() == "2 added, 1 removed, 1 changed, 3 moved, 2 unchanged"
+
+
+def test_ScanDiff_same():
+    diff = ScanDiff(OLD, OLD)
+    assert set(diff.status.values()) == set([UNCHANGED])
+    assert diff.movedfrom == {}
+
+
+def test_treeReports():
+    diff = ScanDiff(OLD, NEW)
+    newreports = [(path, report(['elf'])) for (path, checksum) in NEW]
+    oldreports = [(path, report()) for (path, checksum) in OLD]
+    tree = dict(diff.treeReports(iter(newreports), iter(oldreports)))
+    ## the new files and the removed old ones, not the moved old ones
+    assert sorted(tree) == sorted([path for (path, checksum) in NEW] + ['etc/gone'])
+    assert tree['etc/passwd']['tags'] == ['elf', DIFFTAGS[CHANGED]]
+    assert tree['lib2/libc.so']['tags'] == ['elf', DIFFTAGS[MOVED]]
+    assert tree['etc/gone']['tags'] == [DIFFTAGS[REMOVED]]
+
+
+def test_treeReports_removed():
+    ## a removed file with the checksum of a file that is still there is
+    ## not one of its copies
+    old = OLD + [('bin/oldbusybox', 'a' * 64)]
+    diff = ScanDiff(old, NEW)
+    assert diff.status['bin/oldbusybox'] == REMOVED
+    newreports = [(path, report(checksum = checksum)) for (path, checksum) in NEW]
+    oldreports = [(path, report(checksum = checksum)) for (path, checksum) in old]
+    layout = buildTree(diff.treeReports(iter(newreports), iter(oldreports)))
+    assert 'bin/oldbusybox' in layout.paths
+    assert layout.checksums['a' * 64] == [layout.paths.index('bin/busybox')]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import random, hashlib
+import numpy
+import pytest
+
+from batdupes import ChecksumGroups, DuplicateIndex
+
+
+def randomChecksums(count, nodes, seed = 0):
+    """
+    A dictionary like TreeLayout.checksums for 'nodes' nodes with 'count'
+    distinct checksums, with some that end in zero bytes.
+    """
+    rnd = random.Random(seed)
+    shas = [hashlib.sha256(str(n)).hexdigest() for n in xrange(count - 2)] + \
+           ['00' * 32, 'ab' + '00' * 31]
+    checksums = {}
+    for i in xrange(nodes):
+        checksums.setdefault(rnd.choice(shas), []).append(i)
+    return checksums
+
+
+def test_ChecksumGroups():
+    checksums = randomChecksums(300, 1000)
+    groups = ChecksumGroups.fromDict(checksums)
+    assert len(groups) == len(checksums)
+    assert dict(groups.iteritems()) == checksums
+    assert sorted(groups) == sorted(checksums)
+    for (sha256sum, ids) in checksums.iteritems():
+        assert sha256sum in groups
+        assert groups[sha256sum] == ids
+        assert groups.get(sha256sum.upper()) == ids
+    assert groups.get('1' * 64) is None
+    assert 'not a checksum' not in groups
+    with pytest.raises(KeyError):
+        groups['1' * 64]
+
+
+@pytest.mark.parametrize('prefix', ['', '0', 'ab', 'AB', 'f0', '00' * 32, 'xyz', '1' * 65])
+def test_ChecksumGroups_withPrefix(prefix):
+    checksums = randomChecksums(300, 1000)
+    groups = ChecksumGroups.fromDict(checksums)
+    expected = sorted(i for (sha256sum, ids) in checksums.iteritems()
+                      if sha256sum.startswith(prefix.lower()) for i in ids)
+    assert sorted(groups.withPrefix(prefix).tolist()) == expected
+
+
+def test_ChecksumGroups_invalid():
+    with pytest.raises((TypeError, ValueError)):
+        ChecksumGroups.fromDict({'abc': [0]})
+    with pytest.raises((TypeError, ValueError)):
+        ChecksumGroups.fromDict({'x' * 64: [0]})
+
+
+def test_extraCopies():
+    checksums = randomChecksums(300, 1000)
+    sizes = numpy.arange(1000)
+    expected = numpy.zeros(1000, dtype=bool)
+    for ids in checksums.itervalues():
+        expected[ids[1:]] = True
+    assert (DuplicateIndex(checksums, sizes).extraCopies(1000) == expected).all()
+    groups = ChecksumGroups.fromDict(checksums)
+    assert (DuplicateIndex(groups, sizes).extraCopies(1000) == expected).all()
+
+
+@pytest.mark.parametrize('grouped', [False, True])
+def test_DuplicateIndex(grouped):
+    checksums = {'a' * 64: [2, 5, 9], 'b' * 64: [4]}
+    if grouped:
+        checksums = ChecksumGroups.fromDict(checksums)
+    dupes = DuplicateIndex(checksums, [0, 0, 10, 0, 20, 10, 0, 0, 0, 10])
+    assert dupes.copies('a' * 64) == [(2, 10), (5, 10), (9, 10)]
+    assert dupes.copyCount('b' * 64) == 1
+    assert dupes.copyCount('c' * 64) == 0
+    assert [dupes.nextCopy('a' * 64, i) for i in (2, 5, 9)] == [5, 9, 2]
+    assert dupes.nextCopy('b' * 64, 4) == -1
+    assert dupes.nextCopy('c' * 64, 0) == -1
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import cPickle, gzip
+
+from batgen import GeneratorOptions, writeArchive, REPORTPAGES
+from batarchive import BATArchive
+
+
+def test_writeArchive(tmpdir):
+    options = GeneratorOptions(200, depth = 3, seed = 5, reports = 0.5, hexdumps = 0.2, maxsize = 4096)
+    path = str(tmpdir.join('gen.tar.gz'))
+    writeArchive(path, options)
+    archive = BATArchive(path, str(tmpdir.join('extract')))
+    try:
+        unpackreports = cPickle.loads(archive.readMember('scandata.pickle'))
+        assert len(unpackreports) == 200
+        archive.buildIndex()
+        reports = [name for name in archive.members if name.startswith('reports/')]
+        hexdumps = [name for name in reports if name.endswith('-hexdump.gz')]
+        assert len(hexdumps) > 0
+        assert len(reports) > len(hexdumps)
+        for name in reports:
+            sha256sum = name[len('reports/'):][:64]
+            assert name[len('reports/') + 65:] in [page + '.html.gz' for page in REPORTPAGES] + ['hexdump.gz']
+            assert any(r.get('checksum') == sha256sum for r in unpackreports.itervalues())
+        hexdump = gzip.GzipFile(fileobj = archive.openMember(hexdumps[0])).readline()
+        assert hexdump.startswith('00000000  ')
+    finally:
+        archive.close()
+
+    ## the same seed gives the same archive, the gzip header has the time
+    ## and the name of the file
+    again = str(tmpdir.join('again.tar.gz'))
+    writeArchive(again, options)
+    assert gzip.open(again).read() == gzip.open(path).read()
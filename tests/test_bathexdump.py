@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import random, StringIO
+import pytest
+
+from batgen import hexdumpC, gzipped
+from bathexdump import HexdumpReport, BYTESPERROW, LINEINDEXSPACING
+
+
+def hexdumpReport(text):
+    return HexdumpReport(StringIO.StringIO(gzipped(text)))
+
+
+def test_HexdumpReport_close():
+    rnd = random.Random(0)
+    text = hexdumpC(''.join(chr(rnd.getrandbits(8)) for n in xrange(1000)))
+    report = hexdumpReport(text)
+    report.acquire()
+    report.acquire()
+    ## closing waits for the threads that still use it
+    report.close()
+    assert report.rows(10, 2) == text.split('\n')[10:12]
+    report.release()
+    assert report.rows(0, 1) == text.split('\n')[:1]
+    assert not report.data.raw.closed
+    report.release()
+    assert report.data.raw.closed
+
+
+def randomBytes(rnd, size):
+    return ''.join(chr(rnd.getrandbits(8)) for n in xrange(size))
+
+
+@pytest.mark.parametrize('size', [0, 5, 16, 4000, 4005])
+def test_HexdumpReport_fixed(size):
+    rnd = random.Random(size)
+    lines = hexdumpC(randomBytes(rnd, size)).splitlines()
+    report = hexdumpReport('\n'.join(lines) + '\n' if lines else '')
+    assert report.rows(0, len(lines) + 10) == lines
+    for n in xrange(50):
+        first = rnd.randint(0, len(lines) + 2)
+        count = rnd.randint(0, 40)
+        assert report.rows(first, count) == lines[first:first + count]
+    ## the last window, with the short row of data and the row with the size
+    assert report.rows(max(0, len(lines) - 3), 10) == lines[-3:]
+    ## past the end
+    assert report.rows(len(lines), 5) == []
+    assert report.rows(len(lines) + 1000, 5) == []
+    if size > 0:
+        ## all rows were read with a seek
+        assert report.linestarts is None
+
+
+def test_HexdumpReport_variable():
+    ## rows which are not all the same length, more than one LINEINDEXSPACING
+    rnd = random.Random(1)
+    lines = ['%08x  %s' % (n * BYTESPERROW, 'x' * rnd.randint(0, 60)) for n in xrange(3 * LINEINDEXSPACING + 17)]
+    report = hexdumpReport('\n'.join(lines) + '\n')
+    assert report.rows(LINEINDEXSPACING - 2, 5) == lines[LINEINDEXSPACING - 2:LINEINDEXSPACING + 3]
+    assert report.linestarts is not None
+    for n in xrange(50):
+        first = rnd.randint(0, len(lines) + 2)
+        count = rnd.randint(0, 2 * LINEINDEXSPACING)
+        assert report.rows(first, count) == lines[first:first + count]
+    assert report.rows(len(lines) - 5, 100) == lines[-5:]
+    assert report.rows(len(lines), 5) == []
+    assert report.rows(10 * LINEINDEXSPACING, 5) == []
+
+
+def test_HexdumpReport_squeezed():
+    ## "hexdump -C" without -v writes '*' for repeated rows, the rows
+    ## are then read through the line index
+    full = hexdumpC('\0' * 48 + 'a' * 40).splitlines()
+    lines = full[:1] + ['*'] + full[3:]
+    report = hexdumpReport('\n'.join(lines) + '\n')
+    assert report.rows(1, 3) == lines[1:4]
+    assert report.rows(0, 100) == lines
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import random
+
+from batscans import ScanIndex
+
+
+def scan(offset, name, size):
+    return {'offset': offset, 'scanname': name, 'size': size}
+
+
+## a long scan with a nested one, two overlapping ones after the nested
+## one ends, and an empty one
+SCANS = [scan(0, 'outer', 1000),
+         scan(100, 'nested', 50),
+         scan(300, 'first', 200),
+         scan(400, 'second', 700),
+         scan(2000, 'empty', 0)]
+
+
+def slowOverlapping(scans, start, end):
+    return [n for (n, (offset, name, size)) in enumerate(scans)
+            if offset < end and offset + max(size, 1) > start]
+
+
+def test_overlapping():
+    index = ScanIndex(reversed(SCANS))
+    assert len(index) == 5
+    assert [s[1] for s in index.scans] == ['outer', 'nested', 'first', 'second', 'empty']
+    assert index.overlapping(100, 150) == [0, 1]
+    ## after the nested scan: the running maximum of the ends does not go
+    ## down where it ends, the outer scan is still found
+    assert index.overlapping(160, 170) == [0]
+    assert index.overlapping(450, 460) == [0, 2, 3]
+    ## the scans before the second one all end by 1000 and are skipped
+    assert index.overlapping(1000, 1100) == [3]
+    assert index.overlapping(1100, 2000) == []
+    assert index.overlapping(2000, 2001) == [4]
+    assert index.overlapping(5000, 6000) == []
+    assert ScanIndex([]).overlapping(0, 10) == []
+
+
+def test_overlapping_random():
+    rnd = random.Random(0)
+    scans = [scan(rnd.randint(0, 10000), 'scan%d' % n, rnd.choice([0, rnd.randint(1, 100), rnd.randint(1, 5000)]))
+             for n in xrange(300)]
+    index = ScanIndex(scans)
+    for n in xrange(500):
+        start = rnd.randint(0, 11000)
+        end = start + rnd.randint(1, 300)
+        assert index.overlapping(start, end) == slowOverlapping(index.scans, start, end)
+
+
+def test_covering():
+    index = ScanIndex(SCANS)
+    assert index.covering(120) == [(0, 'outer', 1000), (100, 'nested', 50)]
+    assert index.covering(150) == [(0, 'outer', 1000)]
+    assert index.covering(999) == [(0, 'outer', 1000), (400, 'second', 700)]
+    assert index.covering(1099) == [(400, 'second', 700)]
+    assert index.covering(1100) == []
+    ## a scan of size 0 covers the byte at its offset
+    assert index.covering(2000) == [(2000, 'empty', 0)]
+    assert index.covering(2001) == []
+
+
+def test_rowAnnotations():
+    index = ScanIndex(SCANS)
+    rows = index.rowAnnotations(5, 3, 20)
+    ## rows 5, 6 and 7 are bytes 100 .. 159
+    assert rows == [([(100, 'nested', 50)], [(0, 'outer', 1000)]),
+                    ([], [(0, 'outer', 1000), (100, 'nested', 50)]),
+                    ([], [(0, 'outer', 1000), (100, 'nested', 50)])]
+    rows = index.rowAnnotations(49, 3, 20)
+    ## the outer scan ends in row 49, the second one goes on
+    assert rows == [([], [(0, 'outer', 1000), (400, 'second', 700)]),
+                    ([], [(400, 'second', 700)]),
+                    ([], [(400, 'second', 700)])]
+    assert index.rowAnnotations(0, 1, 20) == [([(0, 'outer', 1000)], [])]
+    assert index.rowAnnotations(100, 2, 20) == [([(2000, 'empty', 0)], []), ([], [])]
+
+
+def test_rowAnnotations_random():
+    rnd = random.Random(1)
+    scans = [scan(rnd.randint(0, 3000), 'scan%d' % n, rnd.choice([0, rnd.randint(1, 50), rnd.randint(1, 2000)]))
+             for n in xrange(100)]
+    index = ScanIndex(scans)
+    rowsize = 16
+    for n in xrange(100):
+        first = rnd.randint(0, 200)
+        count = rnd.randint(1, 30)
+        rows = index.rowAnnotations(first, count, rowsize)
+        for (r, (starts, covers)) in enumerate(rows):
+            start = (first + r) * rowsize
+            inrow = [index.scans[k] for k in slowOverlapping(index.scans, start, start + rowsize)]
+            assert starts == [s for s in inrow if start <= s[0]]
+            assert covers == [s for s in inrow if s[0] < start]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import pytest
+
+pytest.importorskip('PyQt5.QtNetwork')
+
+from PyQt5.QtCore import QUrl
+from batscheme import memberForUrl, MemberReader
+from batarchive import BATArchive, READ_CHUNKSIZE
+from test_batarchive import writeArchive
+
+SHA = 'a' * 64
+
+
+@pytest.mark.parametrize(('url', 'member'), [
+    ('bat://images/%s-piechart.png' % SHA,        'images/%s-piechart.png' % SHA),
+    ('bat://reports/x.html.gz',                   'reports/x.html.gz'),
+    ## the pictures of a report, relative to the page
+    ('file:///tmp/html/REPLACEME/%s.png' % SHA,   'images/%s.png' % SHA),
+    ('qrc:/REPLACEME/a.png',                      'images/a.png'),
+    ('file:///tmp/html/images/a.png',             None),
+    ('http://example.com/REPLACEME',              None),
+    ('bat://images/../scandata.pickle',           None),
+    ('file:///tmp/REPLACEME/../a.png',            None),
+])
+def test_memberForUrl(url, member):
+    assert memberForUrl(QUrl(url)) == member
+
+
+class Signal:
+    def __init__(self):
+        self.calls = []
+
+    def emit(self, *args):
+        self.calls.append(args)
+
+
+class Reply:
+    def __init__(self):
+        self.opened    = Signal()
+        self.chunkRead = Signal()
+        self.done      = Signal()
+        self.aborted   = False
+
+
+def test_MemberReader(tmpdir):
+    picture = ''.join(chr(n % 251) for n in xrange(3 * READ_CHUNKSIZE + 10))
+    path = str(tmpdir.join('result.tar.gz'))
+    writeArchive(path, {'images/%s.png' % SHA: picture}, 'w:gz')
+    archive = BATArchive(path, str(tmpdir.join('extract')))
+    try:
+        reply = Reply()
+        MemberReader(reply, archive, 'images/%s.png' % SHA).run()
+        assert reply.opened.calls == [(len(picture),)]
+        assert len(reply.chunkRead.calls) == 4
+        assert ''.join(data for (data,) in reply.chunkRead.calls) == picture
+        assert reply.done.calls == [()]
+
+        reply = Reply()
+        MemberReader(reply, archive, 'images/missing.png').run()
+        assert reply.opened.calls == [(None,)]
+        assert reply.chunkRead.calls == [] and reply.done.calls == []
+    finally:
+        archive.close()
+
+    reply = Reply()
+    MemberReader(reply, None, 'images/%s.png' % SHA).run()
+    assert reply.opened.calls == [(None,)]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import pytest
+from batsearch import SearchIndex
+
+
+def makeIndex(layout, arrayModel):
+    model = arrayModel(layout)
+    return (model, SearchIndex(model, layout.magics, layout.magicids, layout.checksums))
+
+
+def found(layout, m):
+    return sorted(layout.paths[i] for i in range(len(layout)) if m[i])
+
+
+def bruteForce(layout, text):
+    """
+    The nodes that a plain query matches: a name on their path, their
+    link target or their file type.
+    """
+    hits = set()
+    for i in range(len(layout)):
+        components = layout.paths[i].lower().split('/')
+        if any(text in c for c in components):
+            hits.add(layout.paths[i])
+        if text in layout.linknames.get(i, '').lower():
+            hits.add(layout.paths[i])
+        if layout.magicids[i] > 0 and text in layout.magics[layout.magicids[i]].lower():
+            hits.add(layout.paths[i])
+    return sorted(hits)
+
+
+@pytest.mark.parametrize('text', ['bin', 'libc', 'c', 'so', 'elf', 'busybox', 'caf\xc3\xa9', 'zzz'])
+def test_plain_query_matches_brute_force(layout, arrayModel, text):
+    (model, index) = makeIndex(layout, arrayModel)
+    assert found(layout, index.search(text)) == bruteForce(layout, text)
+
+
+def test_empty_query(layout, arrayModel):
+    (model, index) = makeIndex(layout, arrayModel)
+    assert index.search('  ') is None
+
+
+def test_prefix_and_path(layout, arrayModel):
+    (model, index) = makeIndex(layout, arrayModel)
+    assert found(layout, index.search('lib*')) == ['lib', 'lib/copy', 'lib/copy/libc.so', 'lib/libc.so']
+    assert found(layout, index.search('path:init.d/r')) == ['etc/init.d/rcS']
+    assert found(layout, index.search('copy/')) == ['lib/copy/libc.so']
+
+
+def test_checksum(layout, arrayModel):
+    (model, index) = makeIndex(layout, arrayModel)
+    assert found(layout, index.search('d' * 64)) == ['lib/copy/libc.so', 'lib/libc.so']
+    assert found(layout, index.search('sha256:AA')) == ['bin/busybox']
+
+
+def test_regexp(layout, arrayModel):
+    (model, index) = makeIndex(layout, arrayModel)
+    assert found(layout, index.search('re:^rc')) == ['etc/init.d/rcS']
+    ## not a valid expression, searched for literally
+    assert found(layout, index.search('re:[')) == []
+
+
+@pytest.mark.parametrize('query', [u'conf', u'caf\xe9', u'b*', u'caf\xe9*', u'etc/caf\xe9',
+                                   u're:caf\xe9', u'path:caf\xe9.conf'])
+def test_unicode_query_on_non_ascii_names(layout, arrayModel, query):
+    (model, index) = makeIndex(layout, arrayModel)
+    m = index.search(query)
+    if query == u'b*':
+        assert found(layout, m) == ['bin', 'bin/busybox', 'bin/sh']
+    else:
+        assert 'etc/caf\xc3\xa9.conf' in found(layout, m)
+
+
+def test_longer_query_reuses_substring_hits(layout, arrayModel):
+    (model, index) = makeIndex(layout, arrayModel)
+    assert found(layout, index.search(u'li')) == bruteForce(layout, 'li')
+    assert found(layout, index.search(u'lib')) == bruteForce(layout, 'lib')
+    assert found(layout, index.search(u'caf\xe9')) == bruteForce(layout, 'caf\xc3\xa9')
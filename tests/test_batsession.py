@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os
+import pytest
+import batsession
+from battree import buildTree
+from conftest import REPORTS
+
+
+@pytest.fixture
+def archive(tmpdir):
+    path = tmpdir.join('scan.tar.gz')
+    path.write('not really an archive')
+    return str(path)
+
+
+def test_roundtrip(layout, arrayModel, archive, tmpdir):
+    assert batsession.openSession(archive) is None
+    assert batsession.writeSession(archive, layout) == batsession.sessionPath(archive)
+    session = batsession.openSession(archive)
+    assert session is not None
+    assert len(session) == len(layout)
+    assert session.toplevelcount == layout.toplevelcount
+    for name in ('parents', 'childstart', 'childcount', 'maskbits', 'isdir',
+                 'tagcomboids', 'sizes', 'magicids'):
+        assert list(getattr(session, name)) == list(getattr(layout, name)), name
+    assert [session.paths[i] for i in range(len(session))] == layout.paths
+    assert session.names[:] == layout.names
+    assert session.tagcombos == layout.tagcombos
+    assert list(session.magics) == list(layout.magics)
+    assert session.linknames == layout.linknames
+    assert dict(session.checksums.iteritems()) == layout.checksums
+    ## the names the model gets are the ones a fresh build gives it
+    assert session.nametable == arrayModel(layout).names
+    assert session.lnames == [n.lower() for n in session.nametable]
+    assert [session.lnames[n] for n in session.prefixorder] == sorted(session.lnames)
+
+
+def test_unicode_names_are_stored_as_utf8(archive):
+    layout = buildTree((p.decode('utf-8'), r) for (p, r) in REPORTS)
+    batsession.writeSession(archive, layout)
+    session = batsession.openSession(archive)
+    assert 'caf\xc3\xa9.conf' in session.nametable
+    assert all(isinstance(n, str) for n in session.nametable)
+
+
+def test_rewrite_from_session(layout, archive):
+    batsession.writeSession(archive, layout)
+    session = batsession.openSession(archive)
+    os.remove(batsession.sessionPath(archive))
+    batsession.writeSession(archive, session)
+    again = batsession.openSession(archive)
+    assert list(again.nameids) == list(session.nameids)
+    assert again.nametable == session.nametable
+
+
+def test_other_archive_or_damaged_file(layout, archive):
+    sessionpath = batsession.writeSession(archive, layout)
+    assert batsession.loadSession(sessionpath, 'f' * 64) is None
+    data = open(sessionpath, 'rb').read()
+    for size in (0, 10, batsession.HEADER.size + 5, len(data) // 2, len(data) - 1):
+        open(sessionpath, 'wb').write(data[:size])
+        assert batsession.openSession(archive) is None
+
+    ## a changed archive has another key
+    batsession.writeSession(archive, layout)
+    open(archive, 'ab').write('more')
+    assert batsession.openSession(archive) is None
+
+
+def test_fallback_directory(layout, archive, tmpdir, monkeypatch):
+    monkeypatch.setattr(batsession, 'sessionPath', lambda a: '/proc/no/such/dir/x.session')
+    sessiondir = str(tmpdir.join('sessions'))
+    sessionpath = batsession.writeSession(archive, layout, sessiondir)
+    assert os.path.dirname(sessionpath) == sessiondir
+    assert batsession.openSession(archive) is None
+    assert len(batsession.openSession(archive, sessiondir)) == len(layout)
+
+
+def test_names_with_nul_are_not_written(archive):
+    layout = buildTree([('a\0b', {'size': 1})])
+    assert batsession.writeSession(archive, layout) is None
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os, bz2, gzip, shutil
+import pytest
+
+from batsource import SourceCache, sourceCandidates, fileChecksum, COMPRESSEDEXTENSIONS
+
+HTML = '<html><pre>\n' + ''.join(['<a name="line%d"></a>line %d\n' % (n, n) for n in xrange(1, 101)]) \
+       + '</pre></html>\n'
+
+
+def writeSource(path):
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'wb')
+    elif path.endswith('.bz2'):
+        f = bz2.BZ2File(path, 'w')
+    else:
+        f = open(path, 'wb')
+    f.write(HTML)
+    f.close()
+
+
+def test_sourceCandidates():
+    assert sourceCandidates('a/abc.html.gz') == ['a/abc.html.gz']
+    assert sourceCandidates('a/abc.html') == ['a/abc.html' + ext for ext in COMPRESSEDEXTENSIONS] \
+                                             + ['a/abc.html']
+
+
+@pytest.mark.parametrize('ext', ['.bz2', '.gz', ''])
+def test_SourceCache(tmpdir, ext):
+    path = str(tmpdir.join('abc.html'))
+    writeSource(path + ext)
+    found = [p for p in sourceCandidates(path) if os.path.exists(p)]
+    assert found == [path + ext]
+    sources = SourceCache(str(tmpdir.join('sources')))
+    (first, end, last, html) = sources.anchorWindow(found[0], 50, 2, 5)
+    assert (first, end) == (48, 53)
+    assert html.startswith('<html><pre>\n<a name="line48"></a>line 48\n')
+    assert html.endswith('line 52\n</pre></html>\n')
+    ## the next window comes from the decompressed copy, without the tags
+    ## around the source
+    (first, end, last, html) = sources.window(found[0], end, 1000, False)
+    assert (first, end, last) == (53, 101, 101)
+    assert html.startswith('<a name="line53"></a>line 53\n')
+    assert html.endswith('line 100\n')
+    sources.close()
+
+
+def test_SourceCache_shared(tmpdir):
+    ## the copies are kept by the checksum of the compressed file, for every
+    ## archive and session
+    cachedir = str(tmpdir.join('sources'))
+    first = str(tmpdir.join('one', 'abc.html.gz'))
+    os.makedirs(os.path.dirname(first))
+    writeSource(first)
+    sources = SourceCache(cachedir)
+    expected = sources.window(first, 0, 10)
+    cached = sources.cachedPath(first)
+    key = fileChecksum(first)
+    assert cached == os.path.join(cachedir, key[:2], key + '.html')
+    sources.close()
+
+    ## another path (not ASCII) of the same file, after the archive was
+    ## closed, uses the same copy
+    other = os.path.join(str(tmpdir), u'caf\xe9', u'abc.html.gz')
+    os.makedirs(os.path.dirname(other).encode('utf-8'))
+    shutil.copyfile(first, other.encode('utf-8'))
+    mtime = os.stat(cached).st_mtime
+    os.utime(cached, (mtime - 100, mtime - 100))
+    sources = SourceCache(cachedir)
+    assert sources.cachedPath(other) == cached
+    assert sources.window(other, 0, 10) == expected
+    assert os.stat(cached).st_mtime > mtime - 100
+    sources.close()
+
+
+def test_SourceCache_maxbytes(tmpdir):
+    cachedir = str(tmpdir.join('sources'))
+    sources = SourceCache(cachedir, maxfiles = 1, maxbytes = 2 * len(HTML) + 30)
+    paths = []
+    for n in xrange(4):
+        path = str(tmpdir.join('%d.html' % n))
+        f = open(path, 'wb')
+        f.write(HTML + '<!-- %d -->\n' % n)
+        f.close()
+        paths.append(path)
+        sources.window(path, 0, 1)
+        os.utime(sources.cachedPath(path), (n, n))
+    ## the least recently used copies were removed
+    assert [os.path.exists(sources.cachedPath(p)) for p in paths] == [False, False, True, True]
+    assert sources.size <= sources.maxbytes
+    sources.close()
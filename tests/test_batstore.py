@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os, sqlite3, cPickle
+import pytest
+
+import batstore
+from batstore import ScanStore, convert, isValidCache, archiveStamp, cachePath
+
+UNPACKREPORTS = {
+    'bin/busybox': {'name': 'busybox', 'realpath': '/tmp/x/bin', 'magic': 'ELF 32-bit LSB executable',
+                    'checksum': 'a' * 64, 'size': 1000, 'tags': ['elf', 'binary'],
+                    'scans': [{'offset': 10, 'scanname': 'gzip', 'size': 100}],
+                    'elfreport': {'needed': ['libc.so']}},
+    'bin/sh':      {'name': 'sh', 'realpath': '/tmp/x/bin', 'magic': "symbolic link to `busybox'",
+                    'size': 0, 'tags': ['symlink']},
+    'etc/empty':   {'name': 'empty', 'tags': [], 'size': 0, 'checksum': None, 'note': None},
+}
+
+
+class PicklePath:
+    """
+    picklepath() for ScanStore.open, which writes UNPACKREPORTS and counts
+    how often it is called.
+    """
+    def __init__(self, tmpdir):
+        self.path = str(tmpdir.join('scandata.pickle'))
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        f = open(self.path, 'wb')
+        cPickle.dump(UNPACKREPORTS, f, 2)
+        f.close()
+        return self.path
+
+
+@pytest.fixture
+def archive(tmpdir):
+    path = str(tmpdir.mkdir('archives').join('scan.tar.gz'))
+    open(path, 'wb').write('not really an archive')
+    return path
+
+
+def test_convert(tmpdir):
+    dbpath = str(tmpdir.join('scan.sqlite'))
+    calls = []
+    convert(UNPACKREPORTS, dbpath, '1:2', lambda done, total: calls.append((done, total)))
+    assert calls == [(0, 3)]
+    assert not os.path.exists(dbpath + '.tmp')
+    store = ScanStore(dbpath)
+    assert len(store) == 3
+    ## every report comes back as it was, also the fields without their
+    ## own column and the ones that are None
+    for (path, report) in UNPACKREPORTS.iteritems():
+        assert store.get(path) == report
+    assert store.get('missing') is None
+    assert store.checksum('bin/busybox') == 'a' * 64
+    assert store.checksum('bin/sh') == store.checksum('missing') == ''
+    assert store.size('bin/busybox') == 1000
+    assert store.size('missing') == -1
+    assert store.scans('bin/busybox') == [{'offset': 10, 'scanname': 'gzip', 'size': 100}]
+    assert store.scans('bin/sh') is None
+    assert sorted(store.iterChecksums()) == [('bin/busybox', 'a' * 64), ('bin/sh', None),
+                                             ('etc/empty', None)]
+    assert dict(store.iterTreeReports())['bin/busybox'] == \
+           {'tags': ['elf', 'binary'], 'size': 1000, 'magic': 'ELF 32-bit LSB executable',
+            'checksum': 'a' * 64}
+    store.close()
+
+
+class Stop(Exception):
+    pass
+
+
+def test_convert_interrupted(tmpdir):
+    dbpath = str(tmpdir.join('scan.sqlite'))
+    def progress(done, total):
+        raise Stop()
+    with pytest.raises(Stop):
+        convert(UNPACKREPORTS, dbpath, '1:2', progress)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_isValidCache(tmpdir):
+    dbpath = str(tmpdir.join('scan.sqlite'))
+    assert not isValidCache(dbpath, '1:2')
+    convert(UNPACKREPORTS, dbpath, '1:2')
+    assert isValidCache(dbpath, '1:2')
+    ## another archive, or the same one written again
+    assert not isValidCache(dbpath, '1:3')
+    db = sqlite3.connect(dbpath)
+    db.execute("UPDATE meta SET value = ? WHERE key = 'version'", (str(batstore.SCHEMA_VERSION + 1),))
+    db.commit()
+    db.close()
+    assert not isValidCache(dbpath, '1:2')
+    open(dbpath, 'wb').write('not a database' * 100)
+    assert not isValidCache(dbpath, '1:2')
+
+
+def test_open(archive, tmpdir):
+    picklepath = PicklePath(tmpdir)
+    store = ScanStore.open(archive, picklepath, str(tmpdir))
+    assert store.dbpath == cachePath(archive)
+    assert store.get('bin/busybox') == UNPACKREPORTS['bin/busybox']
+    store.close()
+    ## the cache is used the next time
+    store = ScanStore.open(archive, picklepath, str(tmpdir))
+    assert picklepath.calls == 1
+    store.close()
+    ## the archive changed, the cache is stale
+    st = os.stat(archive)
+    os.utime(archive, (st.st_atime, st.st_mtime - 100))
+    assert not isValidCache(cachePath(archive), archiveStamp(archive))
+    store = ScanStore.open(archive, picklepath, str(tmpdir))
+    assert picklepath.calls == 2
+    assert isValidCache(store.dbpath, archiveStamp(archive))
+    store.close()
+
+
+def test_open_nocache(archive, tmpdir):
+    picklepath = PicklePath(tmpdir)
+    fallbackdir = str(tmpdir.mkdir('extract'))
+    store = ScanStore.open(archive, picklepath, fallbackdir, writecache = False)
+    ## nothing is written next to the archive
+    assert store.dbpath == os.path.join(fallbackdir, 'scandata.sqlite')
+    assert os.listdir(os.path.dirname(archive)) == ['scan.tar.gz']
+    assert store.get('etc/empty') == UNPACKREPORTS['etc/empty']
+    store.close()
+    ## a cache next to the archive is still used
+    store = ScanStore.open(archive, picklepath, None)
+    store.close()
+    store = ScanStore.open(archive, picklepath, fallbackdir, writecache = False)
+    assert store.dbpath == cachePath(archive)
+    assert picklepath.calls == 2
+    store.close()
+    ## without a place to write it
+    os.unlink(cachePath(archive))
+    with pytest.raises(IOError):
+        ScanStore.open(archive, picklepath, None, writecache = False)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import json, threading
+import pytest
+
+import battrace
+from battrace import Tracer, traced
+
+
+@traced("square")
+def square(x):
+    """Square of x."""
+    return x * x
+
+
+@traced("broken")
+def broken():
+    raise ValueError("broken")
+
+
+@pytest.fixture
+def tracing(tmpdir, monkeypatch):
+    ## on for this test only, without writing the files at exit
+    t = Tracer(str(tmpdir.join('summary.json')), str(tmpdir.join('events.json')))
+    monkeypatch.setattr(battrace, 'tracer', t)
+    return t
+
+
+def test_off(monkeypatch):
+    monkeypatch.setattr(battrace, 'tracer', None)
+    assert not battrace.enabled()
+    assert square(3) == 9
+    battrace.count("rows")
+    battrace.log("nothing", 1)
+    assert square.__name__ == 'square' and square.__doc__ == "Square of x."
+
+
+def test_histogram():
+    t = Tracer()
+    for seconds in (0, 0.5e-6, 1.5e-6, 3e-6, 3.9e-6, 1000e-6, 1e-3 + 1e-6):
+        t.add("call", t.start, seconds)
+    latency = t.summary()['latencies']['call']
+    assert latency['count'] == 7
+    assert latency['max'] == 1e-3 + 1e-6
+    assert abs(latency['mean'] - latency['total'] / 7) < 1e-12
+    ## a bucket per power of two microseconds, by the lowest time in it
+    assert latency['histogram'] == [[0, 2], [1, 1], [2, 2], [512, 2]]
+    ## no events unless there is a file for them
+    assert t.events == []
+
+
+def test_traced(tracing):
+    assert battrace.enabled()
+    for x in xrange(5):
+        assert square(x) == x * x
+    with pytest.raises(ValueError):
+        broken()
+    battrace.since("startup", tracing.start)
+    summary = tracing.summary()
+    assert sorted(summary['latencies']) == ['broken', 'square', 'startup']
+    assert summary['latencies']['square']['count'] == 5
+    assert summary['latencies']['broken']['count'] == 1
+    assert sum(n for (lowest, n) in summary['latencies']['square']['histogram']) == 5
+
+
+def test_counters(tracing):
+    battrace.count("rows")
+    battrace.count("rows", 10)
+    battrace.setCounter("hits", 3)
+    battrace.setCounter("hits", 4)
+    ## from more than one thread at a time
+    def counting():
+        for n in xrange(1000):
+            battrace.count("threads")
+    threads = [threading.Thread(target = counting) for n in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tracing.summary()['counters'] == {'rows': 11, 'hits': 4, 'threads': 4000}
+
+
+def test_dump(tracing, tmpdir):
+    square(2)
+    battrace.count("rows", 2)
+    battrace.log("opened", u'caf\xe9', 3)
+    battrace.log("x" * 300)
+    battrace.dump()
+    summary = json.load(open(tracing.summarypath))
+    assert summary['latencies']['square']['count'] == 1
+    assert summary['counters'] == {'rows': 2}
+    assert summary['droppedevents'] == 0
+    ## the Chrome trace: a complete event for the call, instant events for
+    ## the messages
+    events = json.load(open(tracing.eventspath))['traceEvents']
+    assert [(e['name'], e['ph']) for e in events] == [('square', 'X'), (u'opened caf\xe9 3', 'i'),
+                                                      ('x' * 200, 'i')]
+    for e in events:
+        assert e['ts'] >= 0 and e.has_key('pid') and e.has_key('tid')
+    assert events[0]['dur'] >= 0
+
+
+def test_maxevents(tracing, monkeypatch):
+    monkeypatch.setattr(battrace, 'MAXEVENTS', 3)
+    for x in xrange(5):
+        square(x)
+    assert len(tracing.events) == 3
+    summary = tracing.summary()
+    assert summary['droppedevents'] == 2
+    assert summary['latencies']['square']['count'] == 5
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import os, random
+from array import array
+import numpy
+import pytest
+
+from conftest import REPORTS, report
+from battree import buildTree, iterBuildTree, treeLevels, TagColumns, TreeVisibility, \
+                    MASK_DIRECTORY, MASK_EMPTY, PROGRESSINTERVAL
+
+TAGS = ['elf', 'text', 'graphics', 'duplicate']
+## tags of a few nodes, filtering them changes few enough nodes to be
+## followed up the parents
+RARETAGS = ['rare0', 'rare1', 'rare2']
+
+
+def randomReports(n, seed = 0):
+    rnd = random.Random(seed)
+    reports = []
+    for i in xrange(n):
+        depth = rnd.randint(0, 4)
+        path = '/'.join(['d%d' % rnd.randint(0, 3) for j in xrange(depth)] + ['f%d' % i])
+        tags = rnd.sample(TAGS, rnd.randint(0, 2))
+        if rnd.random() < 0.005:
+            tags.append(rnd.choice(RARETAGS))
+        reports.append((path, report(tags, rnd.choice([0, 1, 100]))))
+    return reports
+
+
+def checkShape(layout):
+    for i in xrange(len(layout)):
+        kids = layout.children(i)
+        assert list(kids) == range(layout.childstart[i], layout.childstart[i] + layout.childcount[i])
+        for c in kids:
+            assert layout.parents[c] == i
+            assert layout.paths[c] == layout.paths[i] + '/' + layout.names[c]
+        ## directories first, both sorted by name
+        order = [(not layout.isdir[c], layout.names[c]) for c in kids]
+        assert order == sorted(order)
+
+
+def test_buildTree(layout):
+    checkShape(layout)
+    assert sorted(p for (p, d) in zip(layout.paths, layout.isdir) if not d) == \
+           sorted(p for (p, r) in REPORTS)
+    assert [layout.paths[i] for i in xrange(layout.toplevelcount)] == ['bin', 'etc', 'lib', 'usr']
+    i = layout.paths.index('bin/sh')
+    assert layout.linknames == {i: 'busybox'}
+    assert layout.maskbits[i] == MASK_EMPTY
+    assert layout.maskbits[layout.paths.index('lib')] == MASK_DIRECTORY
+    assert sorted(layout.checksums['d' * 64]) == [layout.paths.index('lib/libc.so'),
+                                                  layout.paths.index('lib/copy/libc.so')]
+
+
+def test_buildTree_random():
+    reports = randomReports(2000)
+    layout = buildTree(iter(reports))
+    checkShape(layout)
+    files = [i for i in xrange(len(layout)) if not layout.isdir[i]]
+    assert sorted(layout.paths[i] for i in files) == sorted(p for (p, r) in reports)
+
+
+def test_buildTree_paths():
+    ## other spellings of the same path give one node
+    layout = buildTree(iter([('/a/b', report()), ('a/b/x', report()), ('a//c/d', report()),
+                             ('a/./e', report()), ('m/n/', report())]))
+    checkShape(layout)
+    assert sorted(layout.paths) == ['a', 'a/b', 'a/b/x', 'a/c', 'a/c/d', 'a/e', 'm', 'm/n']
+    ## a file that is also a directory keeps its data and children
+    b = layout.paths.index('a/b')
+    assert layout.isdir[b] and layout.sizes[b] == 1 and layout.childcount[b] == 1
+
+
+def test_iterBuildTree_levels():
+    reports = randomReports(500, 1)
+    complete = buildTree(iter(reports))
+    levels = treeLevels(numpy.array(complete.parents), numpy.array(complete.childstart),
+                        numpy.array(complete.childcount))
+    seen = []
+    for (layout, end) in iterBuildTree(iter(reports)):
+        ## every level comes on its own, and the nodes that are there
+        ## already do not change anymore
+        assert ((seen or [0])[-1], end) == levels[len(seen)]
+        assert layout.paths[:end] == complete.paths[:end]
+        assert layout.childstart[:end] == complete.childstart[:end]
+        seen.append(end)
+    assert len(seen) == len(levels)
+
+
+class Cancelled(Exception):
+    pass
+
+
+def test_iterBuildTree_progress():
+    reports = randomReports(3 * PROGRESSINTERVAL, 2)
+    calls = []
+    def progress(n):
+        calls.append(n)
+        if len(calls) > 3:
+            raise Cancelled()
+    levels = iterBuildTree(iter(reports), progress)
+    with pytest.raises(Cancelled):
+        levels.next()
+    ## the reports were read, the build stopped while numbering
+    assert calls == [0, PROGRESSINTERVAL, 2 * PROGRESSINTERVAL, len(reports)]
+
+
+def test_iterBuildTree_empty():
+    assert list(iterBuildTree(iter([]))) == []
+    assert len(buildTree(iter([]))) == 0
+
+
+def test_TagColumns(layout):
+    columns = TagColumns(layout.tagcomboids, layout.tagcombos, layout.sizes, ['png'])
+    assert columns.tagbits['png'] == 0
+    hidden = columns.hidden(['elf', 'empty'])
+    assert sorted(layout.paths[i] for i in numpy.flatnonzero(hidden)) == \
+           ['bin/busybox', 'bin/sh', 'etc/empty', 'lib/copy/libc.so', 'lib/libc.so']
+    extracopy = numpy.zeros(len(layout), dtype=bool)
+    extracopy[layout.paths.index('lib/copy/libc.so')] = True
+    columns = TagColumns(layout.tagcomboids, layout.tagcombos, layout.sizes, extracopy = extracopy)
+    assert (columns.hidden(['extracopy']) == extracopy).all()
+
+
+def visibility(layout):
+    columns = TagColumns(layout.tagcomboids, layout.tagcombos, layout.sizes)
+    return TreeVisibility(array('i', layout.parents), array('i', layout.childstart),
+                          array('i', layout.childcount), columns)
+
+
+def test_TreeVisibility(layout):
+    visible = visibility(layout)
+    assert visible.accepted.all()
+    visible.setFilters(['elf'], True)
+    shown = set(layout.paths[i] for i in numpy.flatnonzero(visible.accepted))
+    assert 'lib' not in shown and 'bin/sh' in shown and 'bin' in shown
+    findok = numpy.array([p.startswith('usr') for p in layout.paths])
+    visible.setFind(findok, True)
+    assert set(layout.paths[i] for i in numpy.flatnonzero(visible.accepted)) == \
+           set(['usr', 'usr/share', 'usr/share/logo.png'])
+    assert [layout.paths[i] for i in visible.expandNodes(1, 10)] == ['usr', 'usr/share']
+
+
+@pytest.mark.parametrize('removeEmpty', [False, True])
+def test_TreeVisibility_incremental(removeEmpty):
+    ## small changes are followed up the parents, the result has to be the
+    ## same as recomputing the whole tree
+    layout = buildTree(iter(randomReports(3000, 3)))
+    visible = visibility(layout)
+    visible.setFilters([], removeEmpty)
+    rnd = random.Random(4)
+    filters = set()
+    for step in xrange(30):
+        filters.symmetric_difference_update([rnd.choice(RARETAGS + ['elf'])])
+        old = visible.accepted.copy()
+        changed = visible.setFilters(filters, removeEmpty)
+        fresh = visibility(layout)
+        fresh.setFilters(filters, removeEmpty)
+        assert (visible.accepted == fresh.accepted).all()
+        assert (visible.count == fresh.count).all()
+        assert sorted(changed) == numpy.flatnonzero(old != visible.accepted).tolist()
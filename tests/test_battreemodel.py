@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+## Binary Analysis Tool
+## Licensed under Apache 2.0, see LICENSE file for details
+##
+
+import pytest
+
+pytest.importorskip('PyQt5.QtCore')
+from battreemodel import BATTreeModel
+
+
+@pytest.fixture
+def model(layout):
+    model = BATTreeModel()
+    model.setLayout(layout)
+    return model
+
+
+def test_find_every_path(layout, model):
+    for i in range(len(layout)):
+        assert model.findNode(layout.paths[i]) == i
+        assert model.nodePath(i) == layout.paths[i]
+    assert model.findNode('etc/missing') == -1
+    assert model.findNode('bin/busybox/x') == -1
+
+
+def test_non_ascii_path(layout, model):
+    node = layout.paths.index('etc/caf\xc3\xa9.conf')
+    assert model.findNode(u'etc/caf\xe9.conf') == node
+    assert model.findNode('etc/caf\xc3\xa9.conf') == node
+    assert model.findChild(model.findNode(u'etc'), u'caf\xe9.conf') == node
+    assert model.findNode(u'etc/caf\xe9') == -1
+
+
+def test_unicode_layout_names(layout, model):
+    ## a layout with unicode names gives the same byte string names
+    other = BATTreeModel()
+    layout.names = [n.decode('utf-8') for n in layout.names]
+    other.setLayout(layout)
+    assert other.names == model.names
+    assert all(isinstance(n, str) for n in other.names)